@@ -4,14 +4,44 @@ AL Drones - Flight Area Analysis Tool
 
 import streamlit as st
 import os
-import tempfile
+import time
+import uuid
 from pathlib import Path
 import geopandas as gpd
+import numpy as np
 import pandas as pd
 
 # Import from src folder
 from src import generate_safety_margins as gsm
 from src import population_analysis as pa
+from src import map_output as mo
+from src import jobs
+from src import results_store as rs
+from src import web_map as wm
+from src.kml_io import read_altitude_modes
+
+# Page sizes of the GRB cell table (rows copied from its stored file per rerun)
+TAMANHOS_PAGINA = [50, 100, 250, 500]
+
+# Filters of the GRB cell table: minimum density (hab/km²) or None
+FILTROS_DENSIDADE = {
+    "Todas as células": None,
+    "Somente > 0 hab/km²": 0,
+    "Somente > 5 hab/km²": 5
+}
+
+# Orders of the GRB cell table: (presorted index, ascending)
+ORDENS_CELULAS = {
+    "Densidade (maior → menor)": ('densidade', False),
+    "Densidade (menor → maior)": ('densidade', True),
+    "População (maior → menor)": ('populacao', False),
+    "População (menor → maior)": ('populacao', True)
+}
+
+DESTAQUE_CRITICO = 'background-color: rgba(255, 0, 0, 0.15)'
+
+# ZIP with every download of an analysis
+NOME_PACOTE = 'aldrones_resultados.zip'
 
 
 # Page configuration
@@ -325,6 +355,293 @@ def create_header():
     """, unsafe_allow_html=True)
 
 
+@st.cache_resource(show_spinner="Carregando índice de quadrantes IBGE...")
+def indice_quadrantes():
+    """
+    IBGE quadrant index, loaded once for the whole server process.
+    
+    The quadrant grids are cached the same way inside population_analysis
+    (one copy per process, concurrent first loads coalesced).
+    """
+    indice = pa.carregar_indice_quadrantes()
+    if indice is None:
+        # Raising keeps a failed download out of the resource cache
+        raise RuntimeError("Não foi possível carregar o índice de quadrantes IBGE")
+    return indice
+
+
+def executar_analise(upload_id, parametros, sessao, progresso):
+    """
+    Background job (see src.jobs): safety margins, then population analysis.
+    
+    The files go to a result folder of the session in the results store,
+    pinned until every map has been rendered (see src.results_store). The
+    cell tables are spilled there as well, so the published results only
+    hold handles to them (see guardar_tabelas). Publishes the results as
+    soon as the statistics are ready.
+    """
+    # Resolved first: this also marks the upload as recently used
+    input_kml_path = rs.arquivo_resultado(upload_id, 'input.kml')
+    result_id, analysis_output_dir = rs.criar_resultado(sessao)
+    try:
+        progresso(0.02, "📍 Gerando margens de segurança...")
+        # Layers stay in memory; the KML is only written on download
+        safety_layers = gsm.generate_safety_margins(
+            input_kml_path=input_kml_path,
+            return_layers=True,
+            **parametros
+        )
+        
+        progresso(0.1, "📊 Analisando densidade populacional...")
+        results = pa.analyze_population(
+            safety_layers, analysis_output_dir, wait_maps=False,
+            progresso=lambda fracao, mensagem: progresso(0.1 + 0.9 * fracao, f"📊 {mensagem}")
+        )
+        if results:
+            guardar_tabelas(result_id, results)
+    except BaseException:
+        rs.remover_resultado(result_id)
+        raise
+    if not results:
+        rs.remover_resultado(result_id)
+        return None
+    
+    # Published snapshots hold plain data only (no futures): sessions keep
+    # them in st.session_state while the maps render
+    analise = {
+        'stats': {
+            layer: {k: v for k, v in stats.items() if k != 'map_future'}
+            for layer, stats in results.items()
+        },
+        'output_dir': analysis_output_dir,
+        'result_id': result_id,
+        'safety_layers': safety_layers,
+        # Layers with a map on the way; their info lands in 'maps' (or the
+        # error in 'map_errors')
+        'maps_expected': [layer for layer, stats in results.items() if 'map_future' in stats],
+        'maps': {},
+        'map_errors': {},
+        'complete': False
+    }
+    progresso(0.1, "🗺️ Gerando mapas...", resultado=analise)
+    try:
+        for layer in analise['maps_expected']:
+            maps, erros = dict(analise['maps']), dict(analise['map_errors'])
+            try:
+                maps[layer] = results[layer]['map_future'].result()
+            except Exception as e:
+                # Reported in the maps section
+                erros[layer] = str(e)
+            analise = {**analise, 'maps': maps, 'map_errors': erros}
+            progresso(0.1, f"🗺️ Mapa {layer} pronto", resultado=analise)
+        
+        progresso(0.95, "📦 Preparando downloads...")
+        try:
+            analise = {**analise, 'downloads': preparar_downloads(result_id, analise)}
+        except Exception as e:
+            print(f"✗ Error preparing downloads: {e}")
+            analise = {**analise, 'downloads': {}, 'downloads_error': str(e)}
+    finally:
+        rs.liberar_resultado(result_id)
+    return {**analise, 'complete': True}
+
+
+def acompanhar_analise(analise, pronto):
+    """
+    Latest snapshot of an analysis published before its maps and downloads,
+    polling its job until `pronto(snapshot)` holds or the job has ended.
+    The session keeps the latest snapshot.
+    """
+    job_id = st.session_state.get('job_id')
+    while not analise['complete'] and not pronto(analise):
+        job = jobs.estado_job(job_id) if job_id else None
+        if job is None or job['status'] == 'error':
+            erro = job['error'] if job else "a análise não está mais em execução"
+            analise = {**analise, 'downloads': {}, 'downloads_error': erro, 'complete': True}
+        else:
+            analise = job['result'] if job['status'] == 'done' else job['partial']
+            if not analise['complete'] and not pronto(analise):
+                time.sleep(0.3)
+        st.session_state['analysis_results'] = analise
+    return analise
+
+
+def ordenar_celulas(detailed_cells):
+    """
+    Presorted row positions of the GRB cell table, by density and by
+    population (descending; read backwards for ascending order).
+    """
+    return pd.DataFrame({
+        coluna: np.argsort(-detailed_cells[origem].to_numpy(), kind='stable').astype(np.int32)
+        for coluna, origem in (('densidade', 'Densidade_hab_km2'), ('populacao', 'Populacao'))
+    })
+
+
+def guardar_tabelas(result_id, results):
+    """
+    Replace the cell tables of each layer's stats by handles to Arrow files
+    in the results store, keeping session memory independent of the mission
+    size. The UI memory-maps them and copies only what it shows; the GRB
+    table gets its sort orders computed once here ('detailed_cells_order').
+    The interactive map cells are registered with the tile endpoint here as
+    well, their layer id kept in the handle (see camada_mapa).
+    """
+    for layer, stats in results.items():
+        slug = layer.lower().replace(' ', '_')
+        detailed_cells = stats.get('detailed_cells')
+        if isinstance(detailed_cells, pd.DataFrame) and not detailed_cells.empty:
+            stats['detailed_cells_order'] = rs.salvar_tabela(
+                result_id, f"detailed_cells_order_{slug}.arrow", ordenar_celulas(detailed_cells)
+            )
+        for chave in ('detailed_cells', 'cells'):
+            if isinstance(stats.get(chave), pd.DataFrame):
+                tabela = stats[chave]
+                stats[chave] = rs.salvar_tabela(result_id, f"{chave}_{slug}.arrow", tabela)
+                if chave == 'cells':
+                    stats[chave]['layer_id'] = wm.registrar_camada(tabela, pa.ALBERS_BR)
+
+
+def camada_mapa(handle):
+    """
+    Web map layer id of a cells handle (see guardar_tabelas). The table is
+    read back and registered again only if the layer was evicted.
+    """
+    camada_id = handle.get('layer_id')
+    if camada_id is None or not wm.camada_registrada(camada_id):
+        camada_id = wm.registrar_camada(rs.ler_tabela(handle), pa.ALBERS_BR)
+    return camada_id
+
+
+def tabela_estatisticas(results):
+    """Statistics of each analysed layer, as shown and downloaded."""
+    return pd.DataFrame([
+        {
+            'Camada': layer,
+            'População Total': int(stat['total_pessoas']),
+            'Área (km²)': round(stat['area_km2'], 2),
+            'Densidade Média (hab/km²)': round(stat['densidade_media'], 2),
+            'Densidade Máxima (hab/km²)': round(stat['densidade_maxima'], 2)
+        }
+        for layer, stat in results.items()
+    ])
+
+
+def preparar_downloads(result_id, analise):
+    """
+    Serialise every download of a finished analysis once: safety margins
+    KML, maps, full and critical GRB cell CSVs and statistics, plus a ZIP
+    with all of them (see rs.empacotar_resultado). Reruns only read files.
+    
+    Returns:
+        dict: Download name -> file, size, sha256 and mime
+    """
+    results = analise['stats']
+    arquivos = {}
+    
+    rs.arquivo_resultado(
+        result_id, 'safety_margins.kml',
+        gerar=lambda caminho: gsm.write_safety_kml(analise['safety_layers'], caminho)
+    )
+    arquivos['safety_margins.kml'] = 'safety_margins.kml'
+    
+    for info in analise['maps'].values():
+        nome = os.path.basename(info['path'])
+        arquivos[nome] = nome
+    
+    cells_handle = results.get('Ground Risk Buffer', {}).get('detailed_cells')
+    if cells_handle and cells_handle['rows'] > 0:
+        celulas = rs.ler_tabela(cells_handle)
+        # analyze_population already wrote the full table
+        arquivos['celulas_grb_completo.csv'] = 'celulas_grb_detalhadas.csv'
+        rs.arquivo_resultado(
+            result_id, 'celulas_grb_detalhadas.csv',
+            gerar=lambda caminho: celulas.to_csv(caminho, index=False)
+        )
+        criticas = celulas[celulas['Densidade_hab_km2'] > 5]
+        if not criticas.empty:
+            arquivos['celulas_grb_criticas.csv'] = 'celulas_grb_criticas.csv'
+            rs.arquivo_resultado(
+                result_id, 'celulas_grb_criticas.csv',
+                gerar=lambda caminho: criticas.to_csv(caminho, index=False)
+            )
+    
+    arquivos['estatisticas.csv'] = 'estatisticas.csv'
+    rs.arquivo_resultado(
+        result_id, 'estatisticas.csv',
+        gerar=lambda caminho: tabela_estatisticas(results).to_csv(caminho, index=False)
+    )
+    
+    return rs.empacotar_resultado(result_id, arquivos, NOME_PACOTE)
+
+
+def dados_download(analise, nome):
+    """
+    Deferred `st.download_button` data for a prepared download of a
+    complete analysis: the file is only read when clicked.
+    """
+    def ler():
+        entrada = analise['downloads'][nome]
+        caminho = rs.arquivo_resultado(analise['result_id'], entrada['file'])
+        if nome == NOME_PACOTE:
+            # Read per click and dropped afterwards, never kept in the
+            # bytes cache (Streamlit holds the whole payload anyway)
+            with open(caminho, 'rb') as f:
+                return f.read()
+        return mo.ler_bytes(caminho)
+    return ler
+
+
+def guardar_upload(uploaded_file, sessao):
+    """
+    Copy an uploaded KML to the results store.
+    
+    The upload is a result of the session like any other, so it counts
+    against rs.POR_SESSAO: with the default of 3, a session keeps its
+    upload plus its 2 latest analyses (an older upload is evicted like an
+    older analysis, and step 3 then asks for the KML again).
+    
+    Returns:
+        str: ID of the stored upload; the file is 'input.kml' in it
+    """
+    upload_id, pasta = rs.criar_resultado(sessao)
+    with open(os.path.join(pasta, 'input.kml'), 'wb') as f:
+        f.write(uploaded_file.getvalue())
+    rs.liberar_resultado(upload_id)
+    return upload_id
+
+
+def admin_panel():
+    """Cache memory report, shown only when the server sets ALDRONES_ADMIN=1."""
+    if os.environ.get('ALDRONES_ADMIN') != '1':
+        return
+    
+    st.markdown("---")
+    with st.expander("🛠️ Administração - Cache de grades IBGE", expanded=True):
+        relatorio = pa.relatorio_cache()
+        memoria = pa.memoria_processo_mb()
+        col1, col2, col3 = st.columns(3)
+        col1.metric("Quadrantes em cache", int(relatorio['Item'].str.startswith('grade_id').sum()))
+        col2.metric("Memória do cache", f"{relatorio['Memoria_MB'].sum():.0f} MB")
+        col3.metric("Memória do processo", f"{memoria:.0f} MB" if memoria else "n/d")
+        mapeado = relatorio['Mapeado_MB'].sum()
+        if mapeado:
+            st.caption(
+                f"Quadrantes mapeados do disco: {mapeado:.0f} MB, compartilhados entre "
+                f"processos (fora da memória do cache)"
+            )
+        st.dataframe(relatorio, use_container_width=True, hide_index=True)
+        armazenamento = rs.relatorio_resultados()
+        st.caption(
+            f"Resultados armazenados: {armazenamento['results']} "
+            f"({armazenamento['pinned']} em processamento), {armazenamento['size_mb']:.0f} MB "
+            f"de {rs.MAX_MB:.0f} MB"
+        )
+        if st.button("Limpar cache de grades", key='admin_clear_cache'):
+            pa.limpar_cache()
+            indice_quadrantes.clear()
+            st.rerun()
+
+
 def main():
     """Main application."""
     # Header
@@ -337,6 +654,9 @@ def main():
         st.session_state['kml_uploaded'] = False
     if 'parameters_set' not in st.session_state:
         st.session_state['parameters_set'] = False
+    if 'session_id' not in st.session_state:
+        # Owner of this session's results in the results store
+        st.session_state['session_id'] = uuid.uuid4().hex
     
     # Main content
     st.markdown("""
@@ -374,14 +694,15 @@ def main():
                 "Selecione o arquivo KML de entrada",
                 type=['kml'],
                 key='kml_input',
-                on_change=lambda: st.session_state.pop('analysis_results', None)
+                on_change=lambda: [st.session_state.pop(k, None) for k in ('analysis_results', 'job_id', 'analysis_error', 'prefetch')]
             )
             
             if uploaded_file:
-                st.session_state['uploaded_file'] = uploaded_file
                 st.session_state['kml_filename'] = uploaded_file.name
                 
                 if st.button("➡️ Próximo: Configurar Parâmetros", type="primary"):
+                    # The session keeps a store ID, not the file bytes
+                    st.session_state['upload_id'] = guardar_upload(uploaded_file, st.session_state['session_id'])
                     st.session_state['kml_uploaded'] = True
                     st.session_state['current_step'] = 2
                     st.rerun()
@@ -403,28 +724,45 @@ def main():
                     st.session_state['current_step'] = 2
                     if 'analysis_results' in st.session_state:
                         del st.session_state['analysis_results']
+                    st.session_state.pop('job_id', None)
+                    st.session_state.pop('analysis_error', None)
                     st.rerun()
         else:
             st.markdown("### ⚙️ Etapa 2: Configuração dos Parâmetros")
             
             # Read geometry to check type
-            uploaded_file = st.session_state.get('uploaded_file')
             try:
-                with tempfile.NamedTemporaryFile(delete=False, suffix='.kml') as tmp:
-                    tmp.write(uploaded_file.getvalue())
-                    tmp_path = tmp.name
-                
-                gdf_check = gpd.read_file(tmp_path, driver='KML')
+                gdf_check = gpd.read_file(
+                    rs.arquivo_resultado(st.session_state['upload_id'], 'input.kml'), driver='KML'
+                )
                 geom_types = gdf_check.geometry.type.unique()
                 has_polygon = any(g in ['Polygon', 'MultiPolygon'] for g in geom_types)
                 has_point_or_line = any(g in ['Point', 'LineString', 'MultiPoint', 'MultiLineString'] for g in geom_types)
+                waypoint_heights = gsm.waypoint_heights(gdf_check.geometry)
+                has_heights = has_point_or_line and (waypoint_heights > 0).any()
+                if has_heights:
+                    try:
+                        gsm.check_altitude_modes(read_altitude_modes(
+                            rs.arquivo_resultado(st.session_state['upload_id'], 'input.kml')
+                        ))
+                    except ValueError:
+                        st.warning(
+                            "Altitudes absolutas (altitudeMode absolute) não são alturas sobre o solo: "
+                            "o GRB usa a altura de voo informada"
+                        )
+                        has_heights = False
                 
-                os.unlink(tmp_path)
+                # Load the quadrants of the worst-case Adjacent Area while the
+                # parameters are chosen, once per upload
+                if 'prefetch' not in st.session_state:
+                    pa.prefetch_quadrantes(gdf_check.geometry, chave=st.session_state['upload_id'])
+                    st.session_state['prefetch'] = st.session_state['upload_id']
                 
             except Exception as e:
                 st.error(f"Erro ao ler KML: {str(e)}")
                 has_polygon = False
                 has_point_or_line = True
+                has_heights = False
             
             col1, col2 = st.columns(2)
             
@@ -450,6 +788,15 @@ def main():
                     step=10.0,
                     help="Altura de voo em metros"
                 )
+                
+                if has_heights:
+                    variable_height = st.checkbox(
+                        "GRB variável pela altitude dos waypoints",
+                        value=False,
+                        help=f"Rota 3D detectada ({waypoint_heights.min():.0f}-{waypoint_heights.max():.0f} m): o Ground Risk Buffer de cada trecho segue a altitude dos seus pontos"
+                    )
+                else:
+                    variable_height = False
             
             with col2:
                 st.markdown("#### Parâmetros de Buffer")
@@ -468,8 +815,21 @@ def main():
                     help="Estilo dos cantos dos buffers"
                 )
             
-            grb_preview = gsm.calculate_grb_size(height)
-            st.info(f"Ground Risk Buffer: {grb_preview:.2f} m | Adjacent Area: 7500m")
+            if variable_height:
+                st.info(
+                    f"Ground Risk Buffer: {gsm.calculate_grb_size(waypoint_heights.min()):.2f}-"
+                    f"{gsm.calculate_grb_size(waypoint_heights.max()):.2f} m | Adjacent Area: 7500m"
+                )
+            else:
+                grb_preview = gsm.calculate_grb_size(height)
+                st.info(f"Ground Risk Buffer: {grb_preview:.2f} m | Adjacent Area: 7500m")
+            
+            prefetch = pa.estado_prefetch(st.session_state.get('prefetch'))
+            if prefetch is not None:
+                if prefetch.done():
+                    st.caption(f"✓ Dados do IBGE prontos: {len(prefetch.result())} quadrante(s) carregado(s)")
+                else:
+                    st.caption("⏳ Carregando dados do IBGE em segundo plano...")
             
             if st.button("🚀 Iniciar Análise", type="primary"):
                 # Store parameters
@@ -477,74 +837,96 @@ def main():
                 st.session_state['height'] = height
                 st.session_state['cv_size'] = cv_size
                 st.session_state['corner_style'] = corner_style
+                st.session_state['variable_height'] = variable_height
                 st.session_state['parameters_set'] = True
                 st.session_state['current_step'] = 3
                 st.rerun()
     
     # STEP 3: Run Analysis
     if st.session_state['current_step'] >= 3 and st.session_state['parameters_set']:
-        if 'analysis_results' not in st.session_state:
+        if 'analysis_error' in st.session_state:
+            # A failed analysis is only submitted again on request
+            st.markdown("### 📊 Etapa 3: Processamento")
+            erro = st.session_state['analysis_error']
+            st.error(f"❌ Erro durante o processamento: {erro['error']}")
+            with st.expander("Ver detalhes do erro"):
+                st.code(erro['traceback'])
+            if st.button("🔄 Processar novamente", type="primary"):
+                for chave in ('analysis_error', 'job_id'):
+                    st.session_state.pop(chave, None)
+                st.rerun()
+        
+        elif 'analysis_results' not in st.session_state:
             st.markdown("### 📊 Etapa 3: Processamento")
             
             progress_bar = st.progress(0)
             status_text = st.empty()
             
             try:
-                uploaded_file = st.session_state.get('uploaded_file')
-                fg_size = st.session_state.get('fg_size')
-                height = st.session_state.get('height')
-                cv_size = st.session_state.get('cv_size')
-                corner_style = st.session_state.get('corner_style')
-                
-                # ETAPA 1: Gerar Margens de Segurança
-                status_text.markdown('<div class="step-indicator">📍 Gerando margens de segurança...</div>', unsafe_allow_html=True)
-                progress_bar.progress(10)
-                
-                with tempfile.NamedTemporaryFile(delete=False, suffix='.kml') as tmp_input:
-                    tmp_input.write(uploaded_file.getvalue())
-                    tmp_input_path = tmp_input.name
-                
-                output_dir = tempfile.mkdtemp()
-                safety_kml_path = os.path.join(output_dir, 'safety_margins.kml')
-                
-                result_path = gsm.generate_safety_margins(
-                    input_kml_path=tmp_input_path,
-                    output_kml_path=safety_kml_path,
-                    fg_size=fg_size,
-                    height=height,
-                    cv_size=cv_size,
-                    corner_style=corner_style
-                )
-                
-                progress_bar.progress(30)
-                
-                with open(result_path, 'rb') as f:
-                    kml_data = f.read()
-                
-                # ETAPA 2: Análise Populacional
-                status_text.markdown('<div class="step-indicator">📊 Analisando densidade populacional...</div>', unsafe_allow_html=True)
-                progress_bar.progress(40)
-                
-                analysis_output_dir = os.path.join(output_dir, 'analysis_results')
-                os.makedirs(analysis_output_dir, exist_ok=True)
-                
-                results = pa.analyze_population(result_path, analysis_output_dir)
-                
-                progress_bar.progress(100)
-                status_text.empty()
-                
-                if results:
-                    st.session_state['analysis_results'] = {
-                        'stats': results,
-                        'output_dir': analysis_output_dir,
-                        'kml_data': kml_data
+                # The analysis runs as a background job attached to the
+                # session by ID: reruns poll it instead of starting over
+                job_id = st.session_state.get('job_id')
+                if (job_id is None or jobs.estado_job(job_id) is None) and not rs.existe_resultado(st.session_state['upload_id']):
+                    # Upload evicted from the results store: back to step 1
+                    for chave in ('kml_uploaded', 'parameters_set', 'upload_id', 'prefetch'):
+                        st.session_state.pop(chave, None)
+                    st.session_state['current_step'] = 1
+                    st.warning("⚠️ O KML enviado expirou no servidor. Faça o upload novamente.")
+                    st.stop()
+                if job_id is None or jobs.estado_job(job_id) is None:
+                    indice_quadrantes()
+                    parametros = {
+                        'fg_size': st.session_state.get('fg_size'),
+                        'height': st.session_state.get('height'),
+                        'cv_size': st.session_state.get('cv_size'),
+                        'corner_style': st.session_state.get('corner_style'),
+                        'variable_height': st.session_state.get('variable_height', False)
                     }
-                    st.rerun()
-                else:
-                    st.warning("⚠️ Nenhum resultado foi gerado.")
+                    # Identical analyses already running (e.g. a team sharing
+                    # one mission KML) are joined instead of started again
+                    geometrias = gpd.read_file(
+                        rs.arquivo_resultado(st.session_state['upload_id'], 'input.kml'), driver='KML'
+                    ).geometry
+                    job_id, _ = jobs.submeter_job_unico(
+                        ('app', pa.chave_analise(geometrias, parametros)),
+                        executar_analise, st.session_state['upload_id'], parametros,
+                        st.session_state['session_id']
+                    )
+                    st.session_state['job_id'] = job_id
                 
-                if os.path.exists(tmp_input_path):
-                    os.unlink(tmp_input_path)
+                while True:
+                    job = jobs.estado_job(job_id)
+                    progress_bar.progress(int(job['progress'] * 100))
+                    mensagem = job['message']
+                    if job['attached']:
+                        mensagem += f" (compartilhada com {job['attached'] + 1} solicitações idênticas)"
+                    status_text.markdown(f'<div class="step-indicator">{mensagem}</div>', unsafe_allow_html=True)
+                    
+                    if job['status'] == 'error':
+                        # Kept with the failed job ID: reruns show the error
+                        # until "Processar novamente" submits the analysis again
+                        st.session_state['analysis_error'] = {
+                            'job_id': job_id, 'error': job['error'], 'traceback': job['traceback']
+                        }
+                        st.rerun()
+                    
+                    # Stats are published before the maps finish rendering
+                    analise = job['result'] if job['status'] == 'done' else job['partial']
+                    if analise is not None:
+                        if job['attached']:
+                            # Created under the session that started the job:
+                            # held by this one too, so neither quota drops it
+                            # from under the other
+                            rs.compartilhar_resultado(analise['result_id'], st.session_state['session_id'])
+                        st.session_state['analysis_results'] = analise
+                        st.rerun()
+                    if job['status'] == 'done':
+                        progress_bar.empty()
+                        status_text.empty()
+                        st.warning("⚠️ Nenhum resultado foi gerado.")
+                        break
+                    
+                    time.sleep(0.3)
             
             except Exception as e:
                 progress_bar.empty()
@@ -554,11 +936,19 @@ def main():
                 with st.expander("Ver detalhes do erro"):
                     st.code(traceback.format_exc())
         
+        # Results whose files were evicted from the store must be recomputed
+        if 'analysis_results' in st.session_state and not rs.existe_resultado(st.session_state['analysis_results']['result_id']):
+            st.warning("⚠️ Os arquivos desta análise expiraram e foram removidos do servidor.")
+            if st.button("🔄 Processar novamente", type="primary"):
+                for chave in ('analysis_results', 'job_id'):
+                    st.session_state.pop(chave, None)
+                st.rerun()
+        
         # Display results if they exist
-        if 'analysis_results' in st.session_state:
-            results = st.session_state['analysis_results']['stats']
-            analysis_output_dir = st.session_state['analysis_results']['output_dir']
-            kml_data = st.session_state['analysis_results']['kml_data']
+        elif 'analysis_results' in st.session_state:
+            analise = st.session_state['analysis_results']
+            results = analise['stats']
+            safety_layers = analise['safety_layers']
             
             st.success("✅ Análise concluída com sucesso!")
             
@@ -671,16 +1061,22 @@ def main():
 
             # Tabela Detalhada de Células do GRB
             if 'Ground Risk Buffer' in results and 'detailed_cells' in results['Ground Risk Buffer']:
-                detailed_cells = results['Ground Risk Buffer']['detailed_cells']
+                # Handle to the table in the results store (see guardar_tabelas);
+                # its columns are zero-copy views of the memory-mapped file
+                cells_handle = results['Ground Risk Buffer']['detailed_cells']
             
-                if not detailed_cells.empty:
+                if cells_handle['rows'] > 0:
                     st.markdown("---")
                     st.markdown("## 📋 Células do Ground Risk Buffer")
+                    
+                    detailed_cells = rs.abrir_tabela(cells_handle)
+                    densidades = detailed_cells.column('Densidade_hab_km2').to_numpy()
+                    populacoes = detailed_cells.column('Populacao').to_numpy()
             
                     # Estatísticas rápidas
-                    total_cells = len(detailed_cells)
-                    cells_above_5 = len(detailed_cells[detailed_cells['Densidade_hab_km2'] > 5])
-                    cells_above_0 = len(detailed_cells[detailed_cells['Densidade_hab_km2'] > 0])
+                    total_cells = len(densidades)
+                    cells_above_5 = int((densidades > 5).sum())
+                    cells_above_0 = int((densidades > 0).sum())
             
                     col1, col2, col3 = st.columns(3)
                     with col1:
@@ -701,52 +1097,46 @@ def main():
                     with col1:
                         densidade_filter = st.selectbox(
                             "Filtrar por densidade",
-                            options=["Todas as células", "Somente > 0 hab/km²", "Somente > 5 hab/km²"],
+                            options=list(FILTROS_DENSIDADE),
                             index=1
                         )
             
                     with col2:
                         sort_option = st.selectbox(
                             "Ordenar por",
-                            options=["Densidade (maior → menor)", "Densidade (menor → maior)", 
-                                    "População (maior → menor)", "População (menor → maior)"],
+                            options=list(ORDENS_CELULAS),
                             index=0
                         )
             
-                    # Aplicar filtros
-                    filtered_cells = detailed_cells.copy()
-            
-                    if densidade_filter == "Somente > 0 hab/km²":
-                        filtered_cells = filtered_cells[filtered_cells['Densidade_hab_km2'] > 0]
-                    elif densidade_filter == "Somente > 5 hab/km²":
-                        filtered_cells = filtered_cells[filtered_cells['Densidade_hab_km2'] > 5]
-            
-                    # Aplicar ordenação
-                    if sort_option == "Densidade (maior → menor)":
-                        filtered_cells = filtered_cells.sort_values('Densidade_hab_km2', ascending=False)
-                    elif sort_option == "Densidade (menor → maior)":
-                        filtered_cells = filtered_cells.sort_values('Densidade_hab_km2', ascending=True)
-                    elif sort_option == "População (maior → menor)":
-                        filtered_cells = filtered_cells.sort_values('Populacao', ascending=False)
-                    elif sort_option == "População (menor → maior)":
-                        filtered_cells = filtered_cells.sort_values('Populacao', ascending=True)
-            
-                    # Formatar a tabela para exibição
-                    display_df = filtered_cells.copy()
-                    
-                    # Arredondar valores numéricos básicos
-                    if 'Densidade_hab_km2' in display_df.columns:
-                        display_df['Densidade_hab_km2'] = display_df['Densidade_hab_km2'].round(2)
-                    if 'Area_km2' in display_df.columns:
-                        display_df['Area_km2'] = display_df['Area_km2'].round(6)
-                    if 'Populacao' in display_df.columns:
-                        display_df['Populacao'] = display_df['Populacao'].astype(int)
+                    # Row positions in the chosen order, from the presorted
+                    # indexes (see ordenar_celulas); the table is not copied
+                    indice, crescente = ORDENS_CELULAS[sort_option]
+                    linhas = rs.abrir_tabela(results['Ground Risk Buffer']['detailed_cells_order']).column(indice).to_numpy()
+                    if crescente:
+                        linhas = linhas[::-1]
+                    densidade_minima = FILTROS_DENSIDADE[densidade_filter]
+                    if densidade_minima is not None:
+                        linhas = linhas[densidades[linhas] > densidade_minima]
+                    num_filtradas = len(linhas)
+            
+                    st.markdown(f"### 📊 Tabela de Células ({num_filtradas} registros)")
                     
-                    # Arredondar coordenadas dos vértices (V1_Latitude, V1_Longitude, etc.)
-                    vertex_cols = [col for col in display_df.columns if col.startswith('V') and ('Latitude' in col or 'Longitude' in col)]
-                    for col in vertex_cols:
-                        if col in display_df.columns:  # Verificação extra de segurança
-                            display_df[col] = display_df[col].round(7)
+                    col1, col2 = st.columns([1, 3])
+                    with col1:
+                        tamanho_pagina = st.selectbox("Células por página", options=TAMANHOS_PAGINA, index=1)
+                    num_paginas = max(-(-num_filtradas // tamanho_pagina), 1)
+                    if st.session_state.get('grb_page', 1) > num_paginas:
+                        # The filter or page size changed under the current page
+                        st.session_state['grb_page'] = 1
+                    with col2:
+                        pagina = st.number_input(
+                            f"Página (de {num_paginas})", min_value=1, max_value=num_paginas, step=1, key='grb_page'
+                        )
+            
+                    # Only the rows of the visible page are read from the file;
+                    # values were rounded when the table was built
+                    linhas_pagina = linhas[(pagina - 1) * tamanho_pagina:pagina * tamanho_pagina]
+                    display_df = rs.ler_tabela(cells_handle, linhas=linhas_pagina)
             
                     # Renomear colunas para português (apenas as colunas base, manter nomes dos vértices)
                     rename_dict = {
@@ -759,21 +1149,16 @@ def main():
                     # Renomear apenas colunas que existem
                     rename_dict = {k: v for k, v in rename_dict.items() if k in display_df.columns}
                     display_df = display_df.rename(columns=rename_dict)
-            
-                    st.markdown(f"### 📊 Tabela de Células ({len(filtered_cells)} registros)")
                     
                     # Informação sobre vértices
                     if 'Nº Vértices' in display_df.columns and len(display_df) > 0:
                         num_vertices = display_df['Nº Vértices'].iloc[0]
                         st.info(f"💡 **Cada célula contém {num_vertices} vértices** com coordenadas nas colunas V1_Longitude, V1_Latitude, V2_Longitude, V2_Latitude, etc.")
             
-                    # Adicionar destaque visual para células críticas
-                    def highlight_critical(row):
-                        if 'Densidade (hab/km²)' in row.index and row['Densidade (hab/km²)'] > 5:
-                            return ['background-color: rgba(255, 0, 0, 0.15)'] * len(row)
-                        return [''] * len(row)
-            
-                    styled_df = display_df.style.apply(highlight_critical, axis=1)
+                    # Destaque das células críticas: one style vector for the
+                    # page, applied column by column
+                    estilos = np.where(densidades[linhas_pagina] > 5, DESTAQUE_CRITICO, '')
+                    styled_df = display_df.style.apply(lambda coluna: estilos, axis=0)
                     st.dataframe(styled_df, use_container_width=True, hide_index=True, height=400)
             
                     # Legenda
@@ -789,12 +1174,12 @@ def main():
             
                     col1, col2, col3 = st.columns([1, 1, 2])
             
+                    # CSVs written once when the analysis ended (see preparar_downloads)
                     with col1:
                         # Download CSV completo
-                        csv_completo = detailed_cells.to_csv(index=False).encode('utf-8')
                         st.download_button(
                             label="📥 Download Todas as Células (CSV)",
-                            data=csv_completo,
+                            data=dados_download(analise, 'celulas_grb_completo.csv'),
                             file_name='celulas_grb_completo.csv',
                             mime='text/csv',
                             use_container_width=True,
@@ -804,11 +1189,9 @@ def main():
                     with col2:
                         # Download CSV apenas células > 5
                         if cells_above_5 > 0:
-                            cells_critical = detailed_cells[detailed_cells['Densidade_hab_km2'] > 5]
-                            csv_critical = cells_critical.to_csv(index=False).encode('utf-8')
                             st.download_button(
                                 label="📥 Download Células Críticas (CSV)",
-                                data=csv_critical,
+                                data=dados_download(analise, 'celulas_grb_criticas.csv'),
                                 file_name='celulas_grb_criticas.csv',
                                 mime='text/csv',
                                 use_container_width=True,
@@ -831,69 +1214,106 @@ def main():
             st.markdown("---")
             st.markdown("## 📊 Estatísticas Detalhadas por Camada")
 
-            if 'stats' in results:
-                stats_data = []
-                for layer, stat in results.items():
-                    stats_data.append({
-                        'Camada': layer,
-                        'População Total': int(stat['total_pessoas']),
-                        'Área (km²)': round(stat['area_km2'], 2),
-                        'Densidade Média (hab/km²)': round(stat['densidade_media'], 2),
-                        'Densidade Máxima (hab/km²)': round(stat['densidade_maxima'], 2)
-                    })
-                stats_df = pd.DataFrame(stats_data)
-                st.dataframe(stats_df, use_container_width=True, hide_index=True)
+            st.dataframe(tabela_estatisticas(results), use_container_width=True, hide_index=True)
 
             # Display maps
             st.markdown("---")
             st.markdown("## 🗺️ Mapas de Densidade Populacional")
 
-            maps = [
-                ('map_flight_geography.png', 'Flight Geography'),
-                ('map_ground_risk_buffer.png', 'Ground Risk Buffer'),
-                ('map_adjacent_area.png', 'Adjacent Area')
-            ]
+            maps = ['Flight Geography', 'Ground Risk Buffer', 'Adjacent Area']
+
+            # Previews are shown; the full-resolution files are downloads.
+            # Bytes come from the map_output cache, read once per file.
+            for map_title in maps:
+                if map_title not in analise['maps_expected']:
+                    continue
+                with st.spinner(f"Gerando mapa {map_title}..."):
+                    analise = acompanhar_analise(
+                        analise, lambda a: map_title in a['maps'] or map_title in a['map_errors']
+                    )
+                info = analise['maps'].get(map_title)
+                if info is None:
+                    erro = analise['map_errors'].get(map_title, analise.get('downloads_error'))
+                    st.warning(f"⚠️ Erro ao gerar o mapa {map_title}: {erro}")
+                    continue
+                st.markdown(f"### {map_title}")
+                st.image(mo.ler_bytes(info['preview_path']), use_container_width=True)
+                st.caption(
+                    f"Prévia {mo.formatar_tamanho(info['preview_size'])} · "
+                    f"arquivo completo {info['pixels'][0]}×{info['pixels'][1]} px, "
+                    f"{mo.formatar_tamanho(info['size'])}"
+                )
+
+            # Interactive map: cells streamed as level-of-detail GeoJSON tiles
+            st.markdown("---")
+            st.markdown("## 🧭 Mapa Interativo")
+
+            try:
+                from streamlit_folium import st_folium
 
-            for map_file, map_title in maps:
-                map_path = os.path.join(analysis_output_dir, map_file)
-                if os.path.exists(map_path):
-                    st.markdown(f"### {map_title}")
-                    st.image(map_path, use_container_width=True)
+                camadas = {
+                    titulo: camada_mapa(results[titulo]['cells'])
+                    for titulo in maps
+                    if 'cells' in results.get(titulo, {})
+                }
+                mapa = wm.mapa_interativo(
+                    pa.converter_layers(safety_layers, pa.LAYERS_KML),
+                    camadas,
+                    url_tiles=wm.iniciar_servidor(),
+                    cores=pa.COLORS
+                )
+                st_folium(mapa, height=650, use_container_width=True, returned_objects=[])
+            except ImportError:
+                st.info("ℹ️ Instale `folium` e `streamlit-folium` para ver o mapa interativo.")
 
             # Download results - KML and Maps together
             st.markdown("---")
             st.markdown("## 📥 Download dos Resultados")
 
-            col1, col2, col3, col4 = st.columns(4)
+            with st.spinner("Preparando arquivos para download..."):
+                analise = acompanhar_analise(analise, lambda a: False)
+            downloads = analise['downloads']
+            if 'downloads_error' in analise:
+                st.warning(f"⚠️ Erro ao preparar os downloads: {analise['downloads_error']}")
 
-            # KML download
-            with col1:
+            # Files serialised once when the analysis ended: reruns only
+            # register deferred reads (see dados_download)
+            def botao_download(label, nome, key):
+                entrada = downloads[nome]
                 st.download_button(
-                    label="📥 Margens de Segurança",
-                    data=kml_data,
-                    file_name='safety_margins.kml',
-                    mime='application/vnd.google-earth.kml+xml',
-                    key='download_kml_final',
-                    use_container_width=True
+                    label=label,
+                    data=dados_download(analise, nome),
+                    file_name=nome,
+                    mime=entrada['mime'],
+                    use_container_width=True,
+                    key=key,
+                    help=f"{mo.formatar_tamanho(entrada['size'])} · SHA-256 {entrada['sha256'][:16]}…"
                 )
 
+            col1, col2, col3, col4 = st.columns(4)
+
+            with col1:
+                if 'safety_margins.kml' in downloads:
+                    botao_download("📥 Margens de Segurança", 'safety_margins.kml', 'download_kml_final')
+
             # Map downloads
             map_labels = ['📥 Mapa FG', '📥 Mapa GRB', '📥 Mapa AA']
-            for idx, (map_file, map_title) in enumerate(maps):
-                map_path = os.path.join(analysis_output_dir, map_file)
-                if os.path.exists(map_path):
+            for idx, map_title in enumerate(maps):
+                info = analise['maps'].get(map_title)
+                if info and os.path.basename(info['path']) in downloads:
                     with [col2, col3, col4][idx]:
-                        with open(map_path, 'rb') as f:
-                            file_data = f.read()
-                            st.download_button(
-                                label=map_labels[idx],
-                                data=file_data,
-                                file_name=map_file,
-                                mime='image/png',
-                                use_container_width=True,
-                                key=f"download_map_{idx}"
-                            )
+                        botao_download(map_labels[idx], os.path.basename(info['path']), f"download_map_{idx}")
 
+            col1, col2 = st.columns([1, 3])
+            with col1:
+                if 'estatisticas.csv' in downloads:
+                    botao_download("📥 Estatísticas (CSV)", 'estatisticas.csv', 'download_stats')
+            with col2:
+                if NOME_PACOTE in downloads:
+                    botao_download("📦 Baixar Tudo (ZIP)", NOME_PACOTE, 'download_bundle')
+
+    admin_panel()
+    
     # Footer
     st.markdown("""
     <div class="footer">
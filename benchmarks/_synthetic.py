@@ -0,0 +1,56 @@
+"""
+Synthetic inputs shared by the benchmarks (no network or IBGE data needed).
+"""
+
+import geopandas as gpd
+import numpy as np
+import shapely
+from shapely.geometry import LineString
+
+# SIRGAS 2000 / UTM zone 23S (Brasília)
+CRS_SINTETICO = 'EPSG:31983'
+
+
+def rota_sintetica(km, seed=0):
+    """Gently curving random-walk route near Brasília with ~1 km legs."""
+    rng = np.random.default_rng(seed)
+    angles = np.cumsum(rng.normal(0, 0.05, int(km)))
+    steps = np.column_stack([np.cos(angles), np.sin(angles)]) * 1000
+    coords = np.cumsum(np.vstack([[190000, 8250000], steps]), axis=0)
+    return gpd.GeoDataFrame(geometry=[LineString(coords)], crs=CRS_SINTETICO)
+
+
+def trilha_gps(km, spacing=10.0, noise=2.0, seed=0):
+    """Dense GPS-like track: the route resampled every `spacing` m with jitter."""
+    rng = np.random.default_rng(seed)
+    line = rota_sintetica(km, seed).geometry.iloc[0].segmentize(spacing)
+    coords = np.asarray(line.coords)
+    coords[1:-1] += rng.normal(0, noise, coords[1:-1].shape)
+    return gpd.GeoDataFrame(geometry=[LineString(coords)], crs=CRS_SINTETICO)
+
+
+def quadrante_urbano(centro_lonlat=(-47.9, -15.8), lado_km=60, celula_m=200, seed=0):
+    """
+    Dense urban quadrant: a full lattice of `celula_m` cells (IBGE Albers
+    lattice) around `centro_lonlat`, returned in WGS84 like the IBGE files.
+    """
+    from src.population_analysis import ALBERS_BR
+
+    rng = np.random.default_rng(seed)
+    centro = gpd.GeoSeries.from_xy([centro_lonlat[0]], [centro_lonlat[1]], crs=4326)
+    cx, cy = centro.to_crs(ALBERS_BR).iloc[0].coords[0]
+    meio = lado_km * 500
+    x0 = np.floor((cx - meio) / celula_m) * celula_m
+    y0 = np.floor((cy - meio) / celula_m) * celula_m
+    n = int(lado_km * 1000 / celula_m)
+    xs, ys = np.meshgrid(x0 + celula_m * np.arange(n), y0 + celula_m * np.arange(n))
+    xs, ys = xs.ravel(), ys.ravel()
+    cells = gpd.GeoDataFrame(
+        {
+            'ID_UNICO': [f"200ME{int(x)}N{int(y)}" for x, y in zip(xs, ys)],
+            'TOTAL': rng.poisson(40, len(xs)).astype(float),
+        },
+        geometry=shapely.box(xs, ys, xs + celula_m, ys + celula_m),
+        crs=ALBERS_BR,
+    )
+    return cells.to_crs(epsg=4326)
@@ -0,0 +1,67 @@
+"""
+Benchmark: map file size and encode time per output format, for the full
+export and the preview, against matplotlib's default PNG. The map is a
+raster density map of a synthetic quadrant, without the basemap.
+
+Usage (from the repository root):
+    python -m benchmarks.bench_formats [--lado-km 45] [--dpi 150]
+"""
+
+import argparse
+import io
+import time
+
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+from PIL import Image
+
+from benchmarks._synthetic import quadrante_urbano
+from src import population_analysis as pa
+from src.map_output import FORMATOS, codificar_imagem, reduzir_preview
+from src.projection import para_crs
+from src.rendering import desenhar_celulas
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--lado-km', type=float, default=45, help='Quadrant side in km')
+    parser.add_argument('--dpi', type=int, default=150, help='Export resolution')
+    args = parser.parse_args()
+
+    dados = quadrante_urbano(lado_km=args.lado_km)
+    dados_area = dados.set_geometry(para_crs(dados.geometry, pa.ALBERS_BR))
+    dados['densidade_pop_km2'] = dados['TOTAL'] / (dados_area.geometry.area / 1e6)
+
+    fig, ax = plt.subplots(figsize=(24, 24))
+    desenhar_celulas(ax, dados, dados_area, crs_albers=pa.ALBERS_BR)
+    ax.set_title("benchmark", fontsize=18, fontweight='bold')
+
+    t0 = time.perf_counter()
+    buf = io.BytesIO()
+    fig.savefig(buf, format='png', dpi=args.dpi, bbox_inches='tight')
+    t_png = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    bruto = io.BytesIO()
+    fig.savefig(bruto, format='png', dpi=args.dpi, bbox_inches='tight', pil_kwargs={'compress_level': 0})
+    bruto.seek(0)
+    imagem = Image.open(bruto).convert('RGB')
+    t_render = time.perf_counter() - t0
+    plt.close(fig)
+
+    preview = reduzir_preview(imagem)
+
+    print(f"Map: {imagem.size[0]}x{imagem.size[1]} px, preview {preview.size[0]}x{preview.size[1]} px")
+    print(f"Uncompressed render (shared by all formats): {t_render:.2f} s")
+    print(f"{'format':<16}{'full MB':>9}{'encode s':>10}{'preview KB':>12}{'encode s':>10}")
+    print(f"{'savefig png':<16}{buf.tell() / 1e6:>9.2f}{t_png:>10.2f}{'-':>12}{'-':>10}")
+    for formato in FORMATOS:
+        dados_full, t_full = codificar_imagem(imagem, formato)
+        dados_prev, t_prev = codificar_imagem(preview, formato)
+        print(f"{formato:<16}{len(dados_full) / 1e6:>9.2f}{t_full:>10.2f}"
+              f"{len(dados_prev) / 1e3:>12.0f}{t_prev:>10.2f}")
+
+
+if __name__ == '__main__':
+    main()
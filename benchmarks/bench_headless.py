@@ -0,0 +1,73 @@
+"""
+Benchmark: analyze_population with maps vs headless (render=False), cold
+(fresh interpreter: imports + first run) and warm (second run in the same
+process). The IBGE index and grid caches are seeded with a synthetic
+quadrant and the basemap runs offline, so no network is needed.
+
+Usage (from the repository root):
+    python -m benchmarks.bench_headless [--lado-km 40]
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+
+def executar(modo, lado_km):
+    """Time import + two analyses in this process; print 'import first second'."""
+    t0 = time.perf_counter()
+    import geopandas as gpd
+    import shapely
+    from benchmarks._synthetic import quadrante_urbano, trilha_gps
+    from src.generate_safety_margins import build_safety_layers
+    from src import population_analysis as pa
+    t_import = time.perf_counter() - t0
+
+    layers = build_safety_layers(trilha_gps(30), fg_size=50, adj_size=3000)
+    centro = pa.converter_layers(layers, list(layers.index))['Flight Geography'].centroid
+    grid = quadrante_urbano(centro_lonlat=(centro.x, centro.y), lado_km=lado_km)
+
+    # Seed the quadrant index and grid caches with one synthetic quadrant
+    pa._QUADRANT_INDEX = gpd.GeoDataFrame(
+        {'QUADRANTE': ['ID_1']}, geometry=[shapely.box(*grid.total_bounds)], crs=4326
+    )
+    pa._GRID_CACHE[1] = grid
+
+    tempos = []
+    with tempfile.TemporaryDirectory() as pasta:
+        for _ in range(2):
+            t0 = time.perf_counter()
+            pa.analyze_population(layers, pasta, map_workers=1, render=(modo == 'maps'))
+            tempos.append(time.perf_counter() - t0)
+
+    print(f"{t_import} {tempos[0]} {tempos[1]}", file=sys.__stdout__)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--lado-km', type=float, default=40, help='Quadrant side in km')
+    parser.add_argument('--modo', choices=['maps', 'headless'], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.modo:
+        sys.stdout = open(os.devnull, 'w')
+        executar(args.modo, args.lado_km)
+        return
+
+    env = dict(os.environ, ALDRONES_TILE_OFFLINE='1')
+    print(f"{'mode':<10}{'import':>9}{'cold run':>10}{'warm run':>10}  (seconds)")
+    for modo in ('maps', 'headless'):
+        saida = subprocess.run(
+            [sys.executable, '-m', 'benchmarks.bench_headless',
+             '--modo', modo, '--lado-km', str(args.lado_km)],
+            capture_output=True, text=True, env=env, check=True
+        ).stdout.split()
+        t_import, frio, quente = map(float, saida[-3:])
+        print(f"{modo:<10}{t_import:>9.2f}{frio:>10.2f}{quente:>10.2f}")
+
+
+if __name__ == '__main__':
+    main()
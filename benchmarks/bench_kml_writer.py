@@ -0,0 +1,85 @@
+"""
+Benchmark: streaming KML/KMZ writer vs simplekml on large safety margins.
+
+Usage (from the repository root):
+    python -m benchmarks.bench_kml_writer [--km 300]
+"""
+
+import argparse
+import os
+import tempfile
+import time
+
+from shapely.geometry import Polygon, MultiPolygon
+
+from benchmarks._synthetic import rota_sintetica
+from src.generate_safety_margins import STYLES, build_safety_layers
+from src.kml_io import write_kml, count_vertices
+
+
+def escrever_streaming(layers, path):
+    write_kml(path, {'Safety Margins': layers}, STYLES)
+
+
+def escrever_simplekml(layers, path):
+    import simplekml
+
+    kml = simplekml.Kml()
+    folder = kml.newfolder(name="Safety Margins")
+    for name, geom in layers.items():
+        polygons = [geom] if isinstance(geom, Polygon) else (
+            geom.geoms if isinstance(geom, MultiPolygon) else []
+        )
+        for poly in polygons:
+            coords = list(zip(*poly.exterior.coords.xy))
+            pol = folder.newpolygon(name=name, outerboundaryis=coords)
+            pol.style.polystyle.color = STYLES[name]['fill']
+            pol.style.polystyle.fill = 1
+            pol.style.linestyle.color = STYLES[name]['outline']
+            pol.style.linestyle.width = STYLES[name]['width']
+    kml.save(path)
+
+
+def cronometrar(fn, repeat=3):
+    best = float('inf')
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--km', type=float, default=300, help='Route length in km')
+    args = parser.parse_args()
+
+    gdf = rota_sintetica(args.km)
+    gdf['geometry'] = gdf.geometry.segmentize(50)
+    layers = build_safety_layers(
+        gdf, fg_size=50, corner_style='rounded', quad_segs=16, vertex_budgets={}
+    )
+    layers = layers.to_crs(epsg=4326)
+    layers = dict(layers.items())
+    total = sum(count_vertices(g) for g in layers.values())
+    print(f"Route: {args.km:.0f} km, total vertices: {total:,}")
+
+    tmp = tempfile.mkdtemp()
+    cases = {
+        'streaming KML': (os.path.join(tmp, 'fast.kml'), escrever_streaming),
+        'streaming KMZ': (os.path.join(tmp, 'fast.kmz'), escrever_streaming),
+    }
+    try:
+        import simplekml  # noqa: F401
+        cases['simplekml'] = (os.path.join(tmp, 'simplekml.kml'), escrever_simplekml)
+    except ImportError:
+        print("⚠ simplekml not installed, skipping baseline")
+
+    print(f"{'writer':<16}{'time [s]':>10}{'size [KB]':>12}")
+    for label, (path, writer) in cases.items():
+        elapsed = cronometrar(lambda: writer(layers, path))
+        print(f"{label:<16}{elapsed:>10.3f}{os.path.getsize(path) / 1024:>12.1f}")
+
+
+if __name__ == '__main__':
+    main()
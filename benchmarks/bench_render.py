@@ -0,0 +1,65 @@
+"""
+Benchmark: map rendering of grid cells (one polygon patch per cell vs one
+RGBA image composited at device resolution), without the basemap, saved
+the way the maps are (map_output.salvar_figura). 'seconds' is the whole
+map (figure, drawing, render and both encodes); 'render' and 'encode' are
+the parts reported by salvar_figura.
+
+Usage (from the repository root):
+    python -m benchmarks.bench_render [--lado-km 45]
+"""
+
+import argparse
+import os
+import tempfile
+import time
+
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+
+from benchmarks._synthetic import quadrante_urbano
+from src import population_analysis as pa
+from src.map_output import salvar_figura
+from src.projection import para_crs
+from src.rendering import desenhar_celulas
+
+
+def renderizar(dados, dados_area, vetorial, pasta):
+    """Draw and save one map the way renderizar_mapa does."""
+    t0 = time.perf_counter()
+    fig, ax = plt.subplots(figsize=(24, 24))
+    if dados is not None:
+        desenhar_celulas(ax, dados, dados_area, crs_albers=pa.ALBERS_BR, vetorial=vetorial)
+    ax.set_title("benchmark", fontsize=18, fontweight='bold')
+    info = salvar_figura(fig, os.path.join(pasta, 'mapa'), dpi=150)
+    plt.close(fig)
+    return time.perf_counter() - t0, info
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--lado-km', type=float, default=45, help='Quadrant side in km')
+    args = parser.parse_args()
+
+    dados = quadrante_urbano(lado_km=args.lado_km)
+    dados_area = dados.set_geometry(para_crs(dados.geometry, pa.ALBERS_BR))
+    dados['densidade_pop_km2'] = dados['TOTAL'] / (dados_area.geometry.area / 1e6)
+    print(f"Cells: {len(dados):,} of 200 m")
+
+    with tempfile.TemporaryDirectory() as pasta:
+        renderizar(dados.iloc[:100], dados_area.iloc[:100], False, pasta)  # warm up fonts/caches
+        print(f"{'renderer':<14}{'seconds':>10}{'render':>10}{'encode':>10}{'MB':>8}")
+        for nome, vetorial in (('empty figure', None), ('raster', False), ('vector', True)):
+            if vetorial is None:
+                segundos, info = renderizar(None, None, False, pasta)
+            else:
+                segundos, info = renderizar(dados, dados_area, vetorial, pasta)
+            print(
+                f"{nome:<14}{segundos:>10.2f}{info['render_s']:>10.2f}"
+                f"{info['encode_s']:>10.2f}{info['size'] / 1e6:>8.1f}"
+            )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,505 @@
+"""
+AL Drones - Headless HTTP API
+REST service for flight planning systems: submit a flight KML as a job, poll
+its status, then fetch the statistics and files (maps, KML, CSV, ZIP). A
+synchronous endpoint returns the statistics alone, without maps. The server
+is asyncio (aiohttp); the analyses run in a process pool, so the event loop
+only parses requests and serves files. Identical requests (same route
+geometry and parameters) made while one is being computed share its job or
+its statistics instead of running again.
+
+Usage:
+    python src/api.py [--host 0.0.0.0] [--port 8000] [--workers 2]
+
+Endpoints:
+    GET  /health                      Service status
+    POST /jobs                        Submit an analysis (202, job ID)
+    GET  /jobs/{job_id}               Status and progress
+    GET  /jobs/{job_id}/result        Statistics and file list (409 until done)
+    GET  /jobs/{job_id}/files/{name}  One result file
+    POST /stats                       Statistics only, synchronous
+
+The KML goes in the request body, with the parameters in the query string,
+or as JSON: {"kml": "<kml ...>", "parameters": {...}, "render": true}.
+
+Configuration (environment variables):
+    ALDRONES_API_HOST     Bind address (default: 0.0.0.0)
+    ALDRONES_API_PORT     Port (default: 8000)
+    ALDRONES_API_WORKERS  Analysis processes, and jobs running at the same time
+                          (default: ALDRONES_JOB_WORKERS)
+    ALDRONES_API_MAX_STATS  Distinct /stats computations in flight; more get
+                          503 (default: 8)
+"""
+
+import io
+import os
+import json
+import math
+import queue
+import hashlib
+import argparse
+import tempfile
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import asyncio
+import geopandas as gpd
+from aiohttp import web
+
+try:
+    from . import jobs
+    from . import results_store as rs
+    from .population_analysis import chave_analise
+except ImportError:
+    import jobs
+    import results_store as rs
+    from population_analysis import chave_analise
+
+
+API_HOST = os.environ.get('ALDRONES_API_HOST', '0.0.0.0')
+API_PORT = int(os.environ.get('ALDRONES_API_PORT', '8000'))
+API_WORKERS = int(os.environ.get('ALDRONES_API_WORKERS', str(jobs.JOB_WORKERS)))
+MAX_STATS = int(os.environ.get('ALDRONES_API_MAX_STATS', '8'))
+
+# Largest accepted request body (KML), as the Streamlit upload limit
+MAX_BODY = 200 * 1024 * 1024
+
+# Safety margin parameters accepted from clients, with their types
+PARAMETROS = {
+    'fg_size': float,
+    'height': float,
+    'cv_size': float,
+    'adj_size': float,
+    'corner_style': str,
+    'variable_height': bool
+}
+CANTOS = ('square', 'rounded')
+FORMATOS_MAPA = ('png', 'png24', 'webp', 'jpeg')
+# Accepted map export resolutions (the pixel count grows with the square)
+DPI_MAPA = (50, 600)
+
+NOME_PACOTE = 'results.zip'
+
+_POOL = None
+_POOL_LOCK = threading.Lock()
+_MANAGER = None
+# Coalescing key -> asyncio future of the /stats computation in flight
+_STATS_EM_VOO = {}
+
+
+def _pool(quebrado=None):
+    """
+    Analysis processes ('spawn': workers never inherit the server's threads).
+
+    Args:
+        quebrado (ProcessPoolExecutor): A pool that raised BrokenProcessPool
+            (e.g. a worker killed for memory); if it is still the shared
+            one, it is replaced by a new pool
+    """
+    global _POOL
+
+    with _POOL_LOCK:
+        if quebrado is not None and _POOL is quebrado:
+            print("⚠ Analysis pool broken, starting a new one")
+            _POOL = None
+            quebrado.shutdown(wait=False, cancel_futures=True)
+        if _POOL is None:
+            _POOL = ProcessPoolExecutor(
+                max_workers=API_WORKERS, mp_context=multiprocessing.get_context('spawn')
+            )
+        return _POOL
+
+
+def _submeter(fn, *args):
+    """
+    Submit `fn(*args)` to the analysis pool, replacing a pool found broken
+    (the new one may have been broken again since, hence the retries).
+
+    Returns:
+        tuple: (future, pool it runs in)
+    """
+    pool = _pool()
+    for tentativa in range(3):
+        try:
+            return pool.submit(fn, *args), pool
+        except BrokenProcessPool:
+            if tentativa == 2:
+                raise
+            pool = _pool(quebrado=pool)
+
+
+def _fila_progresso():
+    """Queue the worker processes report their progress through."""
+    global _MANAGER
+
+    with _POOL_LOCK:
+        if _MANAGER is None:
+            _MANAGER = multiprocessing.get_context('spawn').Manager()
+        return _MANAGER.Queue()
+
+
+def resumo_estatisticas(results):
+    """JSON-ready statistics per layer of analyze_population results."""
+    resumo = {}
+    for layer, stats in results.items():
+        resumo[layer] = {
+            'population': int(stats['total_pessoas']),
+            'area_km2': round(float(stats['area_km2']), 4),
+            'mean_density_km2': round(float(stats['densidade_media']), 2),
+            'max_density_km2': round(float(stats['densidade_maxima']), 2)
+        }
+        if 'num_cells_above_5' in stats:
+            resumo[layer]['cells_above_5_km2'] = int(stats['num_cells_above_5'])
+    return resumo
+
+
+def _analisar(kml_bytes, parametros, pasta, render=True, opcoes_mapa=None, fila=None):
+    """
+    Worker process: safety margins, population analysis and result files.
+
+    Returns:
+        dict or None: 'stats' (see resumo_estatisticas) and 'files' (download
+        name -> file name in `pasta`); None if no population data was found
+    """
+    try:
+        from . import generate_safety_margins as gsm
+        from . import population_analysis as pa
+    except ImportError:
+        import generate_safety_margins as gsm
+        import population_analysis as pa
+
+    def progresso(fracao, mensagem):
+        if fila is not None:
+            fila.put((fracao, mensagem))
+
+    os.makedirs(pasta, exist_ok=True)
+    entrada = os.path.join(pasta, 'input.kml')
+    with open(entrada, 'wb') as f:
+        f.write(kml_bytes)
+
+    progresso(0.02, "Generating safety margins")
+    layers = gsm.generate_safety_margins(input_kml_path=entrada, return_layers=True, **parametros)
+
+    # One process per analysis: maps are rendered inline, after the stats
+    results = pa.analyze_population(
+        layers, pasta, map_workers=1, wait_maps=True, render=render,
+        progresso=lambda fracao, mensagem: progresso(0.1 + 0.85 * fracao, mensagem),
+        **(opcoes_mapa or {})
+    )
+    if not results:
+        return None
+
+    resumo = resumo_estatisticas(results)
+    with open(os.path.join(pasta, 'stats.json'), 'w', encoding='utf-8') as f:
+        json.dump(resumo, f, ensure_ascii=False, indent=2)
+    arquivos = {'stats.json': 'stats.json'}
+
+    if render:
+        gsm.write_safety_kml(layers, os.path.join(pasta, 'safety_margins.kml'))
+        arquivos['safety_margins.kml'] = 'safety_margins.kml'
+        for stats in results.values():
+            if 'map_path' in stats:
+                nome = os.path.basename(stats['map_path'])
+                arquivos[nome] = nome
+        if os.path.exists(os.path.join(pasta, 'celulas_grb_detalhadas.csv')):
+            arquivos['celulas_grb_detalhadas.csv'] = 'celulas_grb_detalhadas.csv'
+
+    return {'stats': resumo, 'files': arquivos}
+
+
+def _estatisticas(kml_bytes, parametros):
+    """Worker process: statistics only, in a folder removed afterwards."""
+    with tempfile.TemporaryDirectory(prefix='aldrones_stats_') as pasta:
+        resumo = _analisar(kml_bytes, parametros, pasta, render=False)
+    return resumo['stats'] if resumo else None
+
+
+def _executar_job(kml_bytes, parametros, render, opcoes_mapa, sessao, progresso):
+    """
+    Background job (see src.jobs): one analysis in the process pool, relaying
+    its progress, with its files in the results store.
+    """
+    result_id, pasta = rs.criar_resultado(sessao)
+    try:
+        fila = _fila_progresso()
+        future, pool = _submeter(_analisar, kml_bytes, parametros, pasta, render, opcoes_mapa, fila)
+        while True:
+            try:
+                progresso(*fila.get(timeout=0.25))
+            except queue.Empty:
+                if future.done():
+                    break
+        try:
+            resumo = future.result()
+        except BrokenProcessPool:
+            # A worker died during this analysis: it fails, later ones get
+            # a new pool
+            _pool(quebrado=pool)
+            raise
+        if resumo is None:
+            raise ValueError("No population data found for this flight area")
+
+        progresso(0.97, "Packaging files")
+        manifesto = rs.empacotar_resultado(result_id, resumo['files'], NOME_PACOTE)
+    except BaseException:
+        rs.remover_resultado(result_id)
+        raise
+    rs.liberar_resultado(result_id)
+    return {'result_id': result_id, 'stats': resumo['stats'], 'files': manifesto}
+
+
+def _erro(classe, mensagem, headers=None):
+    return classe(text=json.dumps({'error': mensagem}), content_type='application/json', headers=headers)
+
+
+def _converter(nome, valor):
+    tipo = PARAMETROS[nome]
+    try:
+        if tipo is bool:
+            if isinstance(valor, str):
+                return valor.strip().lower() in ('1', 'true', 'yes', 'on')
+            return bool(valor)
+        valor = tipo(valor)
+    except (TypeError, ValueError):
+        raise _erro(web.HTTPBadRequest, f"Invalid value for '{nome}': {valor!r}")
+    if tipo is float and not math.isfinite(valor):
+        raise _erro(web.HTTPBadRequest, f"'{nome}' must be a finite number")
+    if tipo is float and valor < 0:
+        raise _erro(web.HTTPBadRequest, f"'{nome}' must not be negative")
+    if nome == 'corner_style' and valor not in CANTOS:
+        raise _erro(web.HTTPBadRequest, f"'corner_style' must be one of {', '.join(CANTOS)}")
+    return valor
+
+
+async def _ler_pedido(request):
+    """
+    KML bytes, safety margin parameters and render options of a request.
+
+    Returns:
+        tuple: (kml_bytes, parametros, render, opcoes_mapa)
+    """
+    if request.content_type == 'application/json':
+        try:
+            corpo = await request.json()
+        except ValueError:
+            raise _erro(web.HTTPBadRequest, "Malformed JSON body")
+        if not isinstance(corpo, dict) or not isinstance(corpo.get('kml'), str):
+            raise _erro(web.HTTPBadRequest, "JSON body needs a 'kml' string")
+        if not isinstance(corpo.get('parameters', {}), dict):
+            raise _erro(web.HTTPBadRequest, "'parameters' must be a JSON object")
+        kml = corpo['kml'].encode('utf-8')
+        valores = {**corpo.get('parameters', {}), **{k: v for k, v in corpo.items() if k != 'parameters'}}
+    else:
+        kml = await request.read()
+        valores = dict(request.query)
+
+    if not kml.strip():
+        raise _erro(web.HTTPBadRequest, "Empty KML")
+    desconhecidos = set(valores) - set(PARAMETROS) - {'kml', 'render', 'map_format', 'map_dpi'}
+    if desconhecidos:
+        raise _erro(web.HTTPBadRequest, f"Unknown parameters: {', '.join(sorted(desconhecidos))}")
+
+    parametros = {nome: _converter(nome, valores[nome]) for nome in PARAMETROS if nome in valores}
+    render = str(valores.get('render', 'true')).strip().lower() not in ('0', 'false', 'no', 'off')
+
+    opcoes_mapa = {}
+    if 'map_format' in valores:
+        if valores['map_format'] not in FORMATOS_MAPA:
+            raise _erro(web.HTTPBadRequest, f"'map_format' must be one of {', '.join(FORMATOS_MAPA)}")
+        opcoes_mapa['map_format'] = valores['map_format']
+    if 'map_dpi' in valores:
+        try:
+            opcoes_mapa['map_dpi'] = int(valores['map_dpi'])
+        except (TypeError, ValueError, OverflowError):
+            raise _erro(web.HTTPBadRequest, f"Invalid value for 'map_dpi': {valores['map_dpi']!r}")
+        if not DPI_MAPA[0] <= opcoes_mapa['map_dpi'] <= DPI_MAPA[1]:
+            raise _erro(web.HTTPBadRequest, f"'map_dpi' must be between {DPI_MAPA[0]} and {DPI_MAPA[1]}")
+
+    return kml, parametros, render, opcoes_mapa
+
+
+def _chave(kml, opcoes):
+    """
+    Coalescing key of a request (see population_analysis.chave_analise);
+    the raw KML hash if it cannot be parsed here (the job then reports why).
+    """
+    try:
+        geometrias = gpd.read_file(io.BytesIO(kml), driver='KML').geometry
+    except Exception:
+        return hashlib.sha256(kml).hexdigest() + json.dumps(opcoes, sort_keys=True, default=str)
+    return chave_analise(geometrias, opcoes)
+
+
+def _job(request):
+    job = jobs.estado_job(request.match_info['job_id'])
+    if job is None:
+        raise _erro(web.HTTPNotFound, "Unknown or expired job")
+    return job
+
+
+def _url_job(job_id, *partes):
+    return '/'.join(('', 'jobs', job_id) + partes)
+
+
+async def saude(request):
+    return web.json_response({'status': 'ok', 'workers': API_WORKERS})
+
+
+async def criar_job(request):
+    kml, parametros, render, opcoes_mapa = await _ler_pedido(request)
+    # Results are owned by the client (see results_store quotas), one per job
+    # unless the client identifies itself
+    sessao = request.headers.get('X-Client-Id') or f"api:{os.urandom(6).hex()}"
+    # Parsing and hashing a large KML must not stall the event loop
+    chave = await asyncio.get_running_loop().run_in_executor(
+        None, _chave, kml, {**parametros, 'render': render, **opcoes_mapa}
+    )
+    job_id, compartilhado = jobs.submeter_job_unico(
+        ('api', chave), _executar_job, kml, parametros, render, opcoes_mapa, sessao
+    )
+    return web.json_response({
+        'job_id': job_id,
+        'status': jobs.estado_job(job_id)['status'],
+        'coalesced': compartilhado,
+        'status_url': _url_job(job_id),
+        'result_url': _url_job(job_id, 'result')
+    }, status=202)
+
+
+async def estado(request):
+    job = _job(request)
+    return web.json_response({
+        'job_id': job['id'],
+        'status': job['status'],
+        'progress': round(job['progress'], 3),
+        'message': job['message'],
+        'error': job['error'],
+        'attached_requests': job['attached'],
+        'created': job['created'],
+        'started': job['started'],
+        'finished': job['finished']
+    })
+
+
+async def resultado(request):
+    job = _job(request)
+    if job['status'] == 'error':
+        raise _erro(web.HTTPUnprocessableEntity, job['error'])
+    if job['status'] != 'done':
+        raise _erro(web.HTTPConflict, f"Job is {job['status']}")
+
+    res = job['result']
+    return web.json_response({
+        'job_id': job['id'],
+        'stats': res['stats'],
+        'files': {
+            nome: {
+                'url': _url_job(job['id'], 'files', nome),
+                'size': entrada['size'],
+                'sha256': entrada['sha256'],
+                'mime': entrada['mime']
+            }
+            for nome, entrada in res['files'].items()
+        }
+    })
+
+
+async def arquivo(request):
+    job = _job(request)
+    if job['status'] != 'done':
+        raise _erro(web.HTTPConflict, f"Job is {job['status']}")
+    entrada = job['result']['files'].get(request.match_info['nome'])
+    if entrada is None:
+        raise _erro(web.HTTPNotFound, "Unknown file")
+    try:
+        caminho = rs.arquivo_resultado(job['result']['result_id'], entrada['file'])
+    except KeyError:
+        raise _erro(web.HTTPGone, "Result files expired")
+
+    # Streamed from disk; the content hash doubles as the ETag
+    return web.FileResponse(caminho, headers={
+        'Content-Type': entrada['mime'],
+        'ETag': f'"{entrada["sha256"]}"',
+        'Content-Disposition': f'attachment; filename="{request.match_info["nome"]}"'
+    })
+
+
+async def estatisticas(request):
+    kml, parametros, _, _ = await _ler_pedido(request)
+    chave = await asyncio.get_running_loop().run_in_executor(None, _chave, kml, {**parametros, 'render': False})
+    tarefa = _STATS_EM_VOO.get(chave)
+    if tarefa is None:
+        # Beyond the cap the pool queue would only grow: the client retries
+        if len(_STATS_EM_VOO) >= MAX_STATS:
+            raise _erro(
+                web.HTTPServiceUnavailable, "Too many statistics requests in progress, retry later",
+                headers={'Retry-After': '10'}
+            )
+        future, pool = _submeter(_estatisticas, kml, parametros)
+        tarefa = asyncio.wrap_future(future)
+        _STATS_EM_VOO[chave] = tarefa
+
+        def terminar(t):
+            _STATS_EM_VOO.pop(chave, None)
+            if not t.cancelled() and isinstance(t.exception(), BrokenProcessPool):
+                # A worker died during this analysis: later ones get a new pool
+                _pool(quebrado=pool)
+
+        tarefa.add_done_callback(terminar)
+    try:
+        # Shielded: a client hanging up must not cancel it for the others
+        stats = await asyncio.shield(tarefa)
+    except Exception as e:
+        raise _erro(web.HTTPUnprocessableEntity, str(e))
+    if stats is None:
+        raise _erro(web.HTTPUnprocessableEntity, "No population data found for this flight area")
+    return web.json_response({'stats': stats})
+
+
+async def _encerrar(app):
+    if _POOL is not None:
+        _POOL.shutdown(wait=False, cancel_futures=True)
+    if _MANAGER is not None:
+        _MANAGER.shutdown()
+
+
+def criar_app():
+    """aiohttp application with the API routes."""
+    # Each job thread feeds one analysis process: as many of each, so no
+    # process sits idle and no job waits with a process free
+    jobs.JOB_WORKERS = API_WORKERS
+    app = web.Application(client_max_size=MAX_BODY)
+    app.add_routes([
+        web.get('/health', saude),
+        web.post('/jobs', criar_job),
+        web.get('/jobs/{job_id}', estado),
+        web.get('/jobs/{job_id}/result', resultado),
+        web.get('/jobs/{job_id}/files/{nome}', arquivo),
+        web.post('/stats', estatisticas)
+    ])
+    app.on_cleanup.append(_encerrar)
+    return app
+
+
+def main():
+    """Command line interface."""
+    global API_WORKERS
+
+    parser = argparse.ArgumentParser(description='AL Drones population analysis HTTP API')
+    parser.add_argument('--host', default=API_HOST, help=f'Bind address (default: {API_HOST})')
+    parser.add_argument('--port', type=int, default=API_PORT, help=f'Port (default: {API_PORT})')
+    parser.add_argument(
+        '--workers', type=int, default=API_WORKERS,
+        help=f'Analysis processes and concurrent jobs (default: {API_WORKERS})'
+    )
+    args = parser.parse_args()
+
+    API_WORKERS = args.workers
+    print(f"✓ AL Drones API on {args.host}:{args.port} ({API_WORKERS} analysis processes)")
+    web.run_app(criar_app(), host=args.host, port=args.port, print=None)
+
+
+if __name__ == '__main__':
+    main()
@@ -5,10 +5,19 @@ Generates 4 safety layers from input KML for drone operations.
 
 import os
 import argparse
-from math import sqrt
-import simplekml
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from math import sqrt, cos, pi, isfinite
 import geopandas as gpd
-from shapely.geometry import Polygon, MultiPolygon
+import numpy as np
+import shapely
+
+try:
+    from .kml_io import write_kml, read_missions, read_altitude_modes
+    from .projection import escolher_crs_metrico, para_crs, para_wgs84
+except ImportError:
+    from kml_io import write_kml, read_missions, read_altitude_modes
+    from projection import escolher_crs_metrico, para_crs, para_wgs84
 
 
 # KML styling configuration
@@ -19,50 +28,259 @@ STYLES = {
     'Adjacent Area': {'fill': '00ff0000', 'outline': 'ffff0000', 'width': 1},
 }
 
+# Metric CRS selection for buffering: 'utm' (mission zone), 'aeqd' (centred
+# on the mission) or an explicit CRS such as 'EPSG:31983'
+METRIC_CRS = 'utm'
+
+# Buffer segments per quarter circle (shapely default). The regulatory
+# margins are the nominal distances at this resolution; a lower quad_segs
+# is opt-in and inflates the distances of round buffers to compensate
+QUAD_SEGS = 16
+
+CORNER_STYLES = ('square', 'rounded')
+
+# KML altitudeMode values whose Z is not a height above ground
+ABSOLUTE_ALTITUDE_MODES = {'absolute'}
+
+
+def _distance(value):
+    distance = float(value)
+    if not isfinite(distance) or distance < 0:
+        raise ValueError(f"must be a finite distance >= 0, got {value!r}")
+    return distance
+
+
+def _corner_style(value):
+    style = value.strip().lower()
+    if style not in CORNER_STYLES:
+        raise ValueError(f"must be one of {', '.join(CORNER_STYLES)}, got {value!r}")
+    return style
+
+
+# Parameters a mission can override through KML ExtendedData, with their parsers
+MISSION_PARAMETERS = {
+    'fg_size': _distance,
+    'height': _distance,
+    'cv_size': _distance,
+    'adj_size': _distance,
+    'corner_style': _corner_style,
+}
+
+# Per-layer vertex budget: (max vertices, max simplification tolerance in m).
+# None keeps the layer exact. Simplification only ever grows a layer.
+VERTEX_BUDGETS = {
+    'Flight Geography': None,
+    'Contingency Volume': None,
+    'Ground Risk Buffer': (5000, 5.0),
+    'Adjacent Area': (2000, 50.0),
+}
+
 
 def calculate_grb_size(height):
     """
     Calculate Ground Risk Buffer size based on flight height.
     
+    Negative heights (waypoints below the take-off point) count as 0.
+    
     Args:
-        height (float): Flight height in meters
+        height (float or array): Flight height in meters
         
     Returns:
-        float: GRB size in meters
+        float: GRB size in meters (array for array input)
     """
+    if np.ndim(height) > 0:
+        height = np.maximum(np.asarray(height, dtype=float), 0)
+        return np.where(
+            height <= 120,
+            height,
+            150/3.6 * np.sqrt(2 * height / 9.81) + 4/2
+        )
+    
+    height = max(height, 0)
     if height <= 120:
         return height
     else:
         return 150/3.6 * sqrt(2 * height / 9.81) + 4/2
 
 
-def generate_safety_margins(
-    input_kml_path,
-    output_kml_path=None,
+def waypoint_heights(geometry):
+    """Z values (height above ground, m) of all 3D input vertices."""
+    geoms = geometry.values[shapely.has_z(geometry.values)]
+    return shapely.get_coordinates(geoms, include_z=True)[:, 2]
+
+
+def check_altitude_modes(modes):
+    """
+    Reject routes whose waypoint Z is not a height above ground.
+    
+    The variable GRB reads Z as height above ground, as in relativeToGround.
+    Files without altitudeMode (drone planners often omit it) and the
+    clamped modes are read the same way. Absolute altitudes are above sea
+    level and would need a terrain model, so such routes are rejected.
+    
+    Args:
+        modes (set): altitudeMode values (see kml_io.read_altitude_modes)
+        
+    Raises:
+        ValueError: An absolute altitudeMode is used
+    """
+    absolutos = ABSOLUTE_ALTITUDE_MODES & set(modes)
+    if absolutos:
+        raise ValueError(
+            f"variable height needs Z relative to the ground, got altitudeMode "
+            f"{', '.join(sorted(absolutos))}; use relativeToGround or a fixed height"
+        )
+
+
+def variable_grb_buffer(geometry, base_size, height, corner_style='square', quad_segs=QUAD_SEGS):
+    """
+    Ground Risk Buffer whose width follows the height of each waypoint.
+    
+    Each segment of a 3D line is buffered by the GRB of the higher of its two
+    waypoints, all segments in one vectorized call. 3D points and polygons use
+    their own (highest) Z; 2D parts use the scalar `height`. Lines flown at a
+    single height take the plain buffer path.
+    
+    Args:
+        geometry (GeoSeries): Input geometries in a metric CRS, Z = height
+        base_size (float): Buffer added to the GRB (CV + FG sizes)
+        height (float): Height for parts without Z
+        corner_style (str): 'square' or 'rounded'
+        quad_segs (int): Buffer segments per quarter circle
+        
+    Returns:
+        Geometry: Unioned Ground Risk Buffer
+    """
+    # Square caps keep the segment joints at least as wide as mitre corners
+    style = 'square' if corner_style == 'square' else 'round'
+    join_style = 2 if corner_style == 'square' else 1
+    
+    pieces = []
+    for part in shapely.get_parts(geometry.values):
+        coords = shapely.get_coordinates(part, include_z=True)
+        if not shapely.has_z(part):
+            widths = np.array([calculate_grb_size(height)])
+        elif part.geom_type == 'LineString' and len(coords) > 1:
+            widths = calculate_grb_size(np.maximum(coords[:-1, 2], coords[1:, 2]))
+        else:
+            widths = np.array([calculate_grb_size(coords[:, 2].max())])
+        plain = len(widths) == 1 or np.all(widths == widths[0])
+        # Round caps on lines and points; joins follow the corner style
+        arcs = corner_style != 'square' or (plain and part.geom_type not in ('Polygon', 'MultiPolygon'))
+        widths = conservative_distance(widths + base_size, quad_segs, arcs)
+        
+        if plain:
+            pieces.append(part.buffer(
+                widths.max(), quad_segs=quad_segs, cap_style=1, join_style=join_style
+            ))
+        else:
+            segments = shapely.linestrings(
+                np.stack([coords[:-1, :2], coords[1:, :2]], axis=1)
+            )
+            pieces.extend(shapely.buffer(
+                segments, widths, quad_segs=quad_segs, cap_style=style
+            ))
+    
+    return shapely.union_all(pieces)
+
+
+def conservative_distance(distance, quad_segs=QUAD_SEGS, arcs=True):
+    """
+    Inflate a buffer distance so the polygonised arcs enclose the true circle,
+    when `quad_segs` is reduced below QUAD_SEGS.
+    
+    Buffer arcs are chords between vertices on the circle, so a coarse
+    `quad_segs` would cut inside the nominal distance. GEOS rounds the
+    segment count of each fillet, so one chord can span up to 1.5x the
+    nominal angle (pi / 2 / quad_segs); the bound below covers that case.
+    At the default resolution, or for buffers without round joins or caps
+    (`arcs` False), the nominal distance is returned unchanged.
+    """
+    if not arcs or quad_segs >= QUAD_SEGS:
+        return distance
+    return distance / cos(3 * pi / (8 * quad_segs))
+
+
+def simplify_conservative(geom, max_vertices, max_tolerance):
+    """
+    Simplify a polygon to a vertex budget without ever shrinking it.
+    
+    The geometry is grown by the tolerance before a topology-preserving
+    simplification, and the result is only accepted if it still covers the
+    original. Tolerance doubles from 0.5 m up to `max_tolerance`.
+    
+    Returns:
+        Geometry covering `geom` (or `geom` itself if nothing better is found)
+    """
+    if shapely.get_num_coordinates(geom) <= max_vertices:
+        return geom
+    
+    best = geom
+    tolerance = 0.5
+    while tolerance <= max_tolerance:
+        candidate = geom.buffer(tolerance, quad_segs=1, join_style=2).simplify(
+            tolerance, preserve_topology=True
+        )
+        if candidate.covers(geom):
+            best = candidate
+            if shapely.get_num_coordinates(candidate) <= max_vertices:
+                break
+        tolerance *= 2
+    
+    return best
+
+
+def to_metric(geometry, metric_crs=METRIC_CRS):
+    """
+    Project input geometries to the metric CRS chosen for the mission.
+    
+    Args:
+        geometry (GeoSeries): Input geometries (WGS84 if no CRS is set)
+        metric_crs (str): 'utm', 'aeqd' or an explicit CRS (see METRIC_CRS)
+        
+    Returns:
+        GeoDataFrame: Geometries in the metric CRS
+    """
+    if geometry.crs is None:
+        geometry = geometry.set_crs(epsg=4326)
+    elif not geometry.crs.equals('EPSG:4326'):
+        geometry = para_crs(geometry, 'EPSG:4326')
+    crs = escolher_crs_metrico(geometry.total_bounds, metric_crs)
+    return gpd.GeoDataFrame(geometry=para_crs(geometry, crs))
+
+
+def build_safety_layers(
+    gdf,
     fg_size=0,
     height=100,
     cv_size=50,
     adj_size=7500,
-    corner_style='square'
+    corner_style='square',
+    quad_segs=QUAD_SEGS,
+    vertex_budgets=VERTEX_BUDGETS,
+    variable_height=False
 ):
     """
-    Generate safety margin layers from input KML.
+    Build the 4 safety layers from input geometries in a metric CRS.
     
     Args:
-        input_kml_path (str): Path to input KML file
-        output_kml_path (str): Path for output KML file (optional)
+        gdf (GeoDataFrame): Input geometries, already in a metric CRS
         fg_size (float): Flight Geography buffer size in meters (0 for polygons)
         height (float): Flight height in meters
         cv_size (float): Contingency Volume buffer size in meters
-        adj_size (float): Adjacent Area buffer size in meters (default 5000)
+        adj_size (float): Adjacent Area buffer size in meters
         corner_style (str): 'square' or 'rounded' for buffer corners
+        quad_segs (int): Buffer segments per quarter circle
+        vertex_budgets (dict): Per-layer (max vertices, max tolerance) or None
+            (see VERTEX_BUDGETS); pass {} to disable simplification
+        variable_height (bool): Size the GRB from each waypoint's Z (height
+            above ground) instead of `height`; ignored if no Z is above 0
         
     Returns:
-        str: Path to generated KML file
+        GeoSeries: One unioned geometry per layer name, in the CRS of `gdf`
     """
-    
-    # Read and reproject to metric CRS (SIRGAS 2000 / UTM zone 23S)
-    gdf = gpd.read_file(input_kml_path).to_crs(epsg=31983)
+    if corner_style not in CORNER_STYLES:
+        raise ValueError(f"corner_style must be one of {', '.join(CORNER_STYLES)}, got {corner_style!r}")
     
     # Check if geometry contains polygons
     has_polygon = gdf.geometry.type.isin(['Polygon', 'MultiPolygon']).any()
@@ -73,6 +291,8 @@ def generate_safety_margins(
     
     # Set join style for corners
     join_style = 2 if corner_style == 'square' else 1
+    # Lines and points get round caps on the CV, GRB and AA buffers
+    has_caps = not gdf.geometry.type.isin(['Polygon', 'MultiPolygon']).all()
     
     # Calculate Ground Risk Buffer size
     grb_size = calculate_grb_size(height)
@@ -84,66 +304,327 @@ def generate_safety_margins(
         'Ground Risk Buffer': grb_size + cv_size + fg_size,
     }
     
+    # Per-waypoint GRB only when the input really carries heights
+    variable_height = variable_height and (waypoint_heights(gdf.geometry) > 0).any()
+    
     layers = {}
     for name, buffer_size in buffers.items():
-        layer = gdf.copy()
+        geometry = gdf.geometry
+        if name == 'Ground Risk Buffer' and variable_height:
+            layers[name] = variable_grb_buffer(
+                geometry, cv_size + fg_size, height, corner_style, quad_segs
+            )
+            continue
         if buffer_size > 0:
             # Use flat cap for Flight Geography points, round cap for others
             cap_style = 3 if name == 'Flight Geography' and not has_polygon else 1
-            layer["geometry"] = gdf.geometry.buffer(
-                buffer_size,
+            arcs = join_style == 1 or (cap_style == 1 and has_caps)
+            geometry = geometry.buffer(
+                conservative_distance(buffer_size, quad_segs, arcs),
+                quad_segs=quad_segs,
                 cap_style=cap_style,
                 join_style=join_style
             )
-        layers[name] = layer.to_crs(epsg=4326)
+        layers[name] = geometry.union_all()
     
     # Adjacent Area uses Contingency Volume as base
-    adj_layer = layers['Contingency Volume'].copy()
-    adj_layer["geometry"] = (
-        layers['Contingency Volume']
-        .to_crs(epsg=31983)
-        .geometry.buffer(adj_size, join_style=1)
-    )
-    layers['Adjacent Area'] = adj_layer.to_crs(epsg=4326)
-    
-    # Create KML with all polygons
-    kml = simplekml.Kml()
-    folder = kml.newfolder(name="Safety Margins")
-    
-    for name, layer in layers.items():
-        for _, row in layer.iterrows():
-            geom = row['geometry']
-            polygons = (
-                [geom] if isinstance(geom, Polygon)
-                else (geom.geoms if isinstance(geom, MultiPolygon) else [])
-            )
-            
-            for poly in polygons:
-                if isinstance(poly, Polygon):
-                    coords = list(zip(*poly.exterior.coords.xy))
-                    pol = folder.newpolygon(name=name, outerboundaryis=coords)
-                    pol.style.polystyle.color = STYLES[name]['fill']
-                    pol.style.polystyle.fill = 1
-                    pol.style.linestyle.color = STYLES[name]['outline']
-                    pol.style.linestyle.width = STYLES[name]['width']
+    layers['Adjacent Area'] = layers['Contingency Volume'].buffer(
+        conservative_distance(adj_size, quad_segs),
+        quad_segs=quad_segs,
+        join_style=1
+    )
+    
+    for name, budget in vertex_budgets.items():
+        if budget is not None and name in layers:
+            layers[name] = simplify_conservative(layers[name], *budget)
+    
+    return gpd.GeoSeries(layers, crs=gdf.crs)
+
+
+def write_safety_kml(layers, output_kml_path):
+    """
+    Write safety layers to a KML file (converted to WGS84).
+    
+    Args:
+        layers (GeoSeries): Layer geometries indexed by layer name
+        output_kml_path (str): Path for output KML file (.kmz for compressed)
+        
+    Returns:
+        str: Path to generated KML file
+    """
+    if layers.crs is not None:
+        layers = para_wgs84(layers)
+    
+    return write_kml(
+        output_kml_path,
+        {'Safety Margins': dict(layers.items())},
+        styles=STYLES
+    )
+
+
+def generate_safety_margins(
+    input_kml_path,
+    output_kml_path=None,
+    fg_size=0,
+    height=100,
+    cv_size=50,
+    adj_size=7500,
+    corner_style='square',
+    return_layers=False,
+    quad_segs=QUAD_SEGS,
+    simplify=True,
+    metric_crs=METRIC_CRS,
+    variable_height=False
+):
+    """
+    Generate safety margin layers from input KML.
+    
+    Args:
+        input_kml_path (str): Path to input KML file
+        output_kml_path (str): Path for output KML file (optional)
+        fg_size (float): Flight Geography buffer size in meters (0 for polygons)
+        height (float): Flight height in meters
+        cv_size (float): Contingency Volume buffer size in meters
+        adj_size (float): Adjacent Area buffer size in meters (default 5000)
+        corner_style (str): 'square' or 'rounded' for buffer corners
+        return_layers (bool): Return the layer geometries (metric CRS) instead
+            of the KML path. The KML is then only written if
+            `output_kml_path` is given; use `write_safety_kml` to export later.
+        quad_segs (int): Buffer segments per quarter circle
+        simplify (bool): Apply the per-layer VERTEX_BUDGETS
+        metric_crs (str): 'utm', 'aeqd' or an explicit CRS (see METRIC_CRS)
+        variable_height (bool): Size the GRB per segment from the Z of each
+            waypoint (height above ground) of 3D routes
+        
+    Returns:
+        str: Path to generated KML file, or
+        GeoSeries: Layer geometries by name if `return_layers` is True
+        
+    Raises:
+        ValueError: variable_height with absolute altitudes (see
+            check_altitude_modes)
+    """
+    
+    if variable_height:
+        check_altitude_modes(read_altitude_modes(input_kml_path))
+    
+    # Read and reproject to the mission's metric CRS (one forward transform)
+    gdf = to_metric(gpd.read_file(input_kml_path).geometry, metric_crs)
+    
+    has_polygon = gdf.geometry.type.isin(['Polygon', 'MultiPolygon']).any()
+    if has_polygon:
+        fg_size = 0
+    
+    layers = build_safety_layers(
+        gdf,
+        fg_size=fg_size,
+        height=height,
+        cv_size=cv_size,
+        adj_size=adj_size,
+        corner_style=corner_style,
+        quad_segs=quad_segs,
+        vertex_budgets=VERTEX_BUDGETS if simplify else {},
+        variable_height=variable_height
+    )
+    print(f"✓ Metric CRS: {layers.crs.to_string()}")
     
     # Determine output path
-    if output_kml_path is None:
+    if output_kml_path is None and not return_layers:
         base_name = os.path.splitext(input_kml_path)[0]
         output_kml_path = f"{base_name}_safety_margins.kml"
     
     # Save KML
-    kml.save(output_kml_path)
+    if output_kml_path is not None:
+        write_safety_kml(layers, output_kml_path)
+        print(f"✓ Safety margins KML generated: {output_kml_path}")
+    else:
+        print("✓ Safety margins generated (in memory)")
     
-    print(f"✓ Safety margins KML generated: {output_kml_path}")
     print(f"  - Flight Geography: {fg_size}m buffer")
     print(f"  - Contingency Volume: {cv_size}m buffer")
-    print(f"  - Ground Risk Buffer: {grb_size:.2f}m (height: {height}m)")
+    heights = waypoint_heights(gdf.geometry)
+    if variable_height and (heights > 0).any():
+        print(
+            f"  - Ground Risk Buffer: {calculate_grb_size(heights.min()):.2f}-"
+            f"{calculate_grb_size(heights.max()):.2f}m "
+            f"(waypoint heights: {heights.min():.0f}-{heights.max():.0f}m)"
+        )
+    else:
+        if variable_height:
+            print(f"⚠ No waypoint heights in input, using height {height}m")
+        grb_size = calculate_grb_size(height)
+        print(f"  - Ground Risk Buffer: {grb_size:.2f}m (height: {height}m)")
     print(f"  - Adjacent Area: {adj_size}m buffer")
+    vertices = shapely.get_num_coordinates(layers.values)
+    print("  - Vertices: " + ", ".join(
+        f"{name} {int(n):,}" for name, n in zip(layers.index, vertices)
+    ))
+    
+    if return_layers:
+        return layers
     
     return output_kml_path
 
 
+def mission_parameters(extended_data, defaults):
+    """
+    Merge a mission's ExtendedData over the default buffer parameters.
+    
+    Keys are matched case-insensitively, with '-' or ' ' treated as '_'
+    (e.g. 'Height', 'cv-size'). Unknown keys are ignored.
+    
+    Raises:
+        ValueError: A value is invalid (e.g. height="abc"); the message
+            names the key
+    """
+    params = dict(defaults)
+    for key, value in extended_data.items():
+        if key is None or value is None or not value.strip():
+            continue
+        key = key.strip().lower().replace('-', '_').replace(' ', '_')
+        if key in MISSION_PARAMETERS:
+            try:
+                params[key] = MISSION_PARAMETERS[key](value.strip())
+            except ValueError as e:
+                raise ValueError(f"invalid {key}: {e}") from None
+    return params
+
+
+def build_mission_layers(
+    mission,
+    defaults,
+    quad_segs=QUAD_SEGS,
+    simplify=True,
+    metric_crs=METRIC_CRS
+):
+    """
+    Build the safety layers of one mission read by `read_missions`.
+    
+    Runs in a worker process of `generate_mission_margins`.
+    
+    Returns:
+        tuple: (layers GeoSeries in metric CRS, effective parameters)
+    """
+    params = mission_parameters(mission['params'], defaults)
+    gdf = to_metric(gpd.GeoSeries(mission['geometries'], crs='EPSG:4326'), metric_crs)
+    
+    if gdf.geometry.type.isin(['Polygon', 'MultiPolygon']).any():
+        params['fg_size'] = 0
+    
+    layers = build_safety_layers(
+        gdf,
+        quad_segs=quad_segs,
+        vertex_budgets=VERTEX_BUDGETS if simplify else {},
+        **params
+    )
+    return layers, params
+
+
+def generate_mission_margins(
+    input_kml_path,
+    output_kml_path=None,
+    group_by='placemark',
+    max_workers=None,
+    quad_segs=QUAD_SEGS,
+    simplify=True,
+    metric_crs=METRIC_CRS,
+    **defaults
+):
+    """
+    Generate safety margins for every mission in a multi-mission KML.
+    
+    Each Placemark (or top-level Folder, with group_by='folder') is buffered
+    as its own mission, with parameters read from its ExtendedData
+    (see MISSION_PARAMETERS) over `defaults`. Missions are buffered in a
+    process pool.
+    
+    Args:
+        input_kml_path (str): Path to input KML/KMZ file
+        output_kml_path (str): Output KML with one folder per mission (optional)
+        group_by (str): 'placemark' or 'folder'
+        max_workers (int): Process pool size (default: CPU count)
+        quad_segs (int): Buffer segments per quarter circle
+        simplify (bool): Apply the per-layer VERTEX_BUDGETS
+        metric_crs (str): 'utm', 'aeqd' or an explicit CRS, chosen per mission
+        **defaults: fg_size, height, cv_size, adj_size, corner_style,
+            variable_height
+        
+    Returns:
+        dict: {mission name: layers GeoSeries (metric CRS)}, in file order
+    """
+    defaults = {
+        'fg_size': 0,
+        'height': 100,
+        'cv_size': 50,
+        'adj_size': 7500,
+        'corner_style': 'square',
+        'variable_height': False,
+        **defaults
+    }
+    
+    missions = read_missions(input_kml_path, group_by=group_by)
+    if not missions:
+        print("✗ No missions found in KML")
+        return {}
+    
+    # Mission names become folder names, so keep them unique
+    names = []
+    for mission in missions:
+        name, n = mission['name'], 2
+        while name in names:
+            name, n = f"{mission['name']} ({n})", n + 1
+        names.append(name)
+    
+    # A mission with invalid parameters is reported and left out; the
+    # others are still generated
+    validas = []
+    for name, mission in zip(names, missions):
+        try:
+            if mission_parameters(mission['params'], defaults)['variable_height']:
+                check_altitude_modes(mission['altitude_modes'])
+        except ValueError as e:
+            print(f"✗ Mission '{name}' skipped: {e}")
+            continue
+        validas.append((name, mission))
+    if not validas:
+        return {}
+    names = [name for name, _ in validas]
+    missions = [mission for _, mission in validas]
+    
+    build = partial(
+        build_mission_layers, defaults=defaults, quad_segs=quad_segs, simplify=simplify, metric_crs=metric_crs
+    )
+    if len(missions) == 1 or max_workers == 1:
+        built = list(map(build, missions))
+    else:
+        with ProcessPoolExecutor(max_workers=max_workers) as pool:
+            built = list(pool.map(build, missions))
+    
+    mission_layers = {name: layers for name, (layers, _) in zip(names, built)}
+    
+    print(f"✓ Safety margins generated for {len(missions)} missions")
+    for name, (_, params) in zip(names, built):
+        grb = (
+            'per waypoint' if params['variable_height']
+            else f"{calculate_grb_size(params['height']):.2f}m"
+        )
+        print(
+            f"  - {name}: height {params['height']}m, CV {params['cv_size']}m, "
+            f"GRB {grb}"
+        )
+    
+    if output_kml_path is not None:
+        write_kml(
+            output_kml_path,
+            {name: dict(para_wgs84(layers).items())
+             for name, layers in mission_layers.items()},
+            styles=STYLES
+        )
+        print(f"✓ Safety margins KML generated: {output_kml_path}")
+    
+    return mission_layers
+
+
 def main():
     """Command line interface."""
     parser = argparse.ArgumentParser(
@@ -155,7 +636,7 @@ def main():
     )
     parser.add_argument(
         '-o', '--output',
-        help='Output KML file path (optional)',
+        help='Output KML file path, .kmz for compressed output (optional)',
         default=None
     )
     parser.add_argument(
@@ -182,15 +663,69 @@ def main():
         default=5000,
         help='Adjacent Area buffer size in meters (default: 5000)'
     )
+    parser.add_argument(
+        '--variable-height',
+        action='store_true',
+        help='Size the GRB per segment from the waypoint altitudes (Z) of 3D routes'
+    )
     parser.add_argument(
         '--corner-style',
         choices=['square', 'rounded'],
         default='square',
         help='Corner style for buffers (default: square)'
     )
+    parser.add_argument(
+        '--quad-segs',
+        type=int,
+        default=QUAD_SEGS,
+        help=f'Buffer segments per quarter circle (default: {QUAD_SEGS})'
+    )
+    parser.add_argument(
+        '--no-simplify',
+        action='store_true',
+        help='Keep full-resolution layers (disable vertex budgets)'
+    )
+    parser.add_argument(
+        '--metric-crs',
+        default=METRIC_CRS,
+        help="Metric CRS for buffering: 'utm' (zone of the mission), 'aeqd' "
+             "(centred on the mission) or e.g. 'EPSG:31983' (default: utm)"
+    )
+    parser.add_argument(
+        '--multi-mission',
+        choices=['placemark', 'folder'],
+        default=None,
+        help='Treat each Placemark or top-level Folder as a separate mission, '
+             'with parameters from its ExtendedData'
+    )
+    parser.add_argument(
+        '--workers',
+        type=int,
+        default=None,
+        help='Worker processes for --multi-mission (default: CPU count)'
+    )
     
     args = parser.parse_args()
     
+    if args.multi_mission:
+        output = args.output or f"{os.path.splitext(args.input_kml)[0]}_safety_margins.kml"
+        generate_mission_margins(
+            input_kml_path=args.input_kml,
+            output_kml_path=output,
+            group_by=args.multi_mission,
+            max_workers=args.workers,
+            quad_segs=args.quad_segs,
+            simplify=not args.no_simplify,
+            metric_crs=args.metric_crs,
+            fg_size=args.fg_size,
+            height=args.height,
+            cv_size=args.cv_size,
+            adj_size=args.adj_size,
+            corner_style=args.corner_style,
+            variable_height=args.variable_height
+        )
+        return
+    
     generate_safety_margins(
         input_kml_path=args.input_kml,
         output_kml_path=args.output,
@@ -198,7 +733,11 @@ def main():
         height=args.height,
         cv_size=args.cv_size,
         adj_size=args.adj_size,
-        corner_style=args.corner_style
+        corner_style=args.corner_style,
+        quad_segs=args.quad_segs,
+        simplify=not args.no_simplify,
+        metric_crs=args.metric_crs,
+        variable_height=args.variable_height
     )
 
 
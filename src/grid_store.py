@@ -0,0 +1,237 @@
+"""
+AL Drones - Memory-mapped IBGE grid quadrants
+A quadrant shapefile is converted once into flat arrays on disk (cell bounds,
+WKB geometries, attribute columns). Every process opens them memory-mapped:
+the pages live once in the OS page cache, shared by all analysis workers
+(and by containers sharing the dados_ibge volume), instead of one
+GeoDataFrame per process. Queries touch only the cells near the area and
+build geometries for those alone.
+
+Layout of a quadrant folder:
+    meta.json         Cell count, CRS, columns, source file stamp
+    bounds.npy        (n, 4) float64 minx, miny, maxx, maxy per cell
+    ordem.npy         Cell positions sorted by minx
+    xmin_ordenado.npy minx in that order (searched for the area's x range)
+    wkb.bin           Cell geometries, WKB back to back
+    wkb_offsets.npy   (n + 1) int64 start of each geometry in wkb.bin
+    col_<i>.npy       One attribute column (text as UTF-8 bytes)
+    nulo_<i>.npy      Missing values of a text column, if it has any
+"""
+
+import os
+import json
+import mmap
+import shutil
+from contextlib import contextmanager
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import shapely
+
+try:
+    import fcntl
+except ImportError:
+    # Windows: no advisory locks, writers rely on the atomic renames alone
+    fcntl = None
+
+# Bumped when the layout changes, so older folders are rebuilt
+VERSAO = 2
+
+
+def _carimbo(origem):
+    """Size and mtime of the source file: a changed shapefile is converted again."""
+    info = os.stat(origem)
+    return {'size': info.st_size, 'mtime': int(info.st_mtime)}
+
+
+@contextmanager
+def trava_arquivo(caminho):
+    """
+    Exclusive lock across processes (and containers sharing the volume),
+    held on `caminho` (created if missing) for the duration of the block.
+    """
+    os.makedirs(os.path.dirname(caminho) or '.', exist_ok=True)
+    with open(caminho, 'a') as f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def exportar_quadrante(grid, pasta, origem=None):
+    """
+    Write a quadrant GeoDataFrame as memory-mappable arrays.
+
+    The folder is built aside and renamed into place, so readers never see
+    a partial one; processes still mapping a replaced folder keep reading
+    its (unlinked) files.
+
+    Args:
+        grid (GeoDataFrame): Quadrant cells
+        pasta (str): Destination folder
+        origem (str): Source file, stamped so abrir_quadrante can detect a
+            newer one
+    """
+    tmp = f"{pasta}.tmp-{os.getpid()}"
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+    try:
+        geoms = grid.geometry.values
+        bounds = shapely.bounds(geoms)
+        np.save(os.path.join(tmp, 'bounds.npy'), bounds)
+        ordem = np.argsort(bounds[:, 0], kind='stable')
+        np.save(os.path.join(tmp, 'ordem.npy'), ordem)
+        np.save(os.path.join(tmp, 'xmin_ordenado.npy'), bounds[ordem, 0])
+
+        wkb = shapely.to_wkb(geoms)
+        offsets = np.zeros(len(wkb) + 1, dtype=np.int64)
+        np.cumsum([len(w) for w in wkb], out=offsets[1:])
+        with open(os.path.join(tmp, 'wkb.bin'), 'wb') as f:
+            for w in wkb:
+                f.write(w)
+        np.save(os.path.join(tmp, 'wkb_offsets.npy'), offsets)
+
+        colunas, texto, nulos = [], [], []
+        for nome in grid.columns:
+            if nome == grid.geometry.name:
+                continue
+            valores = grid[nome].to_numpy()
+            if not (np.issubdtype(valores.dtype, np.number) or valores.dtype == bool):
+                # None/NaN would be stored as the strings 'None'/'nan': kept
+                # apart as a mask and restored as None
+                faltantes = grid[nome].isna().to_numpy()
+                if faltantes.any():
+                    np.save(os.path.join(tmp, f"nulo_{len(colunas)}.npy"), faltantes)
+                    nulos.append(nome)
+                # Through object: pandas' str dtype with missing values
+                # converts to one-character strings with to_numpy(dtype=str)
+                textos = grid[nome].fillna('').astype(str).to_numpy(dtype=object).astype(str)
+                valores = np.char.encode(textos, 'utf-8')
+                texto.append(nome)
+            np.save(os.path.join(tmp, f"col_{len(colunas)}.npy"), valores)
+            colunas.append(nome)
+
+        largura = bounds[:, 2] - bounds[:, 0]
+        meta = {
+            'version': VERSAO,
+            'cells': len(grid),
+            'crs': grid.crs.to_wkt() if grid.crs is not None else None,
+            'geometry': grid.geometry.name,
+            'order': list(grid.columns),
+            'columns': colunas,
+            'text': texto,
+            'nulls': nulos,
+            'max_width': float(largura.max()) if len(largura) else 0.0,
+            'source': _carimbo(origem) if origem else None
+        }
+        with open(os.path.join(tmp, 'meta.json'), 'w') as f:
+            json.dump(meta, f)
+
+        antiga = f"{pasta}.old-{os.getpid()}"
+        if os.path.exists(pasta):
+            os.rename(pasta, antiga)
+        os.rename(tmp, pasta)
+        shutil.rmtree(antiga, ignore_errors=True)
+    except BaseException:
+        shutil.rmtree(tmp, ignore_errors=True)
+        raise
+
+
+def abrir_quadrante(pasta, origem=None):
+    """
+    Open an exported quadrant memory-mapped (nothing is read until queried).
+
+    Args:
+        pasta (str): Folder written by exportar_quadrante
+        origem (str): Source file; a folder stamped from another version of
+            it is treated as missing
+
+    Returns:
+        dict or None: Quadrant arrays and metadata, None if missing or stale
+    """
+    try:
+        with open(os.path.join(pasta, 'meta.json')) as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if meta.get('version') != VERSAO:
+        return None
+    if origem and os.path.exists(origem) and meta['source'] != _carimbo(origem):
+        return None
+
+    def mapear(nome):
+        return np.load(os.path.join(pasta, nome), mmap_mode='r')
+
+    # A plain mmap: slicing it yields bytes for shapely with no array overhead
+    with open(os.path.join(pasta, 'wkb.bin'), 'rb') as f:
+        wkb = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if os.fstat(f.fileno()).st_size else b''
+    return {
+        'path': pasta,
+        'meta': meta,
+        'bounds': mapear('bounds.npy'),
+        'ordem': mapear('ordem.npy'),
+        'xmin_ordenado': mapear('xmin_ordenado.npy'),
+        'wkb': wkb,
+        'wkb_offsets': mapear('wkb_offsets.npy'),
+        'columns': {nome: mapear(f"col_{i}.npy") for i, nome in enumerate(meta['columns'])},
+        'nulls': {
+            nome: mapear(f"nulo_{i}.npy") for i, nome in enumerate(meta['columns']) if nome in meta['nulls']
+        }
+    }
+
+
+def selecionar_celulas(quadrante, area_geom):
+    """
+    Cells of a memory-mapped quadrant that intersect an area.
+
+    Same cells, order and index as a GeoDataFrame STRtree 'intersects'
+    query: candidates come from a binary search on the sorted minx and a
+    bounds test, then the exact predicate runs on their geometries only.
+
+    Args:
+        quadrante (dict): Quadrant from abrir_quadrante
+        area_geom: Area in the quadrant CRS (preferably prepared)
+
+    Returns:
+        GeoDataFrame: Intersecting cells, indexed by their position
+    """
+    meta = quadrante['meta']
+    xmin, ymin, xmax, ymax = area_geom.bounds
+
+    xs = quadrante['xmin_ordenado']
+    inicio = np.searchsorted(xs, xmin - meta['max_width'], side='left')
+    fim = np.searchsorted(xs, xmax, side='right')
+    candidatos = np.asarray(quadrante['ordem'][inicio:fim])
+    b = quadrante['bounds'][candidatos]
+    candidatos = np.sort(candidatos[(b[:, 2] >= xmin) & (b[:, 1] <= ymax) & (b[:, 3] >= ymin)])
+
+    wkb, offsets = quadrante['wkb'], quadrante['wkb_offsets']
+    inicios, fins = offsets[candidatos].tolist(), offsets[candidatos + 1].tolist()
+    geoms = shapely.from_wkb(
+        [wkb[a:b] for a, b in zip(inicios, fins)]
+    ) if len(candidatos) else np.empty(0, dtype=object)
+    dentro = shapely.intersects(area_geom, geoms)
+    posicoes = candidatos[dentro]
+
+    dados = {}
+    for nome, valores in quadrante['columns'].items():
+        valores = np.asarray(valores[posicoes])
+        if nome in meta['text']:
+            valores = np.char.decode(valores, 'utf-8').astype(object)
+            if nome in quadrante['nulls']:
+                valores[np.asarray(quadrante['nulls'][nome][posicoes])] = None
+        dados[nome] = valores
+    dados[meta['geometry']] = gpd.GeoSeries(geoms[dentro], index=posicoes, crs=meta['crs'])
+    return gpd.GeoDataFrame(
+        pd.DataFrame(dados, index=posicoes)[meta['order']], geometry=meta['geometry'], crs=meta['crs']
+    )
+
+
+def tamanho_quadrante(quadrante):
+    """Bytes mapped by a quadrant (file sizes; resident only as pages are read)."""
+    pasta = quadrante['path']
+    return sum(os.path.getsize(os.path.join(pasta, nome)) for nome in os.listdir(pasta))
@@ -0,0 +1,187 @@
+"""
+AL Drones - Background analysis jobs
+Analyses run as jobs in a bounded thread pool, outside the Streamlit script
+run. Each job reports progress (fraction, message) and may publish a partial
+result (e.g. the statistics while its maps still render); the UI polls the
+job by ID, so reruns and widget interactions never restart the work.
+Identical requests made while a job is in flight attach to it instead of
+starting another (see submeter_job_unico).
+
+Configuration (environment variables):
+    ALDRONES_JOB_WORKERS   Analyses running at the same time (default: 2)
+"""
+
+import os
+import time
+import uuid
+import threading
+import traceback
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+
+JOB_WORKERS = int(os.environ.get('ALDRONES_JOB_WORKERS', '2'))
+
+# Finished jobs kept for polling, oldest dropped first
+MAX_JOBS = 200
+
+_JOBS = OrderedDict()
+_LOCK = threading.Lock()
+# Coalescing key -> ID of the job in flight for it
+_EM_VOO = {}
+_POOL = None
+
+
+def _pool():
+    global _POOL
+
+    with _LOCK:
+        if _POOL is None:
+            _POOL = ThreadPoolExecutor(max_workers=JOB_WORKERS, thread_name_prefix='jobs')
+        return _POOL
+
+
+def _atualizar(job_id, **campos):
+    with _LOCK:
+        job = _JOBS.get(job_id)
+        if job is not None:
+            job.update(campos)
+
+
+def _executar(job_id, fn, args, kwargs):
+    def progresso(fracao, mensagem, resultado=None):
+        # Stages may report from several threads: progress never goes back
+        with _LOCK:
+            job = _JOBS.get(job_id)
+            if job is None:
+                return
+            job['progress'] = max(job['progress'], min(max(float(fracao), 0.0), 1.0))
+            job['message'] = mensagem
+            if resultado is not None:
+                job['partial'] = resultado
+
+    _atualizar(job_id, status='running', started=time.time())
+    try:
+        resultado = fn(*args, progresso=progresso, **kwargs)
+    except Exception as e:
+        print(f"✗ Job {job_id} failed: {e}")
+        _terminar(
+            job_id, status='error', error=str(e), traceback=traceback.format_exc(), finished=time.time()
+        )
+        raise
+    _terminar(job_id, status='done', progress=1.0, result=resultado, finished=time.time())
+    return resultado
+
+
+def _terminar(job_id, **campos):
+    """Final update of a job: later identical requests start a new one."""
+    with _LOCK:
+        job = _JOBS.get(job_id)
+        if job is None:
+            return
+        job.update(campos)
+        if job['key'] is not None and _EM_VOO.get(job['key']) == job_id:
+            del _EM_VOO[job['key']]
+
+
+def _registrar(chave=None):
+    """Register a new queued job (caller holds _LOCK)."""
+    job_id = uuid.uuid4().hex[:12]
+    _JOBS[job_id] = {
+        'id': job_id,
+        'status': 'queued',
+        'progress': 0.0,
+        'message': 'Na fila...',
+        'partial': None,
+        'result': None,
+        'error': None,
+        'traceback': None,
+        'created': time.time(),
+        'started': None,
+        'finished': None,
+        'key': chave,
+        'attached': 0
+    }
+    terminados = [j for j, job in _JOBS.items() if job['status'] in ('done', 'error')]
+    for antigo in terminados[:max(len(terminados) - MAX_JOBS, 0)]:
+        del _JOBS[antigo]
+    if chave is not None:
+        _EM_VOO[chave] = job_id
+    return job_id
+
+
+def submeter_job(fn, *args, **kwargs):
+    """
+    Run `fn(*args, progresso=callback, **kwargs)` as a background job.
+
+    `progresso(fracao, mensagem, resultado=None)` records the job progress
+    (0..1) and, with `resultado`, a partial result readable before the job
+    ends.
+
+    Returns:
+        str: Job ID
+    """
+    pool = _pool()
+    with _LOCK:
+        job_id = _registrar()
+        # Attached before the ID is returned: every visible job has a future
+        _JOBS[job_id]['future'] = pool.submit(_executar, job_id, fn, args, kwargs)
+    return job_id
+
+
+def submeter_job_unico(chave, fn, *args, **kwargs):
+    """
+    Single-flight submeter_job: while a job submitted with the same `chave`
+    is queued or running, its ID is returned instead of starting another,
+    so identical requests share one computation and its result. Once that
+    job ends, the next call with the key starts a new one.
+
+    Args:
+        chave: Hashable key of the work (see population_analysis.chave_analise)
+
+    Returns:
+        tuple: (job ID, whether the request attached to a job in flight)
+    """
+    pool = _pool()
+    with _LOCK:
+        job_id = _EM_VOO.get(chave)
+        if job_id is not None:
+            _JOBS[job_id]['attached'] += 1
+            print(f"✓ Request attached to job {job_id} in flight")
+            return job_id, True
+        job_id = _registrar(chave)
+        _JOBS[job_id]['future'] = pool.submit(_executar, job_id, fn, args, kwargs)
+    return job_id, False
+
+
+def estado_job(job_id):
+    """
+    Snapshot of a job: id, status ('queued', 'running', 'done', 'error'),
+    progress, message, partial, result, error, traceback, timestamps, key
+    and the number of requests attached to it (see submeter_job_unico).
+
+    Returns:
+        dict or None: None for an unknown (or expired) job ID
+    """
+    with _LOCK:
+        job = _JOBS.get(job_id)
+        if job is None:
+            return None
+        return {k: v for k, v in job.items() if k != 'future'}
+
+
+def aguardar_job(job_id, timeout=None):
+    """
+    Block until a job ends and return its result (re-raises its error).
+
+    Raises:
+        ValueError: Unknown (or expired) job ID
+        concurrent.futures.TimeoutError: The job did not end within `timeout`
+            seconds
+    """
+    with _LOCK:
+        job = _JOBS.get(job_id)
+        future = job.get('future') if job is not None else None
+    if future is None:
+        raise ValueError(f"Unknown or expired job: {job_id}")
+    return future.result(timeout)
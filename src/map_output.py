@@ -0,0 +1,195 @@
+"""
+AL Drones - Map image output
+Size-budgeted map files: each figure is rendered once, then encoded as a
+full-resolution export and a small preview in the configured formats
+(WebP, JPEG or palette-quantised PNG). The files are served as bytes from a
+process-wide cache, so Streamlit reruns never read them from disk again.
+Only the serving process fills that cache (see ler_bytes): the render
+workers that write the files never read them back.
+
+Configuration (environment variables):
+    ALDRONES_MAP_FORMAT     Export format: png, png24, webp or jpeg (default: png)
+    ALDRONES_MAP_DPI        Export resolution (default: 150)
+    ALDRONES_PREVIEW_FORMAT Preview format (default: webp)
+    ALDRONES_PREVIEW_PX     Preview longest side in pixels (default: 1600)
+"""
+
+import io
+import os
+import time
+import threading
+from collections import OrderedDict
+
+from PIL import Image
+
+
+# PIL encoder and options per format; 'png' is quantised to a 256 colour
+# palette, 'png24' is the lossless PNG matplotlib writes. zlib level 8 is
+# within 1% of optimize (level 9) on the palette maps at half the time;
+# WebP method 2 is 2x faster than 4 for a 5-10% larger file
+FORMATOS = {
+    'png': {'ext': 'png', 'mime': 'image/png', 'pil': 'PNG', 'cores': 256,
+            'opcoes': {'compress_level': 8}},
+    'png24': {'ext': 'png', 'mime': 'image/png', 'pil': 'PNG',
+              'opcoes': {'compress_level': 6}},
+    'webp': {'ext': 'webp', 'mime': 'image/webp', 'pil': 'WEBP',
+             'opcoes': {'quality': 80, 'method': 2}},
+    'jpeg': {'ext': 'jpg', 'mime': 'image/jpeg', 'pil': 'JPEG',
+             'opcoes': {'quality': 85, 'optimize': True, 'progressive': True}},
+}
+
+MAP_FORMAT = os.environ.get('ALDRONES_MAP_FORMAT', 'png')
+MAP_DPI = int(os.environ.get('ALDRONES_MAP_DPI', '150'))
+PREVIEW_FORMAT = os.environ.get('ALDRONES_PREVIEW_FORMAT', 'webp')
+PREVIEW_PX = int(os.environ.get('ALDRONES_PREVIEW_PX', '1600'))
+
+# File bytes by (path, mtime, size), least recently used first
+MAX_CACHE_BYTES = 256 * 1024 * 1024
+_BYTES_CACHE = OrderedDict()
+_LOCK = threading.Lock()
+
+
+def codificar_imagem(imagem, formato):
+    """
+    Encode a PIL image.
+
+    Args:
+        imagem (PIL.Image): RGB image
+        formato (str): Key of FORMATOS
+
+    Returns:
+        tuple: (bytes, encode seconds)
+    """
+    spec = FORMATOS[formato]
+    t0 = time.perf_counter()
+    if 'cores' in spec:
+        imagem = imagem.quantize(
+            colors=spec['cores'], method=Image.Quantize.FASTOCTREE, dither=Image.Dither.NONE
+        )
+    buf = io.BytesIO()
+    imagem.save(buf, format=spec['pil'], **spec['opcoes'])
+    return buf.getvalue(), time.perf_counter() - t0
+
+
+def reduzir_preview(imagem, preview_px=None):
+    """
+    Preview copy of an image, with its longest side at most `preview_px`.
+
+    Bilinear: Lanczos ringing around the flat map colours makes the
+    preview compress worse for no visible gain.
+    """
+    preview = imagem.copy()
+    preview_px = preview_px or PREVIEW_PX
+    preview.thumbnail((preview_px, preview_px), Image.Resampling.BILINEAR, reducing_gap=2.0)
+    return preview
+
+
+def _gravar(caminho, dados):
+    """Write a file atomically (the bytes cache is filled on its first read)."""
+    tmp = f"{caminho}.{os.getpid()}.tmp"
+    with open(tmp, 'wb') as f:
+        f.write(dados)
+    os.replace(tmp, caminho)
+
+
+def salvar_figura(fig, caminho_base, formato=None, dpi=None, formato_preview=None, preview_px=None):
+    """
+    Render a matplotlib figure once and write its export and preview files.
+
+    Args:
+        fig: Matplotlib figure
+        caminho_base (str): Output path without extension; the preview gets
+            a '_preview' suffix
+        formato (str): Export format (default: MAP_FORMAT)
+        dpi (int): Export resolution (default: MAP_DPI)
+        formato_preview (str): Preview format (default: PREVIEW_FORMAT)
+        preview_px (int): Preview longest side (default: PREVIEW_PX)
+
+    Returns:
+        dict: path, preview_path, mime, preview_mime, size (bytes),
+        preview_size, pixels (width, height), render_s and encode_s
+    """
+    formato = formato or MAP_FORMAT
+    formato_preview = formato_preview or PREVIEW_FORMAT
+    dpi = dpi or MAP_DPI
+    preview_px = preview_px or PREVIEW_PX
+
+    from matplotlib import rcParams
+
+    # One raw RGBA render shared by both encodings. The tight box is found
+    # by a layout-only pass at the export dpi, so savefig draws only once
+    t0 = time.perf_counter()
+    dpi_figura = fig.get_dpi()
+    fig.set_dpi(dpi)
+    try:
+        fig.draw_without_rendering()
+        caixa = fig.get_tightbbox().padded(rcParams['savefig.pad_inches'])
+        buf = io.BytesIO()
+        fig.savefig(buf, format='rgba', dpi=dpi, bbox_inches=caixa)
+    finally:
+        fig.set_dpi(dpi_figura)
+    largura = int(caixa.width * dpi)
+    altura, resto = divmod(buf.tell(), 4 * largura)
+    if resto:
+        raise RuntimeError(f"Unexpected raw canvas size for a {largura} px wide map")
+    imagem = Image.frombuffer('RGBA', (largura, altura), buf.getbuffer(), 'raw', 'RGBA', 0, 1).convert('RGB')
+    render_s = time.perf_counter() - t0
+
+    dados, encode_s = codificar_imagem(imagem, formato)
+    caminho = f"{caminho_base}.{FORMATOS[formato]['ext']}"
+    _gravar(caminho, dados)
+
+    preview = reduzir_preview(imagem, preview_px)
+    dados_preview, encode_preview_s = codificar_imagem(preview, formato_preview)
+    caminho_preview = f"{caminho_base}_preview.{FORMATOS[formato_preview]['ext']}"
+    _gravar(caminho_preview, dados_preview)
+
+    return {
+        'path': caminho,
+        'preview_path': caminho_preview,
+        'mime': FORMATOS[formato]['mime'],
+        'preview_mime': FORMATOS[formato_preview]['mime'],
+        'size': len(dados),
+        'preview_size': len(dados_preview),
+        'pixels': imagem.size,
+        'render_s': render_s,
+        'encode_s': encode_s + encode_preview_s
+    }
+
+
+def _chave(caminho):
+    st = os.stat(caminho)
+    return (os.path.abspath(caminho), st.st_mtime_ns, st.st_size)
+
+
+def _guardar(caminho, dados):
+    with _LOCK:
+        _BYTES_CACHE[_chave(caminho)] = dados
+        total = sum(len(v) for v in _BYTES_CACHE.values())
+        while total > MAX_CACHE_BYTES and len(_BYTES_CACHE) > 1:
+            total -= len(_BYTES_CACHE.popitem(last=False)[1])
+
+
+def ler_bytes(caminho):
+    """
+    Contents of a map file, read from disk once per version of the file.
+
+    Returns:
+        bytes
+    """
+    chave = _chave(caminho)
+    with _LOCK:
+        if chave in _BYTES_CACHE:
+            _BYTES_CACHE.move_to_end(chave)
+            return _BYTES_CACHE[chave]
+    with open(caminho, 'rb') as f:
+        dados = f.read()
+    _guardar(caminho, dados)
+    return dados
+
+
+def formatar_tamanho(n):
+    """Human-readable byte count."""
+    if n >= 1024 * 1024:
+        return f"{n / 1024 / 1024:.1f} MB"
+    return f"{n / 1024:.0f} KB"
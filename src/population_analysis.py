@@ -4,14 +4,35 @@ Analyzes population density in drone flight areas using IBGE data.
 """
 
 import os
+import re
+import json
+import hashlib
 import argparse
+import threading
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import partial
 import requests
+import shutil
 import zipfile
 import io
 import geopandas as gpd
-import matplotlib.pyplot as plt
-import contextily as cx
+import numpy as np
 import pandas as pd
+import shapely
+
+try:
+    from .projection import WEB_MERCATOR, WGS84, extent_mapa, para_crs, para_wgs84, transformar
+    from .web_map import celulas_lod
+    from .generate_safety_margins import VERTEX_BUDGETS, conservative_distance
+    from . import grid_store
+except ImportError:
+    from projection import WEB_MERCATOR, WGS84, extent_mapa, para_crs, para_wgs84, transformar
+    from web_map import celulas_lod
+    from generate_safety_margins import VERTEX_BUDGETS, conservative_distance
+    import grid_store
 
 
 # Configuration
@@ -22,19 +43,64 @@ COLORS = {
     'Adjacent Area': 'blue',
 }
 
+LAYERS_KML = ["Flight Geography", "Contingency Volume", "Ground Risk Buffer", "Adjacent Area"]
+
 ALBERS_BR = (
     "+proj=aea +lat_0=-12 +lon_0=-54 +lat_1=-2 +lat_2=-22 "
     "+x_0=0 +y_0=0 +datum=WGS84 +units=m +no_defs"
 )
 
-# Cache for loaded grids
+# Processes rendering the three layer maps concurrently
+MAP_WORKERS = min(3, os.cpu_count() or 1)
+
+# Padding (degrees) around the layers for the shared basemap: cells
+# intersecting a layer reach up to one 1 km cell beyond it
+FOLGA_BASEMAP = 0.015
+
+# Approximate bytes per shapely geometry besides its coordinates (memory report)
+GEOMETRY_OVERHEAD = 200
+
+# Reach (m) of the Adjacent Area beyond an uploaded route, used to prefetch
+# its quadrants before the parameters are known. The AA is the Contingency
+# Volume (FG + CV) buffered by adj_size, and its vertex budget may grow it by
+# up to twice the simplification tolerance; the GRB plays no part. Sized for
+# the app defaults (FG 50 m, CV 50 m, AA 7500 m, default buffer resolution):
+# quadrants reached only by larger buffers are loaded by the analysis itself.
+FOLGA_PREFETCH_M = 50 + 50 + 7500 + 2 * VERTEX_BUDGETS['Adjacent Area'][1]
+
+# Analyses read the quadrants memory-mapped (see grid_store): one copy in
+# the OS page cache for every process, instead of a GeoDataFrame per process
+GRID_MMAP = os.environ.get('ALDRONES_GRID_MMAP', '1') != '0'
+
+# Version of the population data behind every result (see chave_analise):
+# IBGE 2022 census grid, in the memory-mapped layout of grid_store
+VERSAO_DADOS = f"censo_2022/grid_store-{grid_store.VERSAO}"
+
+# Cache for loaded grids: one copy per process, shared by every Streamlit
+# session; concurrent first loads of the same key are coalesced
 _GRID_CACHE = {}
+_MMAP_CACHE = {}
 _QUADRANT_INDEX = None
+_CACHE_LOCK = threading.Lock()
+_CARREGANDO = {}
+_MAP_POOL = None
+_MAP_THREADS = None
+_PREFETCH_THREADS = None
+# Prefetches started with a key (e.g. an upload ID), newest last
+_PREFETCHES = OrderedDict()
+MAX_PREFETCHES = 64
+
 
+def _caminho_kml(kml_filename):
+    """GDAL path for a KML, reading KMZ through /vsizip/."""
+    if str(kml_filename).lower().endswith('.kmz'):
+        return f"/vsizip/{kml_filename}/doc.kml"
+    return kml_filename
 
-def extrair_layers_kml(kml_filename, layer_names):
-    """Extract and union geometries from KML layers."""
-    gdf = gpd.read_file(kml_filename, driver='KML')
+
+def extrair_layers_kml(kml_filename, layer_names, folder=None):
+    """Extract and union geometries from KML (or KMZ) layers."""
+    gdf = gpd.read_file(_caminho_kml(kml_filename), driver='KML', layer=folder)
     layers_poligonos = {}
     
     for name in layer_names:
@@ -54,36 +120,150 @@ def extrair_layers_kml(kml_filename, layer_names):
     return layers_poligonos
 
 
+def extrair_missoes_kml(kml_filename, layer_names):
+    """
+    Extract the layers of every mission of a multi-mission KML
+    (one folder per mission, as written by generate_mission_margins).
+    
+    Returns:
+        dict: {mission name: {layer name: geometry}}
+    """
+    folders = gpd.list_layers(_caminho_kml(kml_filename))['name']
+    return {
+        folder: extrair_layers_kml(kml_filename, layer_names, folder=folder)
+        for folder in folders
+    }
+
+
+def converter_layers(layers, layer_names):
+    """
+    Convert an in-memory layer mapping to WGS84 geometries.
+    
+    Accepts the GeoSeries returned by `generate_safety_margins(...,
+    return_layers=True)` (any CRS) or a plain dict of WGS84 geometries.
+    """
+    if isinstance(layers, gpd.GeoSeries):
+        if layers.crs is not None:
+            layers = para_wgs84(layers)
+        layers = dict(layers.items())
+    
+    layers_poligonos = {}
+    
+    for name in layer_names:
+        geom = layers.get(name)
+        if geom is None or geom.is_empty:
+            print(f"⚠ Layer '{name}' not found in layers.")
+            continue
+        
+        if geom.geom_type not in ('Polygon', 'MultiPolygon'):
+            print(f"⚠ Layer '{name}' has no polygons.")
+            continue
+        
+        layers_poligonos[name] = geom
+    
+    return layers_poligonos
+
+
+def carregar_uma_vez(chave, carregar, em_cache):
+    """
+    Single-flight load: the first caller of `chave` runs `carregar`, and
+    concurrent callers wait for its result instead of loading again.
+    
+    Args:
+        chave: Key of the load
+        carregar (callable): Loads (and caches) the value
+        em_cache (callable): Cached value or None, checked under the lock
+    
+    Returns:
+        The loaded or cached value
+    """
+    with _CACHE_LOCK:
+        valor = em_cache()
+        if valor is not None:
+            return valor
+        future = _CARREGANDO.get(chave)
+        dono = future is None
+        if dono:
+            future = _CARREGANDO[chave] = Future()
+    
+    if not dono:
+        return future.result()
+    
+    try:
+        valor = carregar()
+    except BaseException as e:
+        with _CACHE_LOCK:
+            _CARREGANDO.pop(chave, None)
+        future.set_exception(e)
+        raise
+    with _CACHE_LOCK:
+        _CARREGANDO.pop(chave, None)
+    future.set_result(valor)
+    return valor
+
+
 def carregar_indice_quadrantes():
     """
     Load the 500km aggregated grid to use as spatial index for quadrants.
     This grid shows which quadrants (grade_id) exist and their boundaries.
+    Loaded once per process (see carregar_uma_vez).
     """
-    global _QUADRANT_INDEX
-    
     if _QUADRANT_INDEX is not None:
         return _QUADRANT_INDEX
+    return carregar_uma_vez('indice', _ler_indice_quadrantes, lambda: _QUADRANT_INDEX)
+
+
+def baixar_shapefile(url, pasta, shp_path, timeout):
+    """
+    Download and extract a zipped shapefile once, safe across processes.
+    
+    The download runs under a lock file, so concurrent workers wait for
+    the first one instead of extracting into the same folder. The archive is
+    extracted aside and moved in with the .shp last, so an existing .shp
+    always has its companion files.
+    
+    Raises:
+        Exception: Download or extraction failed (nothing is left in `pasta`)
+    """
+    with grid_store.trava_arquivo(f"{pasta}.lock"):
+        if os.path.exists(shp_path):
+            return
+        resp = requests.get(url, timeout=timeout)
+        resp.raise_for_status()
+        
+        tmp = f"{pasta}.tmp-{os.getpid()}"
+        shutil.rmtree(tmp, ignore_errors=True)
+        try:
+            with zipfile.ZipFile(io.BytesIO(resp.content)) as z:
+                z.extractall(tmp)
+            os.makedirs(pasta, exist_ok=True)
+            for nome in sorted(os.listdir(tmp), key=lambda n: n.lower().endswith('.shp')):
+                os.replace(os.path.join(tmp, nome), os.path.join(pasta, nome))
+        finally:
+            shutil.rmtree(tmp, ignore_errors=True)
+
+
+def _ler_indice_quadrantes():
+    global _QUADRANT_INDEX
     
     url = "https://geoftp.ibge.gov.br/recortes_para_fins_estatisticos/grade_estatistica/censo_2022/grade_500km/BR500KM.zip"
     pasta = "dados_ibge/grade_500km"
     shp_path = os.path.join(pasta, "BR500KM.shp")
     
     if not os.path.exists(shp_path):
-        os.makedirs(pasta, exist_ok=True)
         print("⬇ Downloading 500km grid index (one-time operation)...")
         try:
-            resp = requests.get(url, timeout=60)
-            resp.raise_for_status()
-            with zipfile.ZipFile(io.BytesIO(resp.content)) as z:
-                z.extractall(pasta)
+            baixar_shapefile(url, pasta, shp_path, timeout=60)
         except Exception as e:
             print(f"✗ Error downloading 500km grid: {e}")
             return None
     
     # Load and convert to WGS84 for easy intersection with KML polygons
-    _QUADRANT_INDEX = gpd.read_file(shp_path).to_crs(epsg=4326)
-    print(f"✓ Quadrant index loaded: {len(_QUADRANT_INDEX)} cells")
-    return _QUADRANT_INDEX
+    indice = gpd.read_file(shp_path).to_crs(epsg=4326)
+    indice.sindex
+    _QUADRANT_INDEX = indice
+    print(f"✓ Quadrant index loaded: {len(indice)} cells")
+    return indice
 
 
 def identificar_grades_relevantes(area_geom):
@@ -98,7 +278,9 @@ def identificar_grades_relevantes(area_geom):
         return []
     
     # Find quadrants that intersect the area
-    intersecting = quadrant_index[quadrant_index.intersects(area_geom)]
+    intersecting = quadrant_index.iloc[
+        quadrant_index.sindex.query(area_geom, predicate='intersects')
+    ]
     
     if intersecting.empty:
         print("⚠ Warning: No quadrants found intersecting the polygon")
@@ -119,41 +301,300 @@ def carregar_grid_ibge(grade_id, use_cache=True):
     Uses the standard IBGE Statistical Grid (Census 2022):
     - Mixed resolution: 1km x 1km (rural) and 200m x 200m (urban)
     - Albers Equal Area projection (SIRGAS2000)
+    
+    With `use_cache`, each quadrant is loaded once per process, however many
+    sessions ask for it at the same time (see carregar_uma_vez).
     """
-    if use_cache and grade_id in _GRID_CACHE:
+    if not use_cache:
+        return _ler_grid_ibge(grade_id), grade_id
+    if grade_id in _GRID_CACHE:
         return _GRID_CACHE[grade_id], grade_id
     
+    def carregar():
+        dados = _ler_grid_ibge(grade_id)
+        if dados is not None:
+            # Build the spatial index once, before other threads can see the grid
+            dados.sindex
+            with _CACHE_LOCK:
+                _GRID_CACHE[grade_id] = dados
+        return dados
+    
+    return carregar_uma_vez(('grade', grade_id), carregar, lambda: _GRID_CACHE.get(grade_id)), grade_id
+
+
+def carregar_quadrante(grade_id):
+    """
+    Cells of a quadrant for the analyses (see filtrar_celulas).
+    
+    With GRID_MMAP, the quadrant memory-mapped (see grid_store), converted
+    from the shapefile on first use; otherwise, or if the grid is already
+    held in memory, the GeoDataFrame of carregar_grid_ibge.
+    
+    Returns:
+        dict or GeoDataFrame or None: None if the quadrant is unavailable
+    """
+    if grade_id in _GRID_CACHE or not GRID_MMAP:
+        return carregar_grid_ibge(grade_id)[0]
+    if grade_id in _MMAP_CACHE:
+        return _MMAP_CACHE[grade_id]
+    return carregar_uma_vez(
+        ('mmap', grade_id), lambda: _mapear_grid_ibge(grade_id),
+        lambda: _MMAP_CACHE.get(grade_id) or _GRID_CACHE.get(grade_id)
+    )
+
+
+def _mapear_grid_ibge(grade_id):
+    shp_path = f"dados_ibge/grade_id{grade_id}/grade_id{grade_id}.shp"
+    pasta = f"dados_ibge/grade_id{grade_id}/celulas"
+    
+    try:
+        quadrante = grid_store.abrir_quadrante(pasta, origem=shp_path)
+    except OSError:
+        # Folder being replaced by another process: opened again under the lock
+        quadrante = None
+    
+    dados = None
+    if quadrante is None:
+        try:
+            # One exporter at a time across processes (and containers): one
+            # that waited here opens the folder the other has just written
+            with grid_store.trava_arquivo(f"{pasta}.lock"):
+                quadrante = grid_store.abrir_quadrante(pasta, origem=shp_path)
+                if quadrante is None:
+                    dados = _ler_grid_ibge(grade_id)
+                    if dados is None:
+                        return None
+                    grid_store.exportar_quadrante(dados, pasta, origem=shp_path)
+                    print(f"  ✓ grade_id{grade_id}: memory-mapped copy written")
+                    quadrante = grid_store.abrir_quadrante(pasta, origem=shp_path)
+        except OSError as e:
+            # Read-only data folder: keep this process's copy in memory
+            print(f"  ⚠ grade_id{grade_id}: memory-mapped copy not written ({e})")
+            quadrante = None
+    
+    if quadrante is None:
+        # Never cache a missing quadrant: the next call tries the folder again
+        dados = dados if dados is not None else _ler_grid_ibge(grade_id)
+        if dados is None:
+            return None
+        dados.sindex
+        with _CACHE_LOCK:
+            _GRID_CACHE[grade_id] = dados
+        return dados
+    
+    with _CACHE_LOCK:
+        _MMAP_CACHE[grade_id] = quadrante
+    return quadrante
+
+
+def _ler_grid_ibge(grade_id):
     url = f"https://geoftp.ibge.gov.br/recortes_para_fins_estatisticos/grade_estatistica/censo_2022/grade_estatistica/grade_id{grade_id}.zip"
     pasta = f"dados_ibge/grade_id{grade_id}"
     shp_path = os.path.join(pasta, f"grade_id{grade_id}.shp")
     
     if not os.path.exists(shp_path):
-        os.makedirs(pasta, exist_ok=True)
         print(f"  ⬇ Downloading grade_id{grade_id}...")
         try:
-            resp = requests.get(url, timeout=30)
-            resp.raise_for_status()
-            with zipfile.ZipFile(io.BytesIO(resp.content)) as z:
-                z.extractall(pasta)
+            baixar_shapefile(url, pasta, shp_path, timeout=30)
         except Exception as e:
             print(f"  ✗ Error downloading grade_id{grade_id}: {e}")
-            return None, grade_id
+            return None
+    
+    return gpd.read_file(shp_path)
+
+
+def relatorio_cache():
+    """
+    Memory report of the process-wide index and grid caches.
+    
+    Geometry memory is estimated from the coordinate count (16 bytes per
+    coordinate plus a per-geometry overhead); attribute columns are measured.
+    Memory-mapped quadrants take no process memory of their own: their file
+    size is reported as Mapeado_MB (pages shared with other processes).
+    
+    Returns:
+        DataFrame: One row per cached item (Item, Celulas, Memoria_MB, Mapeado_MB)
+    """
+    with _CACHE_LOCK:
+        itens = [('Quadrant index', _QUADRANT_INDEX)] if _QUADRANT_INDEX is not None else []
+        itens += [(f"grade_id{gid}", dados) for gid, dados in sorted(_GRID_CACHE.items())]
+        mapeados = sorted(_MMAP_CACHE.items())
+    
+    linhas = []
+    for nome, dados in itens:
+        geoms = dados.geometry.values
+        atributos = dados.drop(columns=dados.geometry.name).memory_usage(deep=True).sum()
+        geometria = int(shapely.get_num_coordinates(geoms).sum()) * 16 + len(geoms) * GEOMETRY_OVERHEAD
+        linhas.append({
+            'Item': nome,
+            'Celulas': len(dados),
+            'Memoria_MB': round((atributos + geometria) / 1e6, 1),
+            'Mapeado_MB': 0.0
+        })
+    for gid, quadrante in mapeados:
+        linhas.append({
+            'Item': f"grade_id{gid} (mmap)",
+            'Celulas': quadrante['meta']['cells'],
+            'Memoria_MB': 0.0,
+            'Mapeado_MB': round(grid_store.tamanho_quadrante(quadrante) / 1e6, 1)
+        })
+    return pd.DataFrame(linhas, columns=['Item', 'Celulas', 'Memoria_MB', 'Mapeado_MB'])
+
+
+def memoria_processo_mb():
+    """Resident memory of this process in MB (None where /proc is unavailable)."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 1e6
+    except (OSError, ValueError):
+        return None
+
+
+def limpar_cache():
+    """Drop the cached index and grids (loads in progress are unaffected)."""
+    global _QUADRANT_INDEX
+    
+    with _CACHE_LOCK:
+        _GRID_CACHE.clear()
+        _MMAP_CACHE.clear()
+        _QUADRANT_INDEX = None
+
+
+def envelope_adjacente(geometrias, folga_m=FOLGA_PREFETCH_M):
+    """
+    Worst-case Adjacent Area of a route: its geometries buffered by `folga_m`.
+    
+    Args:
+        geometrias (GeoSeries): Uploaded route or area, in any CRS
+        folga_m (float): Buffer distance in meters
+    
+    Returns:
+        Polygon or MultiPolygon: Envelope in WGS84
+    """
+    metrico = para_crs(geometrias, ALBERS_BR)
+    # Coarse arcs, inflated so their chords never cut inside `folga_m`
+    envelope = shapely.buffer(metrico.union_all(), conservative_distance(folga_m, 4), quad_segs=4)
+    return transformar(envelope, ALBERS_BR, WGS84)
+
+
+def chave_analise(geometrias, parametros):
+    """
+    Key of an analysis for request coalescing: a hash of the input
+    geometries, the parameters and the population data version.
+    
+    Geometries are normalized (ring orientation, part and feature order),
+    so the same route exported twice gets the same key; Z (waypoint
+    heights) is part of it. Missing and empty geometries (e.g. placemarks
+    without coordinates) are left out.
+    
+    Args:
+        geometrias (GeoSeries): Uploaded route or area
+        parametros (dict): Everything else the result depends on (JSON-able)
+    
+    Returns:
+        str: SHA-256 hex digest
+    """
+    h = hashlib.sha256(VERSAO_DADOS.encode())
+    h.update(json.dumps(parametros, sort_keys=True, default=str).encode())
+    geoms = np.asarray(geometrias.values, dtype=object)
+    geoms = geoms[~(shapely.is_missing(geoms) | shapely.is_empty(geoms))]
+    for wkb in sorted(shapely.to_wkb(shapely.normalize(geoms))):
+        h.update(wkb)
+    return h.hexdigest()
+
+
+def prefetch_quadrantes(geometrias, folga_m=FOLGA_PREFETCH_M, chave=None):
+    """
+    Start loading, in the background, the quadrants a route's analysis will
+    need, so it starts on a warm grid cache.
+    
+    The quadrants are those of the worst-case Adjacent Area (see
+    envelope_adjacente), found before the buffer sizes are chosen. Loads
+    go through carregar_quadrante, so an analysis asking for a quadrant
+    still in flight waits for it instead of downloading it again.
     
-    dados = gpd.read_file(shp_path)
+    Args:
+        geometrias (GeoSeries): Uploaded route or area, in any CRS
+        folga_m (float): Worst-case reach of the Adjacent Area in meters
+        chave (str): Key to find the prefetch again with estado_prefetch
+            (e.g. the upload ID); a key already started is not started twice
     
-    if use_cache:
-        _GRID_CACHE[grade_id] = dados
+    Returns:
+        Future: List of the grade_ids loaded (empty on failure)
+    """
+    global _PREFETCH_THREADS
     
-    return dados, grade_id
+    with _CACHE_LOCK:
+        if _PREFETCH_THREADS is None:
+            _PREFETCH_THREADS = ThreadPoolExecutor(max_workers=2, thread_name_prefix='prefetch')
+        if chave is not None and chave in _PREFETCHES:
+            return _PREFETCHES[chave]
+    
+    def carregar():
+        try:
+            grades = identificar_grades_relevantes(envelope_adjacente(geometrias, folga_m))
+            carregadas = [gid for gid in grades if carregar_quadrante(gid) is not None]
+        except Exception as e:
+            print(f"⚠ Quadrant prefetch failed: {e}")
+            return []
+        print(f"✓ Prefetched {len(carregadas)} quadrants: {carregadas}")
+        return carregadas
+    
+    future = _PREFETCH_THREADS.submit(carregar)
+    if chave is not None:
+        with _CACHE_LOCK:
+            _PREFETCHES[chave] = future
+            while len(_PREFETCHES) > MAX_PREFETCHES:
+                _PREFETCHES.popitem(last=False)
+    return future
 
 
-def desenhar_contornos(ax, layers_poligonos, layer_order):
-    """Draw layer boundaries."""
+def estado_prefetch(chave):
+    """
+    Future of the prefetch started with `chave` (see prefetch_quadrantes).
+    
+    Returns:
+        Future or None: None for an unknown (or forgotten) key
+    """
+    with _CACHE_LOCK:
+        return _PREFETCHES.get(chave)
+
+
+
+def filtrar_celulas(grid, area_geom):
+    """
+    Select the grid cells that intersect the area with one bulk STRtree query.
+    
+    The tree tests every bbox candidate against `area_geom` in a single
+    vectorized call; `area_geom` should be prepared (`shapely.prepare`) by
+    the caller so the same prepared geometry is reused across quadrants.
+    `grid` may also be a memory-mapped quadrant (see carregar_quadrante).
+    """
+    if isinstance(grid, dict):
+        return grid_store.selecionar_celulas(grid, area_geom)
+    idx = grid.sindex.query(area_geom, predicate='intersects')
+    return grid.iloc[np.sort(idx)]
+
+
+def desenhar_contornos(ax, layers_poligonos, layer_order, crs=None):
+    """
+    Draw layer boundaries (WGS84 layers, reprojected to `crs` if given).
+    
+    Added as line collections: GeoSeries.plot redraws the whole figure
+    after each call.
+    """
+    from matplotlib.collections import LineCollection
+    
     for name in layer_order:
         if name in layers_poligonos:
-            gpd.GeoSeries([layers_poligonos[name]]).boundary.plot(
-                ax=ax, color=COLORS[name], linewidth=2
-            )
+            geom = layers_poligonos[name]
+            if crs is not None:
+                geom = transformar(geom, WGS84, crs)
+            linhas = shapely.get_parts(shapely.boundary(geom))
+            ax.add_collection(LineCollection(
+                [shapely.get_coordinates(linha) for linha in linhas], colors=COLORS[name], linewidths=2
+            ))
+    ax.autoscale_view()
 
 
 def extrair_vertices_celula(geometry):
@@ -190,8 +631,7 @@ def calcular_estatisticas(dados_intersec, area_geom=None):
     # Use actual polygon area if provided, otherwise sum of cell areas
     if area_geom is not None:
         # Convert to metric projection and calculate area
-        area_geom_projected = gpd.GeoSeries([area_geom], crs='EPSG:4326').to_crs(ALBERS_BR)
-        area_km2 = float(area_geom_projected.area.iloc[0] / 1e6)
+        area_km2 = float(transformar(area_geom, WGS84, ALBERS_BR).area / 1e6)
     else:
         area_km2 = float((dados_intersec.geometry.area.sum()) / 1e6)
     
@@ -226,7 +666,7 @@ def analisar_celulas_grb(dados_combinados, area_geom):
         return 0, pd.DataFrame()
     
     # Convert to WGS84 to extract vertices
-    celulas_wgs84 = celulas_com_pop.to_crs(epsg=4326)
+    celulas_wgs84 = celulas_com_pop.set_geometry(para_crs(celulas_com_pop.geometry, WGS84))
     
     # Create detailed dataframe with vertices as columns
     detailed_rows = []
@@ -281,15 +721,32 @@ def analisar_celulas_grb(dados_combinados, area_geom):
     return num_cells_above_5, detailed_df
 
 
-def processar_todas_grades(area_geom, titulo, layers_poligonos, layers_para_mostrar, output_path=None, layer_name=None):
+def processar_todas_grades(area_geom, titulo, layers_poligonos, layers_para_mostrar, output_path=None, layer_name=None, vetorial=False, pool_mapas=None, basemap=None, exportacao=None, cog_path=None, progresso=None):
     """
     Process all relevant IBGE grids and create a single combined map.
     Uses 500km grid as spatial index to identify relevant quadrants.
+    Cells are drawn as a raster image unless `vetorial` is True.
+    
+    The stats are computed first; the map is then rendered in `pool_mapas`
+    (inline if None) and returned as a Future under 'map_future'. `basemap`
+    is a Future of a shared base mosaic (see analyze_population), cropped
+    to this map's extent. The cells are kept under 'cells' as a compact
+    table for the interactive map (see web_map).
+    
+    `output_path` is the map path without extension; `exportacao` holds the
+    formats and resolution of the files (see map_output.salvar_figura).
+    With `cog_path`, the population and density of the cells are also
+    written there as a Cloud-Optimized GeoTIFF (see raster_output).
+    `progresso(fracao, mensagem)` is called as quadrants are loaded and the
+    cells filtered (fraction 0..1 of this layer).
     """
     print(f"\n{'='*60}")
     print(f"Processing: {titulo}")
     print(f"{'='*60}")
     
+    # No-op if analyze_population already prepared the layer
+    shapely.prepare(area_geom)
+    
     # Identify relevant grids using 500km index
     grades_relevantes = identificar_grades_relevantes(area_geom)
     
@@ -302,20 +759,17 @@ def processar_todas_grades(area_geom, titulo, layers_poligonos, layers_para_most
     # Collect data from all relevant grids
     todos_dados = []
     
-    for grade_id in grades_relevantes:
-        grid, _ = carregar_grid_ibge(grade_id)
+    for k, grade_id in enumerate(grades_relevantes, 1):
+        grid = carregar_quadrante(grade_id)
+        if progresso:
+            progresso(0.8 * k / len(grades_relevantes), f"Quadrant {k} of {len(grades_relevantes)} loaded")
         
         if grid is None:
             continue
         
         # Use spatial index for fast filtering
         try:
-            possible_matches_idx = list(grid.sindex.intersection(area_geom.bounds))
-            if not possible_matches_idx:
-                continue
-            
-            possible_matches = grid.iloc[possible_matches_idx]
-            dados_filtrados = possible_matches[possible_matches.intersects(area_geom)].copy()
+            dados_filtrados = filtrar_celulas(grid, area_geom).copy()
             
             if not dados_filtrados.empty:
                 print(f"  ✓ grade_id{grade_id}: {len(dados_filtrados)} cells found")
@@ -331,60 +785,135 @@ def processar_todas_grades(area_geom, titulo, layers_poligonos, layers_para_most
     # Combine all data
     dados_combinados = gpd.GeoDataFrame(pd.concat(todos_dados, ignore_index=True))
     print(f"✓ Total cells: {len(dados_combinados)}")
+    if progresso:
+        progresso(0.9, f"{len(dados_combinados)} cells filtered")
     
     # Calculate density in metric projection
-    dados_area = dados_combinados.to_crs(ALBERS_BR)
+    dados_area = dados_combinados.set_geometry(para_crs(dados_combinados.geometry, ALBERS_BR))
     dados_area['area_km2'] = dados_area.geometry.area / 1e6
     dados_area['densidade_pop_km2'] = dados_area['TOTAL'] / dados_area['area_km2']
     dados_combinados['densidade_pop_km2'] = dados_area['densidade_pop_km2'].values
     dados_combinados['area_km2'] = dados_area['area_km2'].values
     
-    # Plot
+    # Statistics
+    total_pessoas, area_km2, densidade_media, densidade_maxima = calcular_estatisticas(dados_area, area_geom)
+    
+    # Additional analysis for Ground Risk Buffer
+    num_cells_above_5 = 0
+    detailed_cells_df = pd.DataFrame()
+    if layer_name == 'Ground Risk Buffer':
+        num_cells_above_5, detailed_cells_df = analisar_celulas_grb(dados_combinados, area_geom)
+    
+    result = {
+        'total_pessoas': total_pessoas,
+        'area_km2': area_km2,
+        'densidade_media': densidade_media,
+        'densidade_maxima': densidade_maxima,
+        # Compact cells for the interactive map (see web_map)
+        'cells': celulas_lod(dados_area)
+    }
+    
+    if layer_name == 'Ground Risk Buffer':
+        result['num_cells_above_5'] = num_cells_above_5
+        result['detailed_cells'] = detailed_cells_df
+    
+    if cog_path:
+        try:
+            from .raster_output import escrever_cog
+        except ImportError:
+            from raster_output import escrever_cog
+        
+        try:
+            if escrever_cog(result['cells'], cog_path, ALBERS_BR):
+                result['cog_path'] = cog_path
+                print(f"✓ COG saved: {cog_path}")
+        except Exception as e:
+            print(f"✗ Error writing COG: {e}")
+    
+    # Map: rendered after the stats, in the render pool if one is given
+    if output_path:
+        layers_mapa = {name: layers_poligonos[name] for name in layers_para_mostrar if name in layers_poligonos}
+        extent = extent_mapa(
+            [dados_combinados.total_bounds] + [geom.bounds for geom in layers_mapa.values()]
+        )
+        info_texto = (
+            f"Total population: {int(total_pessoas):,}\n"
+            f"Polygon area: {area_km2:.2f} km²\n"
+            f"Average density: {densidade_media:.2f} pop/km²\n"
+            f"Maximum density: {densidade_maxima:.2f} pop/km²"
+        ).replace(",", ".")
+        result['map_future'] = enviar_renderizacao(
+            pool_mapas,
+            renderizar_mapa,
+            dados_combinados[['densidade_pop_km2', 'geometry']],
+            dados_area[['geometry']],
+            titulo,
+            layers_mapa,
+            layers_para_mostrar,
+            info_texto,
+            output_path,
+            vetorial,
+            exportacao,
+            extent=extent,
+            basemap=basemap
+        )
+    
+    return result
+
+
+def renderizar_mapa(dados_combinados, dados_area, titulo, layers_poligonos, layers_para_mostrar, info_texto, output_path, vetorial=False, exportacao=None, extent=None, basemap=None):
+    """
+    Draw and save one population density map, in EPSG:3857.
+    
+    Runs in a render pool worker (see analyze_population): matplotlib is not
+    thread-safe, so maps are rendered in separate processes.
+    
+    Args:
+        output_path (str): Map path without extension
+        exportacao (dict): Keyword arguments of map_output.salvar_figura
+            (formats, dpi and preview size)
+        extent (tuple): Map extent in EPSG:3857 (default: autoscale)
+        basemap (dict): Base mosaic covering `extent` (see
+            tile_cache.mosaico_3857); fetched at an adaptive zoom if None
+    
+    Returns:
+        dict: Export and preview paths, sizes and timings (see
+        map_output.salvar_figura)
+    """
+    # Plotting modules are only imported once a map is rendered
+    import matplotlib.pyplot as plt
+    try:
+        from .map_output import formatar_tamanho, salvar_figura
+        from .rendering import desenhar_celulas, formatar_eixos_graus
+        from .tile_cache import adicionar_basemap
+    except ImportError:
+        from map_output import formatar_tamanho, salvar_figura
+        from rendering import desenhar_celulas, formatar_eixos_graus
+        from tile_cache import adicionar_basemap
+    
     fig, ax = plt.subplots(figsize=(24, 24))
-    dados_combinados.plot(
-        column='densidade_pop_km2',
-        ax=ax,
-        legend=True,
-        cmap='YlOrBr',
-        alpha=0.6,
-        edgecolor='black',
-        linewidth=0.2,
-        legend_kwds={'shrink': 0.3, 'label': 'Density (pop/km²)'}
-    )
+    desenhar_celulas(ax, dados_combinados, dados_area, crs_albers=ALBERS_BR, vetorial=vetorial)
+    
+    desenhar_contornos(ax, layers_poligonos, layers_para_mostrar, crs=WEB_MERCATOR)
     
-    desenhar_contornos(ax, layers_poligonos, layers_para_mostrar)
+    if extent is not None:
+        minx, miny, maxx, maxy = extent
+        ax.set_xlim(minx, maxx)
+        ax.set_ylim(miny, maxy)
+    ax.set_aspect('equal')
+    formatar_eixos_graus(ax)
     
     ax.set_title(titulo, fontsize=18, fontweight='bold')
     ax.set_xlabel("Longitude [deg]", fontsize=14)
     ax.set_ylabel("Latitude [deg]", fontsize=14)
     
     try:
-        cx.add_basemap(
-            ax,
-            crs=dados_combinados.crs.to_string(),
-            source=cx.providers.OpenStreetMap.Mapnik,
-            alpha=0.6,
-            zoom=13
-        )
+        info = adicionar_basemap(ax, base=basemap, alpha=0.6)
+        if info['unavailable']:
+            print(f"⚠ Basemap incomplete: {info['unavailable']}/{info['tiles']} tiles unavailable")
     except Exception as e:
         print(f"⚠ Could not add basemap: {e}")
     
-    # Statistics
-    total_pessoas, area_km2, densidade_media, densidade_maxima = calcular_estatisticas(dados_area, area_geom)
-    
-    # Additional analysis for Ground Risk Buffer
-    num_cells_above_5 = 0
-    detailed_cells_df = pd.DataFrame()
-    if layer_name == 'Ground Risk Buffer':
-        num_cells_above_5, detailed_cells_df = analisar_celulas_grb(dados_combinados, area_geom)
-    
-    info_texto = (
-        f"Total population: {int(total_pessoas):,}\n"
-        f"Polygon area: {area_km2:.2f} km²\n"
-        f"Average density: {densidade_media:.2f} pop/km²\n"
-        f"Maximum density: {densidade_maxima:.2f} pop/km²"
-    ).replace(",", ".")
-    
     ax.text(
         0.0, -0.10,
         info_texto,
@@ -394,52 +923,209 @@ def processar_todas_grades(area_geom, titulo, layers_poligonos, layers_para_most
         bbox=dict(facecolor='white', alpha=0.85)
     )
     
-    if output_path:
-        plt.savefig(output_path, dpi=150, bbox_inches='tight')
-        print(f"✓ Map saved: {output_path}")
+    info = salvar_figura(fig, output_path, **(exportacao or {}))
+    print(
+        f"✓ Map saved: {info['path']} ({formatar_tamanho(info['size'])}, "
+        f"preview {formatar_tamanho(info['preview_size'])}; "
+        f"render {info['render_s']:.1f}s, encode {info['encode_s']:.1f}s)"
+    )
     
-    plt.close()
+    plt.close(fig)
+    return info
+
+
+def construir_basemap(layers_poligonos):
+    """
+    Base mosaic covering all layer maps of a mission, at the zoom of the
+    widest (Adjacent Area) map. Each map crops it instead of fetching its own.
+    """
+    try:
+        from .tile_cache import mosaico_3857
+    except ImportError:
+        from tile_cache import mosaico_3857
+    
+    extent = extent_mapa([geom.bounds for geom in layers_poligonos.values()], folga=FOLGA_BASEMAP)
+    base = mosaico_3857(extent)
+    print(f"✓ Basemap: zoom {base['zoom']}, {base['tiles']} tiles (shared by all maps)")
+    return base
+
+
+def _recortar_basemap(basemap, extent):
+    """Crop of the shared base mosaic for one map (None: the map fetches its own)."""
+    if basemap is None:
+        return None
+    try:
+        from .tile_cache import recortar_mosaico
+    except ImportError:
+        from tile_cache import recortar_mosaico
     
-    result = {
-        'total_pessoas': total_pessoas,
-        'area_km2': area_km2,
-        'densidade_media': densidade_media,
-        'densidade_maxima': densidade_maxima
-    }
+    try:
+        return recortar_mosaico(basemap.result(), extent)
+    except Exception as e:
+        print(f"⚠ Could not build shared basemap: {e}")
+        return None
+
+
+def obter_pool_mapas(max_workers=MAP_WORKERS, quebrado=None):
+    """
+    Process pool shared by all map renders of this process (created once,
+    with the size of the first call).
     
-    if layer_name == 'Ground Risk Buffer':
-        result['num_cells_above_5'] = num_cells_above_5
-        result['detailed_cells'] = detailed_cells_df
+    Uses 'spawn' so workers never inherit the locks of a threaded parent
+    (e.g. the Streamlit server).
     
-    return result
+    Args:
+        max_workers (int): Pool size, if it is created by this call
+        quebrado (ProcessPoolExecutor): A pool that raised BrokenProcessPool
+            (e.g. a worker killed for memory); if it is still the shared
+            one, it is replaced by a new pool
+    """
+    global _MAP_POOL
+    
+    with _CACHE_LOCK:
+        if quebrado is not None and _MAP_POOL is quebrado:
+            print("⚠ Map render pool broken, starting a new one")
+            _MAP_POOL = None
+            quebrado.shutdown(wait=False, cancel_futures=True)
+        if _MAP_POOL is None:
+            _MAP_POOL = ProcessPoolExecutor(
+                max_workers=max_workers,
+                mp_context=multiprocessing.get_context('spawn')
+            )
+        return _MAP_POOL
 
 
-def analyze_population(kml_file, output_dir='results'):
+def obter_threads_mapas():
+    """Threads that fetch the shared basemap and hand renders to the pool."""
+    global _MAP_THREADS
+    
+    with _CACHE_LOCK:
+        if _MAP_THREADS is None:
+            _MAP_THREADS = ThreadPoolExecutor(max_workers=16, thread_name_prefix='mapas')
+        return _MAP_THREADS
+
+
+def enviar_renderizacao(pool, fn, *args, extent=None, basemap=None):
+    """
+    Submit a render to `pool`, or run it inline (completed Future) if None.
+    
+    `fn` receives `extent` and the crop of the `basemap` Future for it. With
+    a pool, waiting for the basemap happens in a thread, so this never blocks.
+    """
+    if pool is not None:
+        def despachar():
+            base = _recortar_basemap(basemap, extent)
+            atual = pool
+            # A pool broken by an earlier render is replaced (the shared one
+            # may have been replaced already, and broken again since)
+            for tentativa in range(3):
+                try:
+                    future = atual.submit(fn, *args, extent=extent, basemap=base)
+                    break
+                except BrokenProcessPool:
+                    if tentativa == 2:
+                        raise
+                    atual = obter_pool_mapas(quebrado=atual)
+            try:
+                return future.result()
+            except BrokenProcessPool:
+                # A worker died during this render (e.g. killed for memory):
+                # it fails, later renders get a new pool
+                obter_pool_mapas(quebrado=atual)
+                raise
+        return obter_threads_mapas().submit(despachar)
+    
+    future = Future()
+    try:
+        future.set_result(fn(*args, extent=extent, basemap=_recortar_basemap(basemap, extent)))
+    except Exception as e:
+        future.set_exception(e)
+    return future
+
+
+def analyze_population(kml_file, output_dir='results', vector_maps=False, map_workers=MAP_WORKERS, wait_maps=True, render=True, map_format=None, map_dpi=None, preview_px=None, cog=False, progresso=None):
     """
     Main function to analyze population density from safety margins KML.
     
     Args:
-        kml_file (str): Path to KML file with safety margins
+        kml_file (str or GeoSeries or dict): Path to KML file with safety
+            margins, or the layer mapping returned by
+            `generate_safety_margins(..., return_layers=True)`
         output_dir (str): Directory to save output maps
+        vector_maps (bool): Draw cells as polygons instead of a raster image
+        map_workers (int): Render the maps in a shared process pool of this
+            size; 1 renders them inline, one after another (unless
+            `wait_maps` is False)
+        wait_maps (bool): Wait for the maps before returning. If False, the
+            stats are returned as soon as they are computed and each layer
+            carries a 'map_future' (Future resolving to the map info, see
+            below) to await or poll
+        render (bool): Render the maps. With False (headless, stats only)
+            no figure is built, no basemap is fetched and matplotlib is
+            never imported
+        map_format (str): Map export format: 'png' (quantised), 'png24',
+            'webp' or 'jpeg' (default: map_output.MAP_FORMAT)
+        map_dpi (int): Map export resolution (default: map_output.MAP_DPI)
+        preview_px (int): Longest side of the preview image written next to
+            each map (default: map_output.PREVIEW_PX)
+        cog (bool): Also write each layer's population and density as a
+            Cloud-Optimized GeoTIFF in the grid projection (requires
+            rasterio); the path is returned under 'cog_path'
+        progresso (callable): Called as `progresso(fracao, mensagem)` with
+            the overall progress (0..1): quadrants loaded and cells filtered
+            per layer, then each map rendered
         
     Returns:
-        dict: Statistics for each analyzed layer
+        dict: Statistics for each analyzed layer. When waiting for the maps,
+        each layer has 'map_path' and 'map_info' (export and preview paths,
+        byte sizes, render/encode seconds); otherwise 'map_future'
     """
     os.makedirs(output_dir, exist_ok=True)
     
-    layers_kml = ["Flight Geography", "Contingency Volume", "Ground Risk Buffer", "Adjacent Area"]
+    layers_kml = LAYERS_KML
     
     print("="*60)
     print("AL DRONES - Population Analysis Tool")
     print("="*60)
     
-    # Extract KML polygons
-    layers_poligonos = extrair_layers_kml(kml_file, layers_kml)
+    # Extract KML polygons (or take the in-memory layers as they are)
+    if isinstance(kml_file, (str, os.PathLike)):
+        layers_poligonos = extrair_layers_kml(kml_file, layers_kml)
+    else:
+        layers_poligonos = converter_layers(kml_file, layers_kml)
     
     if not layers_poligonos:
         print("✗ No valid layers found in KML")
         return None
     
+    # Prepare each layer once; reused by every quadrant query below
+    for geom in layers_poligonos.values():
+        shapely.prepare(geom)
+    
+    pool_mapas = None
+    if render and (map_workers > 1 or not wait_maps):
+        pool_mapas = obter_pool_mapas(max(map_workers, 1))
+    
+    def caminho_mapa(nome):
+        return os.path.join(output_dir, nome) if render else None
+    
+    exportacao = {'formato': map_format, 'dpi': map_dpi, 'preview_px': preview_px}
+    
+    def caminho_cog(nome):
+        return os.path.join(output_dir, nome) if cog else None
+    
+    # Share of the progress per layer's stats; the rest is for the maps
+    fim_stats = 0.7 if render else 1.0
+    
+    def etapa(i, nome):
+        if progresso is None:
+            return None
+        inicio, fim = fim_stats * i / 3, fim_stats * (i + 1) / 3
+        return lambda fracao, mensagem: progresso(inicio + (fim - inicio) * fracao, f"{nome}: {mensagem}")
+    
+    # One basemap for all three maps, fetched while the stats are computed
+    basemap = obter_threads_mapas().submit(construir_basemap, layers_poligonos) if render else None
+    
     results = {}
     
     # Plot 1 — Flight Geography
@@ -448,8 +1134,14 @@ def analyze_population(kml_file, output_dir='results'):
         titulo="Population Density - Flight Geography",
         layers_poligonos=layers_poligonos,
         layers_para_mostrar=['Flight Geography'],
-        output_path=os.path.join(output_dir, 'map_flight_geography.png'),
-        layer_name='Flight Geography'
+        output_path=caminho_mapa('map_flight_geography'),
+        progresso=etapa(0, 'Flight Geography'),
+        cog_path=caminho_cog('density_flight_geography.tif'),
+        layer_name='Flight Geography',
+        vetorial=vector_maps,
+        pool_mapas=pool_mapas,
+        basemap=basemap,
+        exportacao=exportacao
     )
     if stats:
         results['Flight Geography'] = stats
@@ -460,8 +1152,14 @@ def analyze_population(kml_file, output_dir='results'):
         titulo="Population Density - Ground Risk Buffer",
         layers_poligonos=layers_poligonos,
         layers_para_mostrar=['Flight Geography', 'Contingency Volume', 'Ground Risk Buffer'],
-        output_path=os.path.join(output_dir, 'map_ground_risk_buffer.png'),
-        layer_name='Ground Risk Buffer'
+        output_path=caminho_mapa('map_ground_risk_buffer'),
+        progresso=etapa(1, 'Ground Risk Buffer'),
+        cog_path=caminho_cog('density_ground_risk_buffer.tif'),
+        layer_name='Ground Risk Buffer',
+        vetorial=vector_maps,
+        pool_mapas=pool_mapas,
+        basemap=basemap,
+        exportacao=exportacao
     )
     if stats:
         results['Ground Risk Buffer'] = stats
@@ -481,14 +1179,46 @@ def analyze_population(kml_file, output_dir='results'):
             titulo="Population Density - Adjacent Area",
             layers_poligonos=layers_poligonos,
             layers_para_mostrar=['Flight Geography', 'Contingency Volume', 'Ground Risk Buffer', 'Adjacent Area'],
-            output_path=os.path.join(output_dir, 'map_adjacent_area.png'),
-            layer_name='Adjacent Area'
+            output_path=caminho_mapa('map_adjacent_area'),
+            progresso=etapa(2, 'Adjacent Area'),
+            cog_path=caminho_cog('density_adjacent_area.tif'),
+            layer_name='Adjacent Area',
+            vetorial=vector_maps,
+            pool_mapas=pool_mapas,
+            basemap=basemap,
+            exportacao=exportacao
         )
         if stats:
             results['Adjacent Area'] = stats
     else:
         print("⚠ Cannot generate Adjacent Area plot: missing required layers.")
     
+    mapas = [stats['map_future'] for stats in results.values() if 'map_future' in stats]
+    if progresso:
+        progresso(fim_stats, "Statistics ready" + (", rendering maps" if mapas else ""))
+        prontos = []
+        lock = threading.Lock()
+        
+        def mapa_pronto(_future):
+            with lock:
+                prontos.append(_future)
+                k = len(prontos)
+            progresso(fim_stats + (1 - fim_stats) * k / len(mapas), f"Map {k} of {len(mapas)} rendered")
+        
+        for future in mapas:
+            future.add_done_callback(mapa_pronto)
+    
+    if wait_maps:
+        for layer, stats in results.items():
+            future = stats.pop('map_future', None)
+            if future is None:
+                continue
+            try:
+                stats['map_info'] = future.result()
+                stats['map_path'] = stats['map_info']['path']
+            except Exception as e:
+                print(f"✗ {layer}: Error rendering map - {e}")
+    
     print("\n" + "="*60)
     print("✓ Analysis complete!")
     print("="*60)
@@ -496,6 +1226,68 @@ def analyze_population(kml_file, output_dir='results'):
     return results
 
 
+def analyze_missions(missions, output_dir='results', max_workers=None, vector_maps=False, render=True, map_format=None, map_dpi=None, cog=False):
+    """
+    Analyze several missions in a process pool and write a consolidated report.
+    
+    Args:
+        missions (dict): {mission name: layers}, e.g. from
+            generate_mission_margins or extrair_missoes_kml
+        output_dir (str): Directory; each mission gets its own subdirectory
+        max_workers (int): Process pool size (default: CPU count)
+        vector_maps (bool): Draw cells as polygons instead of a raster image
+        render (bool): Render the maps (False: stats and report only)
+        map_format (str): Map export format (see analyze_population)
+        map_dpi (int): Map export resolution
+        cog (bool): Also write density COGs per layer (see analyze_population)
+        
+    Returns:
+        dict: {mission name: statistics as returned by analyze_population}
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    
+    nomes = list(missions)
+    pastas = [
+        os.path.join(output_dir, f"{i:02d}_" + (re.sub(r'[^\w.-]+', '_', nome).strip('_') or 'missao'))
+        for i, nome in enumerate(nomes, 1)
+    ]
+    layers = [missions[nome] for nome in nomes]
+    
+    analisar = partial(
+        analyze_population, vector_maps=vector_maps, wait_maps=True, render=render,
+        map_format=map_format, map_dpi=map_dpi, cog=cog
+    )
+    if len(nomes) == 1 or max_workers == 1:
+        resultados = list(map(partial(analisar, map_workers=MAP_WORKERS), layers, pastas))
+    else:
+        # Missions already run in parallel: each renders its maps inline
+        with ProcessPoolExecutor(max_workers=max_workers) as pool:
+            resultados = list(pool.map(partial(analisar, map_workers=1), layers, pastas))
+    
+    resultados = dict(zip(nomes, resultados))
+    
+    # Consolidated report: one row per mission and layer
+    linhas = []
+    for nome, pasta in zip(nomes, pastas):
+        for layer, stats in (resultados[nome] or {}).items():
+            linhas.append({
+                'Missao': nome,
+                'Camada': layer,
+                'Populacao_Total': int(stats['total_pessoas']),
+                'Area_km2': round(stats['area_km2'], 4),
+                'Densidade_Media_hab_km2': round(stats['densidade_media'], 2),
+                'Densidade_Maxima_hab_km2': round(stats['densidade_maxima'], 2),
+                'Celulas_Acima_5_hab_km2': stats.get('num_cells_above_5'),
+                'Pasta': pasta,
+            })
+    
+    relatorio_path = os.path.join(output_dir, 'relatorio_missoes.csv')
+    pd.DataFrame(linhas).to_csv(relatorio_path, index=False)
+    print(f"✓ Consolidated report saved: {relatorio_path} ({len(nomes)} missions)")
+    
+    return resultados
+
+
 def main():
     """Command line interface."""
     parser = argparse.ArgumentParser(
@@ -511,9 +1303,60 @@ def main():
         help='Output directory for maps (default: results/)'
     )
     
+    parser.add_argument(
+        '--multi-mission',
+        action='store_true',
+        help='Analyze every mission folder of a multi-mission safety margins KML'
+    )
+    parser.add_argument(
+        '--workers',
+        type=int,
+        default=None,
+        help='Worker processes for --multi-mission (default: CPU count)'
+    )
+    parser.add_argument(
+        '--vector-maps',
+        action='store_true',
+        help='Draw grid cells as polygons instead of a raster image (slower)'
+    )
+    parser.add_argument(
+        '--no-maps',
+        action='store_true',
+        help='Headless mode: compute the statistics only, without rendering maps'
+    )
+    parser.add_argument(
+        '--map-format',
+        choices=['png', 'png24', 'webp', 'jpeg'],
+        default=None,
+        help='Map export format; png is palette-quantised (default: png)'
+    )
+    parser.add_argument(
+        '--map-dpi',
+        type=int,
+        default=None,
+        help='Map export resolution (default: 150)'
+    )
+    parser.add_argument(
+        '--cog',
+        action='store_true',
+        help='Also write population/density Cloud-Optimized GeoTIFFs per layer (requires rasterio)'
+    )
+    
     args = parser.parse_args()
     
-    analyze_population(args.kml_file, args.output_dir)
+    if args.multi_mission:
+        missions = extrair_missoes_kml(args.kml_file, LAYERS_KML)
+        analyze_missions(
+            missions, args.output_dir, max_workers=args.workers,
+            vector_maps=args.vector_maps, render=not args.no_maps,
+            map_format=args.map_format, map_dpi=args.map_dpi, cog=args.cog
+        )
+    else:
+        analyze_population(
+            args.kml_file, args.output_dir,
+            vector_maps=args.vector_maps, render=not args.no_maps,
+            map_format=args.map_format, map_dpi=args.map_dpi, cog=args.cog
+        )
 
 
 if __name__ == '__main__':
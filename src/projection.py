@@ -0,0 +1,156 @@
+"""
+AL Drones - Projection helpers
+Per-mission metric CRS selection and cached pyproj transformers.
+"""
+
+import weakref
+from functools import lru_cache
+
+import geopandas as gpd
+import numpy as np
+import pyproj
+import shapely
+
+
+WGS84 = 'EPSG:4326'
+WEB_MERCATOR = 'EPSG:3857'
+
+# WGS84 copies of metric layer series, keyed by id() while the series lives
+_WGS84_CACHE = {}
+
+# Widest extent (degrees of longitude) still buffered in a single UTM zone
+UTM_MAX_SPAN = 6.0
+
+
+def utm_epsg(lon, lat):
+    """
+    EPSG code of the UTM zone containing (lon, lat).
+
+    SIRGAS 2000 zones (17N-22N, 17S-25S) cover Brazil; WGS 84 zones are used
+    elsewhere.
+    """
+    zone = min(int((lon + 180) // 6) + 1, 60)
+    if lat < 0 and 17 <= zone <= 25:
+        return 31960 + zone
+    if lat >= 0 and 17 <= zone <= 22:
+        return 31954 + zone
+    return (32700 if lat < 0 else 32600) + zone
+
+
+def escolher_crs_metrico(bounds, metodo='utm'):
+    """
+    Choose a metric CRS for a mission from its WGS84 bounds.
+
+    Args:
+        bounds (tuple): (minx, miny, maxx, maxy) in WGS84
+        metodo (str): 'utm' (zone of the mission centre) or 'aeqd' (azimuthal
+            equidistant centred on the mission). 'utm' falls back to 'aeqd'
+            for missions wider than UTM_MAX_SPAN degrees. Any other value is
+            taken as an explicit CRS (e.g. 'EPSG:31983').
+
+    Returns:
+        str: CRS definition usable by pyproj/geopandas
+    """
+    minx, miny, maxx, maxy = bounds
+    lon, lat = (minx + maxx) / 2, (miny + maxy) / 2
+
+    if metodo == 'utm' and maxx - minx <= UTM_MAX_SPAN:
+        return f"EPSG:{utm_epsg(lon, lat)}"
+    if metodo in ('utm', 'aeqd'):
+        # Centre rounded to ~1 km so nearby missions share a cached transformer
+        return (
+            f"+proj=aeqd +lat_0={lat:.2f} +lon_0={lon:.2f} "
+            "+datum=WGS84 +units=m +no_defs"
+        )
+    return metodo
+
+
+@lru_cache(maxsize=64)
+def get_transformer(crs_from, crs_to):
+    """Cached, thread-safe pyproj Transformer (always lon/lat axis order)."""
+    return pyproj.Transformer.from_crs(crs_from, crs_to, always_xy=True)
+
+
+def transformar(geoms, crs_from, crs_to):
+    """
+    Transform a geometry or geometry array with a cached transformer.
+
+    Z values are kept for 3D geometries.
+    """
+    transformer = get_transformer(str(crs_from), str(crs_to))
+
+    def xy(coords):
+        return np.column_stack(transformer.transform(coords[:, 0], coords[:, 1]))
+
+    def xyz(coords):
+        x, y = transformer.transform(coords[:, 0], coords[:, 1])
+        return np.column_stack([x, y, coords[:, 2]])
+
+    arr = np.asarray(geoms, dtype=object)
+    if arr.ndim == 0:
+        geom = arr.item()
+        if shapely.has_z(geom):
+            return shapely.transform(geom, xyz, include_z=True)
+        return shapely.transform(geom, xy)
+
+    out = np.empty(arr.shape, dtype=object)
+    has_z = shapely.has_z(arr)
+    out[~has_z] = shapely.transform(arr[~has_z], xy)
+    if has_z.any():
+        out[has_z] = shapely.transform(arr[has_z], xyz, include_z=True)
+    return out
+
+
+def extent_mercator(bounds):
+    """
+    EPSG:3857 extent of WGS84 (minx, miny, maxx, maxy) bounds.
+
+    Exact for bounding boxes: Mercator maps meridians and parallels to
+    vertical and horizontal lines.
+    """
+    minx, miny, maxx, maxy = bounds
+    xs, ys = get_transformer(WGS84, WEB_MERCATOR).transform([minx, maxx], [miny, maxy])
+    return xs[0], ys[0], xs[1], ys[1]
+
+
+def extent_mapa(bounds_list, folga=0.0, margem=0.05):
+    """
+    EPSG:3857 extent of a map showing all WGS84 `bounds_list`.
+
+    Args:
+        bounds_list (list): (minx, miny, maxx, maxy) tuples in WGS84
+        folga (float): Extra padding in degrees around the bounds
+        margem (float): Relative margin, as matplotlib's autoscale adds
+    """
+    bounds = np.asarray(bounds_list, dtype=float)
+    minx, miny, maxx, maxy = extent_mercator((
+        bounds[:, 0].min() - folga, bounds[:, 1].min() - folga,
+        bounds[:, 2].max() + folga, bounds[:, 3].max() + folga
+    ))
+    dx, dy = (maxx - minx) * margem, (maxy - miny) * margem
+    return minx - dx, miny - dy, maxx + dx, maxy + dy
+
+
+def para_crs(series, crs):
+    """GeoSeries.to_crs through the cached transformers."""
+    return gpd.GeoSeries(
+        transformar(series.values, series.crs.to_string(), crs),
+        index=series.index,
+        crs=crs
+    )
+
+
+def para_wgs84(layers):
+    """
+    WGS84 copy of a metric layer GeoSeries, computed once per series.
+
+    The copy is memoised for the lifetime of `layers`, so the analysis and
+    the KML export of the same mission share one inverse transform.
+    """
+    if layers.crs is None or layers.crs.equals(WGS84):
+        return layers
+    key = id(layers)
+    if key not in _WGS84_CACHE:
+        _WGS84_CACHE[key] = para_crs(layers, WGS84)
+        weakref.finalize(layers, _WGS84_CACHE.pop, key, None)
+    return _WGS84_CACHE[key]
@@ -0,0 +1,196 @@
+"""
+AL Drones - Georeferenced density rasters
+Cloud-Optimized GeoTIFFs of population and density per layer, for GIS use.
+The IBGE cells are axis-aligned squares of the grid projection, so each cell
+is written straight into a block of whole pixels (no polygon rasterisation).
+"""
+
+import os
+
+import numpy as np
+
+# Creation options of the GDAL COG driver: 512 px tiles, DEFLATE with the
+# floating point predictor, and averaged overviews down to one tile
+COG_OPCOES = {
+    'COMPRESS': 'DEFLATE',
+    'PREDICTOR': '3',
+    'BLOCKSIZE': '512',
+    'OVERVIEWS': 'AUTO',
+    'RESAMPLING': 'AVERAGE',
+    'BIGTIFF': 'IF_SAFER'
+}
+
+BANDAS = ('population', 'density_pop_km2')
+
+# Side (px) of the blocks escrever_cog burns and writes one at a time; only
+# blocks holding cells are allocated, so memory follows the cell count and
+# not the layer bbox (a long diagonal route spans a huge, mostly empty one)
+BLOCO = 512
+# Pixel cap of raster_celulas, which builds the whole images in memory
+# (two float32 bands: 128 MB)
+MAX_PIXELS = 16 * 2**20
+# GDAL block cache (MB) while writing; its default, 5% of the RAM, is held
+# by every render worker writing a COG
+GDAL_CACHE_MB = 64
+
+
+def _pixels_celulas(celulas):
+    """
+    Pixels covered by a cell table on its common lattice.
+
+    Returns:
+        tuple or None: (rows, cols, population, density) per pixel, the
+        image shape and (x0, y0 top-left, pixel size); None if the cells
+        are not on a common lattice
+    """
+    x = celulas['x'].to_numpy(dtype=float)
+    y = celulas['y'].to_numpy(dtype=float)
+    tamanho = np.round(celulas['tamanho'].to_numpy(dtype=float))
+    if len(x) == 0:
+        return None
+
+    res = tamanho.min()
+    x0, y0 = x.min(), (y + tamanho).max()
+    col = (x - x0) / res
+    row = (y0 - (y + tamanho)) / res
+    lado = tamanho / res
+    if not all(np.allclose(v, np.round(v), atol=0.01) for v in (col, row, lado)):
+        return None
+    col, row, lado = (np.round(v).astype(np.int64) for v in (col, row, lado))
+
+    pop = celulas['populacao'].to_numpy(dtype=float)
+    area = celulas['area_km2'].to_numpy(dtype=float)
+    dens = np.divide(pop, area, out=np.zeros_like(pop), where=area > 0)
+
+    # A cell of side n fills n x n pixels, each with 1/n² of its population
+    partes = []
+    for n in np.unique(lado):
+        idx = np.flatnonzero(lado == n)
+        for i in range(n):
+            for j in range(n):
+                partes.append((row[idx] + i, col[idx] + j, pop[idx] / (n * n), dens[idx]))
+    linhas, colunas, populacao, densidade = (np.concatenate(v) for v in zip(*partes))
+
+    shape = (int((row + lado).max()), int((col + lado).max()))
+    return (linhas, colunas, populacao, densidade), shape, (x0, y0, res)
+
+
+def _blocos(pixels, shape, bloco=BLOCO):
+    """Yield (row, col, population, density) of each block holding cells."""
+    linhas, colunas, populacao, densidade = pixels
+    por_linha = -(-shape[1] // bloco)
+    chave = (linhas // bloco) * por_linha + colunas // bloco
+    ordem = np.argsort(chave, kind='stable')
+    chaves, inicios = np.unique(chave[ordem], return_index=True)
+    for k, idx in zip(chaves, np.split(ordem, inicios[1:])):
+        r0, c0 = int(k // por_linha) * bloco, int(k % por_linha) * bloco
+        forma = (min(bloco, shape[0] - r0), min(bloco, shape[1] - c0))
+        pop = np.full(forma, np.nan, dtype=np.float32)
+        dens = np.full(forma, np.nan, dtype=np.float32)
+        pop[linhas[idx] - r0, colunas[idx] - c0] = populacao[idx]
+        dens[linhas[idx] - r0, colunas[idx] - c0] = densidade[idx]
+        yield r0, c0, pop, dens
+
+
+def raster_celulas(celulas):
+    """
+    Burn a cell table into population and density images.
+
+    The pixel is the smallest cell side; larger cells (1 km among 200 m)
+    fill n x n pixels, each with 1/n² of the cell population. The images
+    span the whole cell bbox: use escrever_cog for large layers.
+
+    Args:
+        celulas (DataFrame): x, y (lower-left corner), tamanho, populacao and
+            area_km2 per cell, in the grid projection (see web_map.celulas_lod)
+
+    Returns:
+        tuple or None: (population, density, (x0, y0 top-left, pixel size)),
+        float32 images with NaN outside the cells; None if the cells are not
+        on a common lattice
+
+    Raises:
+        ValueError: If the images would exceed MAX_PIXELS
+    """
+    grade = _pixels_celulas(celulas)
+    if grade is None:
+        return None
+    pixels, shape, origem = grade
+    if shape[0] * shape[1] > MAX_PIXELS:
+        raise ValueError(
+            f"Raster of {shape[1]} x {shape[0]} px exceeds {MAX_PIXELS} px; "
+            "write it by blocks with escrever_cog"
+        )
+
+    populacao = np.full(shape, np.nan, dtype=np.float32)
+    densidade = np.full(shape, np.nan, dtype=np.float32)
+    linhas, colunas, pop, dens = pixels
+    populacao[linhas, colunas] = pop
+    densidade[linhas, colunas] = dens
+    return populacao, densidade, origem
+
+
+def escrever_cog(celulas, caminho, crs):
+    """
+    Write the population and density of a cell table as a two-band COG.
+
+    Only the BLOCO x BLOCO blocks holding cells are burnt and written, into
+    a sparse tiled GeoTIFF next to `caminho` that is then copied as a COG,
+    so memory does not grow with the empty part of the bbox.
+
+    Args:
+        celulas (DataFrame): Cell table (see raster_celulas)
+        caminho (str): Output .tif path
+        crs (str): Grid projection of the cell table
+
+    Returns:
+        str or None: `caminho`, or None if the cells are not lattice squares
+    """
+    import rasterio
+    import rasterio.shutil
+    from rasterio.crs import CRS
+    from rasterio.transform import from_origin
+    from rasterio.windows import Window
+
+    grade = _pixels_celulas(celulas)
+    if grade is None:
+        print(f"⚠ Cells are not lattice squares, COG not written: {caminho}")
+        return None
+    pixels, shape, (x0, y0, res) = grade
+
+    perfil = {
+        'driver': 'GTiff',
+        'width': shape[1],
+        'height': shape[0],
+        'count': len(BANDAS),
+        'dtype': 'float32',
+        'crs': CRS.from_user_input(crs),
+        'transform': from_origin(x0, y0, res, res),
+        'nodata': np.nan,
+        # Tiled and sparse: blocks without cells are never written or stored
+        'tiled': True,
+        'blockxsize': BLOCO,
+        'blockysize': BLOCO,
+        'compress': 'DEFLATE',
+        'sparse_ok': True,
+        'BIGTIFF': 'IF_SAFER'
+    }
+    # The COG driver only copies datasets: build on disk by blocks, then copy
+    temporario = f"{caminho}.{os.getpid()}.tmp.tif"
+    try:
+        with rasterio.Env(GDAL_CACHEMAX=GDAL_CACHE_MB):
+            with rasterio.open(temporario, 'w', **perfil) as ds:
+                for r0, c0, populacao, densidade in _blocos(pixels, shape):
+                    janela = Window(c0, r0, populacao.shape[1], populacao.shape[0])
+                    ds.write(populacao, 1, window=janela)
+                    ds.write(densidade, 2, window=janela)
+                for i, nome in enumerate(BANDAS, 1):
+                    ds.set_band_description(i, nome)
+                ds.update_tags(1, units='people per pixel')
+                ds.update_tags(2, units='people/km2')
+            with rasterio.open(temporario) as src:
+                rasterio.shutil.copy(src, caminho, driver='COG', **COG_OPCOES)
+    finally:
+        if os.path.exists(temporario):
+            os.remove(temporario)
+    return caminho
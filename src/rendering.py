@@ -0,0 +1,318 @@
+"""
+AL Drones - Map rendering helpers
+Raster rendering of IBGE grid cells on EPSG:3857 maps: cell densities are
+burnt into one RGBA image, instead of one matplotlib patch per cell. The
+basemap tiles are EPSG:3857 too, so they need no warping. Both are drawn by
+a FundoRaster, composited once at the device resolution of the axes.
+"""
+
+import numpy as np
+import shapely
+from matplotlib import colormaps
+from matplotlib.artist import Artist
+from matplotlib.cm import ScalarMappable
+from matplotlib.colors import Normalize
+from matplotlib.ticker import FuncFormatter
+from PIL import Image
+
+try:
+    from .projection import WEB_MERCATOR, extent_mercator, get_transformer, para_crs
+except ImportError:
+    from projection import WEB_MERCATOR, extent_mercator, get_transformer, para_crs
+
+
+# Image pixels per (smallest) cell side, and cap on the image side (cells
+# smaller than a pixel still mark the pixel holding their centre)
+PIXELS_POR_CELULA = 4
+MAX_PIXELS = 2000
+
+# Sphere radius of EPSG:3857
+RAIO_MERCATOR = 6378137.0
+
+
+def reticulado_celulas(geoms_albers):
+    """
+    Lattice position of each grid cell from its bounds in the grid projection.
+
+    The IBGE cells are axis-aligned squares (200 m urban, 1 km rural) in
+    Albers. Cells are grouped by size; within a group, a cell is identified
+    by its integer (column, row) from the group's origin.
+
+    Returns:
+        list[tuple] or None: (size, x0, y0, cols, rows, cell positions) per
+        cell size, or None if the cells are not lattice squares
+    """
+    bounds = shapely.bounds(geoms_albers)
+    largura = bounds[:, 2] - bounds[:, 0]
+    altura = bounds[:, 3] - bounds[:, 1]
+    tamanhos = np.round(largura)
+    if len(bounds) == 0 or not np.allclose(largura, altura, atol=1) or (tamanhos <= 0).any():
+        return None
+
+    grupos = []
+    for tamanho in np.unique(tamanhos):
+        idx = np.flatnonzero(tamanhos == tamanho)
+        x0, y0 = bounds[idx, 0].min(), bounds[idx, 1].min()
+        cols = (bounds[idx, 0] - x0) / tamanho
+        rows = (bounds[idx, 1] - y0) / tamanho
+        if not (np.allclose(cols, np.round(cols), atol=0.01)
+                and np.allclose(rows, np.round(rows), atol=0.01)):
+            return None
+        grupos.append((tamanho, x0, y0, np.round(cols).astype(np.int64),
+                       np.round(rows).astype(np.int64), idx))
+    return grupos
+
+
+def rasterizar_celulas(geoms_albers, valores, crs_albers, extent, crs_mapa=WEB_MERCATOR, max_pixels=MAX_PIXELS, grupos=None):
+    """
+    Burn cell values into an image grid of the map CRS.
+
+    Each pixel centre is projected to the grid CRS and looked up in the
+    lattice of the cells (exact, no polygon rasterisation). When the pixel
+    cap makes pixels larger than cells, each cell also marks the pixel that
+    holds its centre (keeping the highest value), so no cell is dropped.
+
+    Args:
+        geoms_albers (array): Cell polygons in `crs_albers`
+        valores (array): Value per cell
+        crs_albers (str): Projection in which the cells are lattice squares
+        extent (tuple): (minx, miny, maxx, maxy) of the image in `crs_mapa`
+        crs_mapa (str): CRS of the map axes
+        max_pixels (int or tuple): Cap on the image width/height, or
+            (max width, max height)
+        grupos (list): reticulado_celulas of the cells, if already known
+
+    Returns:
+        ndarray or None: (rows, cols) image, NaN where there is no cell
+        (None if the cells are not lattice squares)
+    """
+    grupos = reticulado_celulas(geoms_albers) if grupos is None else grupos
+    if grupos is None:
+        return None
+
+    minx, miny, maxx, maxy = extent
+    transformer = get_transformer(crs_mapa, crs_albers)
+    max_cols, max_rows = (max_pixels, max_pixels) if np.ndim(max_pixels) == 0 else max_pixels
+
+    # Map units per grid metre along each image edge
+    xs, ys = transformer.transform([minx, maxx, minx], [miny, miny, maxy])
+    escala_x = (maxx - minx) / max(np.hypot(xs[1] - xs[0], ys[1] - ys[0]), 1e-9)
+    escala_y = (maxy - miny) / max(np.hypot(xs[2] - xs[0], ys[2] - ys[0]), 1e-9)
+    passo_m = min(g[0] for g in grupos) / PIXELS_POR_CELULA
+    ideal_cols = np.ceil((maxx - minx) / (passo_m * escala_x))
+    ideal_rows = np.ceil((maxy - miny) / (passo_m * escala_y))
+    ncols = int(np.clip(ideal_cols, 1, max(max_cols, 1)))
+    nrows = int(np.clip(ideal_rows, 1, max(max_rows, 1)))
+
+    px = minx + (np.arange(ncols) + 0.5) * (maxx - minx) / ncols
+    py = maxy - (np.arange(nrows) + 0.5) * (maxy - miny) / nrows
+    px, py = np.meshgrid(px, py)
+    x, y = transformer.transform(px.ravel(), py.ravel())
+
+    imagem = np.full(x.shape, np.nan)
+    valores = np.asarray(valores, dtype=float)
+    for tamanho, x0, y0, cols, rows, idx in grupos:
+        # Cell keys of the group, sorted for a vectorised lookup
+        largura = cols.max() + 1
+        chaves = rows * largura + cols
+        ordem = np.argsort(chaves)
+        chaves = chaves[ordem]
+
+        col = np.floor((x - x0) / tamanho).astype(np.int64)
+        row = np.floor((y - y0) / tamanho).astype(np.int64)
+        dentro = (col >= 0) & (col < largura) & (row >= 0) & (row <= rows.max())
+        chave_px = row[dentro] * largura + col[dentro]
+
+        pos = np.minimum(np.searchsorted(chaves, chave_px), len(chaves) - 1)
+        achou = chaves[pos] == chave_px
+        alvo = np.flatnonzero(dentro)[achou]
+        imagem[alvo] = valores[idx[ordem[pos[achou]]]]
+
+    imagem = imagem.reshape(nrows, ncols)
+    if ncols < ideal_cols or nrows < ideal_rows:
+        inverso = get_transformer(crs_albers, crs_mapa)
+        for tamanho, x0, y0, cols, rows, idx in grupos:
+            cx, cy = inverso.transform(x0 + (cols + 0.5) * tamanho, y0 + (rows + 0.5) * tamanho)
+            c = np.floor((np.asarray(cx) - minx) / (maxx - minx) * ncols).astype(np.int64)
+            r = np.floor((maxy - np.asarray(cy)) / (maxy - miny) * nrows).astype(np.int64)
+            ok = (c >= 0) & (c < ncols) & (r >= 0) & (r < nrows)
+            np.fmax.at(imagem, (r[ok], c[ok]), valores[idx[ok]])
+
+    return imagem
+
+
+class FundoRaster(Artist):
+    """
+    Raster layers of an EPSG:3857 axes (basemap, cells) drawn as one image.
+
+    At draw time each layer is resampled with PIL straight to the pixel box
+    of the axes and alpha-composited in order, so matplotlib neither
+    resamples nor blends full-canvas images. The composite is reused while
+    the box size and view are unchanged.
+    Use fundo_raster(ax) to get the one of an axes.
+    """
+
+    def __init__(self, ax):
+        super().__init__()
+        self.axes = ax
+        self.set_zorder(0)
+        self.set_in_layout(False)
+        self.camadas = []
+        self._chave = None
+        self._imagem = None
+
+    def adicionar(self, fonte, extent, alpha=1.0, ordem=0, suave=False):
+        """
+        Add a layer covering `extent` (minx, miny, maxx, maxy).
+
+        Args:
+            fonte: RGBA uint8 array (first row at the top), or a function
+                (max width, max height) -> array, called at draw time with
+                the device pixels the extent spans
+            alpha (float): Layer opacity
+            ordem (int): Layers are composited by increasing `ordem`
+            suave (bool): Bilinear resampling instead of nearest
+        """
+        self.camadas.append((ordem, len(self.camadas), fonte, tuple(extent), alpha, suave))
+        self._chave = None
+        self.stale = True
+
+    def _compor(self, largura, altura, vista):
+        vx0, vy0, vx1, vy1 = vista
+        sx, sy = largura / (vx1 - vx0), altura / (vy1 - vy0)
+        fundo = Image.new('RGBA', (largura, altura), (0, 0, 0, 0))
+        for _, _, fonte, (ex0, ey0, ex1, ey1), alpha, suave in sorted(self.camadas, key=lambda c: c[:2]):
+            # Output pixels covered by the layer, clipped to the axes
+            c0, c1 = (int(round(np.clip((v - vx0) * sx, 0, largura))) for v in (ex0, ex1))
+            r0, r1 = (int(round(np.clip((vy1 - v) * sy, 0, altura))) for v in (ey1, ey0))
+            if c1 <= c0 or r1 <= r0:
+                continue
+            if callable(fonte):
+                fonte = fonte(int(np.ceil((ex1 - ex0) * sx)), int(np.ceil((ey1 - ey0) * sy)))
+                if fonte is None:
+                    continue
+            ih, iw = fonte.shape[:2]
+            # The same pixels in the layer image
+            fx, fy = iw / (ex1 - ex0), ih / (ey1 - ey0)
+            caixa = (
+                np.clip((vx0 + c0 / sx - ex0) * fx, 0, iw), np.clip((ey1 - (vy1 - r0 / sy)) * fy, 0, ih),
+                np.clip((vx0 + c1 / sx - ex0) * fx, 0, iw), np.clip((ey1 - (vy1 - r1 / sy)) * fy, 0, ih)
+            )
+            parte = Image.fromarray(np.ascontiguousarray(fonte), 'RGBA').resize(
+                (c1 - c0, r1 - r0),
+                Image.Resampling.BILINEAR if suave else Image.Resampling.NEAREST,
+                box=tuple(float(v) for v in caixa)
+            )
+            if alpha < 1:
+                parte.putalpha(parte.getchannel('A').point([round(a * alpha) for a in range(256)]))
+            fundo.alpha_composite(parte, (c0, r0))
+        return np.array(fundo)
+
+    def draw(self, renderer):
+        if not self.get_visible() or not self.camadas:
+            return
+        caixa = self.axes.bbox
+        x0, y0 = int(round(caixa.x0)), int(round(caixa.y0))
+        largura, altura = int(round(caixa.width)), int(round(caixa.height))
+        if largura <= 0 or altura <= 0:
+            return
+        # Keyed on size and view only: a sub-pixel shift of the box (e.g.
+        # the tight-bbox pass of savefig) reuses the composite
+        chave = (largura, altura, tuple(self.axes.viewLim.bounds))
+        if chave != self._chave:
+            (vx0, vy0), (vx1, vy1) = self.axes.transData.inverted().transform(
+                [(x0, y0), (x0 + largura, y0 + altura)]
+            )
+            self._imagem = self._compor(largura, altura, (vx0, vy0, vx1, vy1))
+            self._chave = chave
+
+        gc = renderer.new_gc()
+        gc.set_clip_rectangle(caixa)
+        renderer.draw_image(gc, x0, y0, self._imagem[::-1])
+        gc.restore()
+        self.stale = False
+
+
+def fundo_raster(ax):
+    """The FundoRaster of an axes (created on first use)."""
+    for filho in ax.get_children():
+        if isinstance(filho, FundoRaster):
+            return filho
+    fundo = FundoRaster(ax)
+    ax.add_artist(fundo)
+    return fundo
+
+
+def desenhar_celulas(ax, dados_combinados, dados_area, coluna='densidade_pop_km2',
+                     crs_albers=None, cmap='YlOrBr', alpha=0.6, vetorial=False):
+    """
+    Draw grid cells coloured by `coluna` on EPSG:3857 axes, with a colorbar.
+
+    Cells are drawn as one RGBA image layer of the axes FundoRaster;
+    `vetorial=True` (or cells that are not lattice squares) falls back to one
+    polygon per cell.
+
+    Args:
+        ax: Matplotlib axes in EPSG:3857
+        dados_combinados (GeoDataFrame): Cells in WGS84
+        dados_area (GeoDataFrame): Same cells in `crs_albers`
+        coluna (str): Column to colour by
+        crs_albers (str): Projection in which the cells are lattice squares
+        cmap (str): Colormap name
+        alpha (float): Cell opacity
+        vetorial (bool): Draw polygons instead of an image
+    """
+    valores = dados_combinados[coluna].to_numpy(dtype=float)
+    legenda = {'shrink': 0.3, 'label': 'Density (pop/km²)'}
+
+    grupos = None
+    if not vetorial:
+        grupos = reticulado_celulas(dados_area.geometry.values)
+        if grupos is None:
+            print("⚠ Cells are not lattice squares, drawing polygons")
+
+    if grupos is None:
+        dados_combinados.set_geometry(para_crs(dados_combinados.geometry, WEB_MERCATOR)).plot(
+            column=coluna,
+            ax=ax,
+            legend=True,
+            cmap=cmap,
+            alpha=alpha,
+            edgecolor='black',
+            linewidth=0.2,
+            legend_kwds=legenda
+        )
+        return
+
+    norm = Normalize(vmin=np.nanmin(valores), vmax=np.nanmax(valores))
+    extent = extent_mercator(dados_combinados.total_bounds)
+
+    def imagem_rgba(max_cols, max_rows):
+        # Burnt at draw time, at no more pixels than the map shows
+        imagem = rasterizar_celulas(
+            dados_area.geometry.values, valores, crs_albers or dados_area.crs, extent,
+            max_pixels=(min(max_cols, MAX_PIXELS), min(max_rows, MAX_PIXELS)), grupos=grupos
+        )
+        rgba = colormaps[cmap](norm(imagem), bytes=True)
+        rgba[..., 3] = np.where(np.isnan(imagem), 0, round(alpha * 255))
+        return rgba
+
+    minx, miny, maxx, maxy = extent
+    fundo_raster(ax).adicionar(imagem_rgba, extent, ordem=1)
+    ax.update_datalim([(minx, miny), (maxx, maxy)])
+    ax.autoscale_view()
+    ax.figure.colorbar(ScalarMappable(norm=norm, cmap=cmap), ax=ax, **legenda)
+
+
+def _lon(x, _pos=None):
+    return f"{np.degrees(x / RAIO_MERCATOR):.2f}"
+
+
+def _lat(y, _pos=None):
+    return f"{np.degrees(2 * np.arctan(np.exp(y / RAIO_MERCATOR)) - np.pi / 2):.2f}"
+
+
+def formatar_eixos_graus(ax):
+    """Label EPSG:3857 axes ticks in degrees of longitude/latitude."""
+    ax.xaxis.set_major_formatter(FuncFormatter(_lon))
+    ax.yaxis.set_major_formatter(FuncFormatter(_lat))
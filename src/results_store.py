@@ -0,0 +1,387 @@
+"""
+AL Drones - Managed result storage
+Each analysis writes its files (maps, rasters, KML, CSV) into its own folder
+of a shared store instead of a leaked temporary directory; large tables are
+spilled there too and read back memory-mapped, a slice at a time. Results expire
+after a time without access, each session keeps only its latest results
+(a result shared by several sessions stays while any of them keeps it),
+and the whole store is held under a size quota by evicting the least
+recently used results; a background janitor applies these rules.
+
+Configuration (environment variables):
+    ALDRONES_RESULTS_DIR         Store folder (default: <system temp>/aldrones_results)
+    ALDRONES_RESULTS_TTL         Seconds a result is kept without access (default: 21600)
+    ALDRONES_RESULTS_MAX_MB      Size quota of the whole store (default: 2048)
+    ALDRONES_RESULTS_PER_SESSION Results kept per session (default: 3)
+    ALDRONES_RESULTS_JANITOR_S   Seconds between janitor passes (default: 300)
+"""
+
+import os
+import time
+import uuid
+import shutil
+import hashlib
+import zipfile
+import tempfile
+import mimetypes
+import threading
+from collections import OrderedDict
+
+
+RESULTS_DIR = os.environ.get(
+    'ALDRONES_RESULTS_DIR', os.path.join(tempfile.gettempdir(), 'aldrones_results')
+)
+TTL_S = float(os.environ.get('ALDRONES_RESULTS_TTL', '21600'))
+MAX_MB = float(os.environ.get('ALDRONES_RESULTS_MAX_MB', '2048'))
+POR_SESSAO = int(os.environ.get('ALDRONES_RESULTS_PER_SESSION', '3'))
+JANITOR_S = float(os.environ.get('ALDRONES_RESULTS_JANITOR_S', '300'))
+
+# Results by ID, least recently used first
+_RESULTADOS = OrderedDict()
+_LOCK = threading.Lock()
+_JANITOR = None
+
+# Stored as is in ZIP bundles: compressing them again gains nothing
+JA_COMPRIMIDOS = ('.png', '.webp', '.jpg', '.jpeg', '.tif', '.tiff', '.zip', '.kmz', '.arrow')
+
+mimetypes.add_type('application/vnd.google-earth.kml+xml', '.kml')
+mimetypes.add_type('application/vnd.google-earth.kmz', '.kmz')
+mimetypes.add_type('image/webp', '.webp')
+
+
+def _tamanho_pasta(pasta):
+    total = 0
+    for raiz, _, arquivos in os.walk(pasta):
+        for nome in arquivos:
+            try:
+                total += os.path.getsize(os.path.join(raiz, nome))
+            except OSError:
+                # Removed (or renamed by an atomic write) meanwhile
+                pass
+    return total
+
+
+def _livre(resultado):
+    """Whether a result may be evicted: not pinned and no file being generated."""
+    return not resultado['pinned'] and not resultado['readers']
+
+
+def _apagar(resultado_id, motivo):
+    """Drop a result from the registry and disk (caller holds _LOCK)."""
+    resultado = _RESULTADOS.pop(resultado_id)
+    shutil.rmtree(resultado['path'], ignore_errors=True)
+    print(f"✓ Result {resultado_id} removed ({motivo})")
+
+
+def criar_resultado(sessao):
+    """
+    Create the folder of a new result, owned by `sessao`.
+
+    The result is pinned (never evicted) until `liberar_resultado` is
+    called, so files still being written are safe from the janitor. Older
+    results of the same session beyond POR_SESSAO are released by it, and
+    removed unless another session shares them (see compartilhar_resultado).
+
+    Args:
+        sessao (str): ID of the owning session
+
+    Returns:
+        tuple: (result ID, folder path)
+    """
+    _iniciar_janitor()
+    resultado_id = uuid.uuid4().hex[:12]
+    pasta = os.path.join(RESULTS_DIR, resultado_id)
+    os.makedirs(pasta)
+
+    agora = time.time()
+    with _LOCK:
+        _RESULTADOS[resultado_id] = {
+            'id': resultado_id,
+            # Sessions holding the result (see compartilhar_resultado)
+            'sessions': {sessao},
+            'path': pasta,
+            'created': agora,
+            'accessed': agora,
+            'pinned': True,
+            'readers': 0,
+            'size': 0
+        }
+        da_sessao = [r for r, res in _RESULTADOS.items() if sessao in res['sessions'] and _livre(res)]
+        for antigo in da_sessao[:max(len(da_sessao) - POR_SESSAO + 1, 0)]:
+            _RESULTADOS[antigo]['sessions'].discard(sessao)
+            if not _RESULTADOS[antigo]['sessions']:
+                _apagar(antigo, 'session quota')
+    return resultado_id, pasta
+
+
+def compartilhar_resultado(resultado_id, sessao):
+    """
+    Count a result against `sessao` too, e.g. one computed once for several
+    sessions' identical requests: each session's quota then only releases
+    its own hold, and the result stays while another session still keeps it.
+
+    Returns:
+        bool: Whether the result is still stored
+    """
+    with _LOCK:
+        resultado = _RESULTADOS.get(resultado_id)
+        if resultado is None:
+            return False
+        resultado['sessions'].add(sessao)
+        return True
+
+
+def liberar_resultado(resultado_id):
+    """Unpin a result once all its files are written (see criar_resultado)."""
+    with _LOCK:
+        resultado = _RESULTADOS.get(resultado_id)
+        if resultado is not None:
+            resultado['pinned'] = False
+            resultado['size'] = _tamanho_pasta(resultado['path'])
+
+
+def existe_resultado(resultado_id):
+    """Whether a result is still stored (marks it as accessed)."""
+    with _LOCK:
+        if resultado_id not in _RESULTADOS:
+            return False
+        _RESULTADOS[resultado_id]['accessed'] = time.time()
+        _RESULTADOS.move_to_end(resultado_id)
+        return True
+
+
+def arquivo_resultado(resultado_id, nome, gerar=None):
+    """
+    Path of a file of a result, for downloads.
+
+    Args:
+        resultado_id (str): Result ID
+        nome (str): File name inside the result folder
+        gerar (callable): Writes the file, given its path, if it does not
+            exist yet (e.g. a KML or CSV produced only when downloaded)
+
+    Returns:
+        str: File path
+
+    Raises:
+        KeyError: The result has expired or was evicted
+    """
+    if not existe_resultado(resultado_id):
+        raise KeyError(resultado_id)
+    with _LOCK:
+        resultado = _RESULTADOS[resultado_id]
+        resultado['readers'] += 1
+    try:
+        caminho = os.path.join(resultado['path'], nome)
+        if gerar is not None and not os.path.exists(caminho):
+            # Same extension, so writers that pick a format by it still work
+            tmp = os.path.join(resultado['path'], f".{threading.get_ident()}.{nome}")
+            try:
+                gerar(tmp)
+                os.replace(tmp, caminho)
+            except BaseException:
+                if os.path.exists(tmp):
+                    os.unlink(tmp)
+                raise
+            with _LOCK:
+                resultado['size'] += os.path.getsize(caminho)
+        return caminho
+    finally:
+        with _LOCK:
+            resultado['readers'] -= 1
+
+
+def limpar_resultados(agora=None):
+    """
+    One janitor pass: remove expired results, then the least recently used
+    ones until the store fits in MAX_MB. Pinned results are kept (see
+    criar_resultado), as are those with a file being generated.
+
+    Returns:
+        int: Results removed
+    """
+    agora = agora or time.time()
+    removidos = 0
+    with _LOCK:
+        livres = [r for r, res in _RESULTADOS.items() if _livre(res)]
+        for resultado_id in livres:
+            if agora - _RESULTADOS[resultado_id]['accessed'] > TTL_S:
+                _apagar(resultado_id, 'expired')
+                removidos += 1
+
+        total = sum(res['size'] for res in _RESULTADOS.values())
+        for resultado_id in [r for r in livres if r in _RESULTADOS]:
+            if total <= MAX_MB * 1e6:
+                break
+            total -= _RESULTADOS[resultado_id]['size']
+            _apagar(resultado_id, 'store quota')
+            removidos += 1
+    return removidos
+
+
+def remover_resultado(resultado_id):
+    """Remove a result now (e.g. of a failed analysis); unknown IDs are ignored."""
+    with _LOCK:
+        if resultado_id in _RESULTADOS:
+            _apagar(resultado_id, 'removed')
+
+
+def _remover_orfaos():
+    """Remove folders left by a previous process once they are older than TTL_S."""
+    with _LOCK:
+        conhecidos = set(_RESULTADOS)
+    limite = time.time() - TTL_S
+    for nome in os.listdir(RESULTS_DIR):
+        pasta = os.path.join(RESULTS_DIR, nome)
+        if nome not in conhecidos and os.path.isdir(pasta) and os.path.getmtime(pasta) < limite:
+            shutil.rmtree(pasta, ignore_errors=True)
+            print(f"✓ Orphan result folder removed: {nome}")
+
+
+def _janitor():
+    while True:
+        try:
+            _remover_orfaos()
+            limpar_resultados()
+        except Exception as e:
+            print(f"⚠ Results janitor failed: {e}")
+        time.sleep(JANITOR_S)
+
+
+def _iniciar_janitor():
+    global _JANITOR
+
+    with _LOCK:
+        if _JANITOR is None:
+            os.makedirs(RESULTS_DIR, exist_ok=True)
+            _JANITOR = threading.Thread(target=_janitor, name='results-janitor', daemon=True)
+            _JANITOR.start()
+
+
+def relatorio_resultados():
+    """
+    Store usage: results, pinned results and size in MB.
+
+    Returns:
+        dict
+    """
+    with _LOCK:
+        return {
+            'results': len(_RESULTADOS),
+            'pinned': sum(res['pinned'] for res in _RESULTADOS.values()),
+            'size_mb': sum(res['size'] for res in _RESULTADOS.values()) / 1e6
+        }
+
+
+def salvar_tabela(resultado_id, nome, tabela):
+    """
+    Spill a DataFrame to an uncompressed Arrow IPC file of a result, so the
+    caller can keep a small handle instead of the table.
+
+    Uncompressed IPC (not Parquet) so readers can memory-map the file and
+    copy only the rows and columns they use (see abrir_tabela).
+
+    Args:
+        resultado_id (str): Result ID
+        nome (str): File name inside the result folder (e.g. 'cells.arrow')
+        tabela (DataFrame): Table to store
+
+    Returns:
+        dict: Handle with result_id, name and rows
+    """
+    from pyarrow import feather
+
+    def gravar(caminho):
+        # One record batch: columns map to single zero-copy arrays
+        feather.write_feather(
+            tabela.reset_index(drop=True), caminho, compression='uncompressed', chunksize=max(len(tabela), 1)
+        )
+
+    arquivo_resultado(resultado_id, nome, gerar=gravar)
+    return {'result_id': resultado_id, 'name': nome, 'rows': len(tabela)}
+
+
+def abrir_tabela(handle):
+    """
+    Memory-mapped Arrow table of a handle from salvar_tabela.
+
+    Columns read from it are zero-copy views of the file; `take` or `slice`
+    plus `to_pandas` copies only the selected rows.
+
+    Raises:
+        KeyError: The result has expired or was evicted
+    """
+    import pyarrow
+    import pyarrow.ipc
+
+    caminho = arquivo_resultado(handle['result_id'], handle['name'])
+    return pyarrow.ipc.open_file(pyarrow.memory_map(caminho, 'r')).read_all()
+
+
+def ler_tabela(handle, linhas=None, colunas=None):
+    """
+    DataFrame of a stored table, optionally only some rows (positions) and
+    columns.
+    """
+    tabela = abrir_tabela(handle)
+    if colunas is not None:
+        tabela = tabela.select(colunas)
+    if linhas is not None:
+        tabela = tabela.take(linhas)
+    return tabela.to_pandas()
+
+
+def hash_arquivo(caminho, bloco=1024 * 1024):
+    """SHA-256 of a file, read in blocks."""
+    h = hashlib.sha256()
+    with open(caminho, 'rb') as f:
+        for parte in iter(lambda: f.read(bloco), b''):
+            h.update(parte)
+    return h.hexdigest()
+
+
+def empacotar_resultado(resultado_id, arquivos, nome_zip):
+    """
+    Describe the downloads of a result and bundle them in one ZIP, once.
+
+    The ZIP is written file by file from disk (never held in memory), with
+    a SHA256SUMS listing; images and rasters are stored uncompressed.
+
+    Args:
+        resultado_id (str): Result ID
+        arquivos (dict): Download name -> file name in the result folder
+        nome_zip (str): File name of the bundle
+
+    Returns:
+        dict: Download name -> {'file', 'size', 'sha256', 'mime'}, with the
+        bundle itself under `nome_zip`
+    """
+    manifesto = {}
+    for nome, arquivo in arquivos.items():
+        caminho = arquivo_resultado(resultado_id, arquivo)
+        manifesto[nome] = {
+            'file': arquivo,
+            'size': os.path.getsize(caminho),
+            'sha256': hash_arquivo(caminho),
+            'mime': mimetypes.guess_type(nome)[0] or 'application/octet-stream'
+        }
+
+    def gravar(caminho_zip):
+        with zipfile.ZipFile(caminho_zip, 'w') as z:
+            for nome, entrada in manifesto.items():
+                compressao = zipfile.ZIP_STORED if nome.lower().endswith(JA_COMPRIMIDOS) else zipfile.ZIP_DEFLATED
+                z.write(arquivo_resultado(resultado_id, entrada['file']), nome, compress_type=compressao)
+            z.writestr(
+                'SHA256SUMS',
+                ''.join(f"{entrada['sha256']}  {nome}\n" for nome, entrada in manifesto.items()),
+                compress_type=zipfile.ZIP_DEFLATED
+            )
+
+    caminho_zip = arquivo_resultado(resultado_id, nome_zip, gerar=gravar)
+    manifesto[nome_zip] = {
+        'file': nome_zip,
+        'size': os.path.getsize(caminho_zip),
+        'sha256': hash_arquivo(caminho_zip),
+        'mime': 'application/zip'
+    }
+    return manifesto
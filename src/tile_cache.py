@@ -0,0 +1,427 @@
+"""
+AL Drones - Basemap tile cache
+Persistent XYZ tile cache (directory or MBTiles file) shared by all maps and
+sessions, with a configurable tile server and a prefetch command for
+offline/air-gapped deployments.
+
+Configuration (environment variables):
+    ALDRONES_TILE_URL      Tile URL template, e.g. http://tiles.local/{z}/{x}/{y}.png
+                           (default: OpenStreetMap for on-demand map tiles only;
+                           prefetch needs an explicit server)
+    ALDRONES_TILE_CACHE    Cache directory, or a path ending in .mbtiles
+                           (default: dados_tiles)
+    ALDRONES_TILE_OFFLINE  '1' to never download; missing tiles stay blank
+
+The cache has no size bound: every tile fetched or prefetched is kept until
+the directory (or .mbtiles file) is removed by hand. Its size is set by the
+regions and zooms the maps cover, so deployments that render arbitrary areas
+should clean it periodically.
+"""
+
+import os
+import io
+import re
+import math
+import sqlite3
+import argparse
+import threading
+from urllib.parse import urlparse
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import requests
+from PIL import Image
+
+try:
+    from .projection import extent_mercator
+except ImportError:
+    from projection import extent_mercator
+
+
+TILE_URL_OSM = 'https://tile.openstreetmap.org/{z}/{x}/{y}.png'
+TILE_URL = os.environ.get('ALDRONES_TILE_URL') or TILE_URL_OSM
+TILE_CACHE = os.environ.get('ALDRONES_TILE_CACHE', 'dados_tiles')
+TILE_OFFLINE = os.environ.get('ALDRONES_TILE_OFFLINE', '') == '1'
+
+TILE_SIZE = 256
+TILE_WORKERS = 4
+HEADERS = {'User-Agent': 'aldrones-population-tool'}
+
+ORIGEM_MERCATOR = 20037508.342789244
+
+# Approximate pixel size of the map axes (24 in figure at 150 dpi)
+MAP_PIXELS = 2800
+MAX_ZOOM = 19
+MAX_TILES = 400
+
+# Hit/miss counters of this process (see estatisticas_cache)
+_ESTATISTICAS = {'hits': 0, 'misses': 0, 'downloads': 0, 'errors': 0}
+_LOCK = threading.Lock()
+
+# One MBTiles connection per (path, process)
+_CONEXOES = {}
+
+# MBTiles 'format' metadata by leading bytes of the tile data
+_ASSINATURAS = (
+    (b'\x89PNG', 'png'),
+    (b'\xff\xd8', 'jpg'),
+    (b'RIFF', 'webp'),
+)
+_EXTENSOES = {'png': 'png', 'jpg': 'jpg', 'jpeg': 'jpg', 'webp': 'webp'}
+
+# Bulk downloads are forbidden by the OpenStreetMap tile usage policy
+_HOSTS_SEM_PREFETCH = ('tile.openstreetmap.org',)
+
+
+def _conexao_mbtiles(path):
+    """Open (and create if needed) an MBTiles file for this process."""
+    chave = (path, os.getpid())
+    if chave not in _CONEXOES:
+        pasta = os.path.dirname(path)
+        if pasta:
+            os.makedirs(pasta, exist_ok=True)
+        con = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        con.execute(
+            "CREATE TABLE IF NOT EXISTS tiles (zoom_level INTEGER, tile_column INTEGER, "
+            "tile_row INTEGER, tile_data BLOB, "
+            "PRIMARY KEY (zoom_level, tile_column, tile_row))"
+        )
+        con.execute("CREATE TABLE IF NOT EXISTS metadata (name TEXT PRIMARY KEY, value TEXT)")
+        # 'format' is recorded with the first tile (see _formato_tile)
+        con.execute("INSERT OR IGNORE INTO metadata VALUES ('name', 'aldrones-basemap')")
+        con.commit()
+        _CONEXOES[chave] = con
+    return _CONEXOES[chave]
+
+
+def _formato_tile(dados, url=None):
+    """Image format of tile data ('png', 'jpg', 'webp'), else from the URL extension."""
+    for assinatura, formato in _ASSINATURAS:
+        if dados.startswith(assinatura):
+            return formato
+    extensao = re.search(r'\.(\w+)(?:\?|$)', urlparse(url or TILE_URL).path)
+    return _EXTENSOES.get(extensao.group(1).lower(), 'png') if extensao else 'png'
+
+
+def _caminho_tile(cache, z, x, y):
+    return os.path.join(cache, str(z), str(x), f"{y}.png")
+
+
+def ler_tile_cache(z, x, y, cache=None):
+    """Tile bytes from the cache, or None."""
+    cache = cache or TILE_CACHE
+    if cache.endswith('.mbtiles'):
+        with _LOCK:
+            # MBTiles rows are numbered from the south (TMS)
+            row = _conexao_mbtiles(cache).execute(
+                "SELECT tile_data FROM tiles WHERE zoom_level=? AND tile_column=? AND tile_row=?",
+                (z, x, (1 << z) - 1 - y)
+            ).fetchone()
+        return row[0] if row else None
+
+    path = _caminho_tile(cache, z, x, y)
+    if os.path.exists(path):
+        with open(path, 'rb') as f:
+            return f.read()
+    return None
+
+
+def gravar_tile_cache(z, x, y, dados, cache=None, url=None):
+    """Store tile bytes in the cache (`url`: template, for the MBTiles format)."""
+    cache = cache or TILE_CACHE
+    if cache.endswith('.mbtiles'):
+        with _LOCK:
+            con = _conexao_mbtiles(cache)
+            con.execute(
+                "INSERT OR IGNORE INTO metadata VALUES ('format', ?)",
+                (_formato_tile(dados, url),)
+            )
+            con.execute(
+                "INSERT OR REPLACE INTO tiles VALUES (?, ?, ?, ?)",
+                (z, x, (1 << z) - 1 - y, sqlite3.Binary(dados))
+            )
+            con.commit()
+        return
+
+    path = _caminho_tile(cache, z, x, y)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Write-then-rename so concurrent sessions never read a partial tile
+    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp, 'wb') as f:
+        f.write(dados)
+    os.replace(tmp, path)
+
+
+def _contar(chave):
+    with _LOCK:
+        _ESTATISTICAS[chave] += 1
+
+
+def obter_tile(z, x, y, url=None, cache=None, offline=None):
+    """
+    Tile bytes from the cache, downloading (and caching) on a miss.
+
+    Returns:
+        bytes or None: PNG/JPEG data, None if unavailable
+    """
+    url = url or TILE_URL
+    offline = TILE_OFFLINE if offline is None else offline
+
+    dados = ler_tile_cache(z, x, y, cache)
+    if dados is not None:
+        _contar('hits')
+        return dados
+    _contar('misses')
+
+    if offline:
+        return None
+    try:
+        resp = requests.get(url.format(z=z, x=x, y=y), headers=HEADERS, timeout=10)
+        resp.raise_for_status()
+    except Exception:
+        _contar('errors')
+        return None
+
+    gravar_tile_cache(z, x, y, resp.content, cache, url)
+    _contar('downloads')
+    return resp.content
+
+
+def estatisticas_cache():
+    """Counters of this process plus the hit rate."""
+    with _LOCK:
+        stats = dict(_ESTATISTICAS)
+    total = stats['hits'] + stats['misses']
+    stats['hit_rate'] = stats['hits'] / total if total else 0.0
+    return stats
+
+
+def resolucao_zoom(zoom):
+    """Web Mercator metres per tile pixel at a zoom level."""
+    return 2 * ORIGEM_MERCATOR / (TILE_SIZE * 2 ** zoom)
+
+
+def zoom_adaptativo(extent, pixels=MAP_PIXELS):
+    """
+    Zoom whose tile resolution matches the map pixels for an EPSG:3857 extent.
+
+    Capped at MAX_ZOOM and lowered until the extent needs at most MAX_TILES.
+    """
+    minx, miny, maxx, maxy = extent
+    resolucao = max(maxx - minx, maxy - miny, 1.0) / pixels
+    zoom = int(np.clip(round(math.log2(resolucao_zoom(0) / resolucao)), 0, MAX_ZOOM))
+    while zoom > 0 and len(tiles_extent(extent, zoom)) > MAX_TILES:
+        zoom -= 1
+    return zoom
+
+
+def tiles_extent(extent, zoom):
+    """(x, y) of the tiles covering an EPSG:3857 extent at a zoom level."""
+    minx, miny, maxx, maxy = extent
+    lado = resolucao_zoom(zoom) * TILE_SIZE
+    ultimo = 2 ** zoom - 1
+
+    def indice(v):
+        return int(np.clip(v // lado, 0, ultimo))
+
+    x0, x1 = indice(minx + ORIGEM_MERCATOR), indice(maxx + ORIGEM_MERCATOR)
+    y0, y1 = indice(ORIGEM_MERCATOR - maxy), indice(ORIGEM_MERCATOR - miny)
+    return [(x, y) for y in range(y0, y1 + 1) for x in range(x0, x1 + 1)]
+
+
+def tiles_bounds(bounds, zoom):
+    """(x, y) of the tiles covering WGS84 bounds at a zoom level."""
+    return tiles_extent(extent_mercator(bounds), zoom)
+
+
+def _decodificar(dados):
+    try:
+        return np.asarray(Image.open(io.BytesIO(dados)).convert('RGBA'))
+    except Exception:
+        return None
+
+
+def mosaico_3857(extent, zoom=None, url=None, cache=None, offline=None):
+    """
+    Basemap mosaic covering an EPSG:3857 extent, in native tile pixels.
+
+    Returns:
+        dict: {'imagem' (RGBA uint8, transparent where tiles are missing),
+        'extent' (tile-aligned, EPSG:3857), 'zoom', 'tiles', 'unavailable'}
+    """
+    zoom = zoom_adaptativo(extent) if zoom is None else zoom
+    tiles = tiles_extent(extent, zoom)
+    xs = sorted({x for x, _ in tiles})
+    ys = sorted({y for _, y in tiles})
+
+    with ThreadPoolExecutor(max_workers=TILE_WORKERS) as pool:
+        dados = list(pool.map(lambda t: obter_tile(zoom, *t, url, cache, offline), tiles))
+
+    imagem = np.zeros((len(ys) * TILE_SIZE, len(xs) * TILE_SIZE, 4), dtype=np.uint8)
+    indisponiveis = 0
+    for (x, y), tile in zip(tiles, dados):
+        tile = _decodificar(tile) if tile is not None else None
+        if tile is None or tile.shape[:2] != (TILE_SIZE, TILE_SIZE):
+            indisponiveis += 1
+            continue
+        i, j = (y - ys[0]) * TILE_SIZE, (x - xs[0]) * TILE_SIZE
+        imagem[i:i + TILE_SIZE, j:j + TILE_SIZE] = tile
+
+    lado = resolucao_zoom(zoom) * TILE_SIZE
+    return {
+        'imagem': imagem,
+        'extent': (
+            xs[0] * lado - ORIGEM_MERCATOR,
+            ORIGEM_MERCATOR - (ys[-1] + 1) * lado,
+            (xs[-1] + 1) * lado - ORIGEM_MERCATOR,
+            ORIGEM_MERCATOR - ys[0] * lado,
+        ),
+        'zoom': zoom,
+        'tiles': len(tiles),
+        'unavailable': indisponiveis,
+    }
+
+
+def recortar_mosaico(base, extent):
+    """
+    Crop of a mosaic covering a smaller EPSG:3857 extent.
+
+    Returns None if `extent` is not inside the mosaic, or if the mosaic zoom
+    is more than one level coarser than the extent needs.
+    """
+    bx0, by0, bx1, by1 = base['extent']
+    minx, miny, maxx, maxy = extent
+    if minx < bx0 or miny < by0 or maxx > bx1 or maxy > by1:
+        return None
+    if zoom_adaptativo(extent) > base['zoom'] + 1:
+        return None
+
+    res = resolucao_zoom(base['zoom'])
+    c0, c1 = int((minx - bx0) // res), int(math.ceil((maxx - bx0) / res))
+    r0, r1 = int((by1 - maxy) // res), int(math.ceil((by1 - miny) / res))
+    return {
+        **base,
+        'imagem': base['imagem'][r0:r1, c0:c1],
+        'extent': (bx0 + c0 * res, by1 - r1 * res, bx0 + c1 * res, by1 - r0 * res),
+    }
+
+
+def adicionar_basemap(ax, base=None, zoom=None, alpha=0.6, url=None, cache=None, offline=None):
+    """
+    Draw the basemap under the current extent of an EPSG:3857 axes.
+
+    Args:
+        ax: Matplotlib axes in EPSG:3857
+        base (dict): Mosaic from mosaico_3857 (e.g. shared by several maps);
+            fetched for the axes extent if None
+        zoom (int): Zoom when fetching (default: zoom_adaptativo)
+        alpha (float): Basemap opacity
+
+    Returns:
+        dict: {'zoom', 'tiles', 'unavailable'} of the drawn mosaic
+    """
+    minx, maxx = ax.get_xlim()
+    miny, maxy = ax.get_ylim()
+    if base is None:
+        base = mosaico_3857((minx, miny, maxx, maxy), zoom, url, cache, offline)
+
+    # Composited under the cells at the device resolution of the axes
+    try:
+        from .rendering import fundo_raster
+    except ImportError:
+        from rendering import fundo_raster
+    fundo_raster(ax).adicionar(base['imagem'], base['extent'], alpha=alpha, ordem=0, suave=True)
+    ax.set_xlim(minx, maxx)
+    ax.set_ylim(miny, maxy)
+    return {k: base[k] for k in ('zoom', 'tiles', 'unavailable')}
+
+
+def prefetch(bounds_list, zooms, url=None, cache=None):
+    """
+    Download every tile of the given WGS84 bounds and zoom levels into the cache.
+
+    Args:
+        url (str): Tile URL template; defaults to ALDRONES_TILE_URL. Required,
+            and never an OpenStreetMap tile server
+
+    Returns:
+        dict: Cache counters after the prefetch
+
+    Raises:
+        ValueError: If no tile server is configured, or it is OpenStreetMap's
+    """
+    url = url or os.environ.get('ALDRONES_TILE_URL')
+    if not url:
+        raise ValueError(
+            "Prefetch needs a tile server: pass --url or set ALDRONES_TILE_URL"
+        )
+    host = (urlparse(url).hostname or '').lower()
+    if any(host == h or host.endswith('.' + h) for h in _HOSTS_SEM_PREFETCH):
+        raise ValueError(
+            f"Bulk prefetch from {host} is forbidden by its tile usage policy; "
+            "use your own tile server"
+        )
+
+    tiles = [
+        (z, x, y)
+        for bounds in bounds_list
+        for z in zooms
+        for x, y in tiles_bounds(bounds, z)
+    ]
+    tiles = list(dict.fromkeys(tiles))
+    print(f"⬇ Prefetching {len(tiles)} tiles into {cache or TILE_CACHE}...")
+
+    with ThreadPoolExecutor(max_workers=TILE_WORKERS) as pool:
+        for i, dados in enumerate(pool.map(lambda t: obter_tile(*t, url, cache, False), tiles), 1):
+            if i % 500 == 0:
+                print(f"  {i}/{len(tiles)}")
+
+    stats = estatisticas_cache()
+    print(
+        f"✓ Prefetch complete: {stats['downloads']} downloaded, "
+        f"{stats['hits']} already cached, {stats['errors']} errors"
+    )
+    return stats
+
+
+def main():
+    """Command line interface (prefetch of operating regions)."""
+    parser = argparse.ArgumentParser(
+        description='Prefetch basemap tiles into the local tile cache'
+    )
+    parser.add_argument(
+        '--bbox',
+        nargs=4,
+        type=float,
+        action='append',
+        required=True,
+        metavar=('MINLON', 'MINLAT', 'MAXLON', 'MAXLAT'),
+        help='Region to prefetch (repeatable)'
+    )
+    parser.add_argument(
+        '--zoom',
+        type=int,
+        nargs='+',
+        default=[13],
+        help='Zoom levels (default: 13)'
+    )
+    parser.add_argument(
+        '--cache',
+        default=None,
+        help=f'Cache directory or .mbtiles file (default: {TILE_CACHE})'
+    )
+    parser.add_argument(
+        '--url',
+        default=None,
+        help='Tile URL template (default: ALDRONES_TILE_URL; required, OpenStreetMap refused)'
+    )
+
+    args = parser.parse_args()
+    try:
+        prefetch(args.bbox, args.zoom, url=args.url, cache=args.cache)
+    except ValueError as e:
+        parser.error(str(e))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,493 @@
+"""
+AL Drones - Interactive results map
+Population cells served as level-of-detail GeoJSON tiles: at each zoom the
+cells are aggregated into lattice blocks sized so that one 256 px tile never
+holds more than BLOCOS_POR_TILE² features, whatever the mission size. Tiles
+are cached and served by a small HTTP endpoint next to the app; the map
+itself is a folium (Leaflet) map that fetches the visible tiles.
+
+The endpoint listens on the loopback interface and is meant to be reached
+through the reverse proxy in front of the app, on a path of the app's own
+origin (e.g. /tiles -> http://127.0.0.1:8765/, see DEPLOYMENT.md): no
+CORS, no mixed content under HTTPS, nothing exposed on another port.
+Without ALDRONES_MAP_URL the endpoint is not started and each map embeds
+its GeoJSON inline.
+
+Configuration (environment variables):
+    ALDRONES_MAP_PORT   Port of the tile endpoint (default: 8765)
+    ALDRONES_MAP_HOST   Bind address of the tile endpoint (default: 127.0.0.1)
+    ALDRONES_MAP_URL    Tile endpoint URL as seen by the browser, preferably
+                        a same-origin path such as /tiles (default: unset,
+                        maps are embedded inline)
+"""
+
+import os
+import re
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import pandas as pd
+import shapely
+
+try:
+    from .projection import WEB_MERCATOR, WGS84, get_transformer
+except ImportError:
+    from projection import WEB_MERCATOR, WGS84, get_transformer
+
+
+MAP_PORT = int(os.environ.get('ALDRONES_MAP_PORT', '8765'))
+MAP_HOST = os.environ.get('ALDRONES_MAP_HOST', '127.0.0.1')
+MAP_URL = os.environ.get('ALDRONES_MAP_URL', '').rstrip('/') or None
+
+# Blocks per tile side: at most 32 x 32 features per 256 px tile
+BLOCOS_POR_TILE = 32
+# Feature cap of the inline (no tile endpoint) map
+MAX_FEATURES = 5000
+MAX_CAMADAS = 64
+MAX_TILES = 4096
+
+# Block sides (m) of the LOD levels: the 200 m / 1 km IBGE cells, then
+# doubling 1 km blocks
+NIVEIS = (200, 1000, 2000, 4000, 8000, 16000, 32000, 64000, 128000, 256000)
+
+# Density classes (pop/km²) and their YlOrBr colours
+LIMITES_DENSIDADE = (0, 5, 25, 100, 500, 1000, 5000)
+CORES_DENSIDADE = ('#ffffd4', '#fee391', '#fec44f', '#fe9929', '#ec7014', '#cc4c02', '#8c2d04')
+
+ORIGEM_MERCATOR = 20037508.342789244
+TILE_SIZE = 256
+# Deepest zoom served; beyond it (or off the tile grid) requests get 404
+MAX_ZOOM = 24
+
+# Registered cell layers by id, least recently used first
+_CAMADAS = OrderedDict()
+# Tile GeoJSON by (layer id, z, x, y), least recently used first
+_TILES = OrderedDict()
+_LOCK = threading.Lock()
+_SERVIDOR = {}
+
+
+def celulas_lod(dados_area):
+    """
+    Compact cell table for the web map.
+
+    Args:
+        dados_area (GeoDataFrame): Cells in Albers with 'TOTAL' and 'area_km2'
+
+    Returns:
+        DataFrame: x, y (lower-left corner, m), tamanho (side, m), populacao
+        and area_km2 per cell
+    """
+    bounds = shapely.bounds(dados_area.geometry.values)
+    return pd.DataFrame({
+        'x': bounds[:, 0],
+        'y': bounds[:, 1],
+        'tamanho': np.maximum(bounds[:, 2] - bounds[:, 0], bounds[:, 3] - bounds[:, 1]),
+        'populacao': dados_area['TOTAL'].to_numpy(dtype=float),
+        'area_km2': dados_area['area_km2'].to_numpy(dtype=float)
+    })
+
+
+def registrar_camada(celulas, crs_albers):
+    """
+    Register a cell table (see celulas_lod) for tile requests.
+
+    The id is a hash of the cells, so registering the same cells again
+    (e.g. on a Streamlit rerun) is free and returns the same id.
+
+    Returns:
+        str: Layer id used in the tile URLs
+    """
+    h = hashlib.sha1(str(crs_albers).encode())
+    for coluna in ('x', 'y', 'tamanho', 'populacao'):
+        h.update(np.ascontiguousarray(celulas[coluna].to_numpy(dtype=float)).tobytes())
+    camada_id = h.hexdigest()[:16]
+
+    with _LOCK:
+        if camada_id in _CAMADAS:
+            _CAMADAS.move_to_end(camada_id)
+            return camada_id
+
+    x = celulas['x'].to_numpy(dtype=float)
+    y = celulas['y'].to_numpy(dtype=float)
+    tamanho = celulas['tamanho'].to_numpy(dtype=float)
+    # Cell centres in EPSG:3857, to pick the cells of a tile
+    mx, my = get_transformer(str(crs_albers), WEB_MERCATOR).transform(x + tamanho / 2, y + tamanho / 2)
+
+    camada = {
+        'crs': str(crs_albers),
+        'x': x,
+        'y': y,
+        'tamanho': tamanho,
+        'populacao': celulas['populacao'].to_numpy(dtype=float),
+        'area_km2': celulas['area_km2'].to_numpy(dtype=float),
+        'mx': np.asarray(mx),
+        'my': np.asarray(my)
+    }
+    with _LOCK:
+        _CAMADAS[camada_id] = camada
+        while len(_CAMADAS) > MAX_CAMADAS:
+            _CAMADAS.popitem(last=False)
+    return camada_id
+
+
+def camada_registrada(camada_id):
+    """Whether a layer id is still registered (marks it recently used)."""
+    with _LOCK:
+        if camada_id not in _CAMADAS:
+            return False
+        _CAMADAS.move_to_end(camada_id)
+        return True
+
+
+def bounds_tile(z, x, y):
+    """EPSG:3857 (minx, miny, maxx, maxy) of XYZ tile (z, x, y)."""
+    lado = 2 * ORIGEM_MERCATOR / 2 ** z
+    minx = -ORIGEM_MERCATOR + x * lado
+    maxy = ORIGEM_MERCATOR - y * lado
+    return minx, maxy - lado, minx + lado, maxy
+
+
+def nivel_lod(largura_m, tamanho_min):
+    """
+    Block side for a view `largura_m` metres wide: the smallest LOD level
+    giving at most BLOCOS_POR_TILE blocks across, never finer than the cells.
+    """
+    alvo = max(largura_m / BLOCOS_POR_TILE, tamanho_min)
+    for nivel in NIVEIS:
+        if nivel >= alvo:
+            return nivel
+    return NIVEIS[-1]
+
+
+def agregar_blocos(camada, idx, bloco):
+    """
+    Aggregate cells `idx` of a layer into lattice blocks of side `bloco`.
+
+    Cells at least `bloco` wide are kept as they are. A block is drawn as
+    the bounding box of its cells, so it never covers ground without cells.
+
+    Returns:
+        DataFrame: minx, miny, maxx, maxy (m), populacao, area_km2 and
+        n (cells) per block
+    """
+    x, y, tamanho = camada['x'][idx], camada['y'][idx], camada['tamanho'][idx]
+    lado = np.maximum(tamanho, bloco)
+    blocos = pd.DataFrame({
+        'lado': lado,
+        'col': np.floor(x / lado).astype(np.int64),
+        'row': np.floor(y / lado).astype(np.int64),
+        'minx': x,
+        'miny': y,
+        'maxx': x + tamanho,
+        'maxy': y + tamanho,
+        'populacao': camada['populacao'][idx],
+        'area_km2': camada['area_km2'][idx],
+        'n': 1
+    })
+    return blocos.groupby(['lado', 'col', 'row'], sort=False).agg({
+        'minx': 'min', 'miny': 'min', 'maxx': 'max', 'maxy': 'max',
+        'populacao': 'sum', 'area_km2': 'sum', 'n': 'sum'
+    }).reset_index(drop=True)
+
+
+def feature_collection(blocos, crs_albers):
+    """GeoJSON FeatureCollection (WGS84) of aggregated blocks."""
+    transformer = get_transformer(crs_albers, WGS84)
+    xs = blocos[['minx', 'maxx', 'maxx', 'minx', 'minx']].to_numpy()
+    ys = blocos[['miny', 'miny', 'maxy', 'maxy', 'miny']].to_numpy()
+    lon, lat = transformer.transform(xs, ys)
+    lon, lat = np.round(lon, 6), np.round(lat, 6)
+    densidade = blocos['populacao'] / blocos['area_km2'].where(blocos['area_km2'] > 0)
+
+    features = []
+    for i, (pop, dens, n) in enumerate(zip(blocos['populacao'], densidade.fillna(0), blocos['n'])):
+        features.append({
+            'type': 'Feature',
+            'geometry': {
+                'type': 'Polygon',
+                'coordinates': [np.column_stack([lon[i], lat[i]]).tolist()]
+            },
+            'properties': {'pop': int(round(pop)), 'dens': round(float(dens), 1), 'n': int(n)}
+        })
+    return {'type': 'FeatureCollection', 'features': features}
+
+
+def tile_geojson(camada_id, z, x, y):
+    """
+    GeoJSON of XYZ tile (z, x, y) of a registered layer, at the LOD of `z`.
+
+    Each block belongs to the tile containing its centre, so neighbouring
+    tiles never repeat a block. Results are cached per tile.
+
+    Returns:
+        bytes or None: UTF-8 GeoJSON (None for an unknown or evicted layer,
+        or a tile outside the grid of zoom levels 0..MAX_ZOOM)
+    """
+    if not (0 <= z <= MAX_ZOOM and 0 <= x < 2 ** z and 0 <= y < 2 ** z):
+        return None
+    chave = (camada_id, z, x, y)
+    with _LOCK:
+        if chave in _TILES:
+            _TILES.move_to_end(chave)
+            return _TILES[chave]
+        # Taken with the lock: an eviction afterwards cannot pull it away
+        camada = _CAMADAS.get(camada_id)
+    if camada is None:
+        return None
+
+    corpo = _tile_geojson(camada, z, x, y)
+    with _LOCK:
+        _TILES[chave] = corpo
+        while len(_TILES) > MAX_TILES:
+            _TILES.popitem(last=False)
+    return corpo
+
+
+def _tile_geojson(camada, z, x, y):
+    minx, miny, maxx, maxy = bounds_tile(z, x, y)
+    # Ground metres per Mercator metre at the tile centre
+    escala = np.cos(np.arctan(np.sinh((miny + maxy) / 2 / 6378137.0)))
+    bloco = nivel_lod((maxx - minx) * escala, camada['tamanho'].min())
+
+    # Cells of the blocks that may have their centre in this tile
+    folga = 2 * max(bloco, camada['tamanho'].max()) / escala
+    idx = np.flatnonzero(
+        (camada['mx'] >= minx - folga) & (camada['mx'] < maxx + folga)
+        & (camada['my'] >= miny - folga) & (camada['my'] < maxy + folga)
+    )
+    fc = {'type': 'FeatureCollection', 'features': []}
+    if len(idx):
+        blocos = agregar_blocos(camada, idx, bloco)
+        cx, cy = get_transformer(camada['crs'], WEB_MERCATOR).transform(
+            ((blocos['minx'] + blocos['maxx']) / 2).to_numpy(),
+            ((blocos['miny'] + blocos['maxy']) / 2).to_numpy()
+        )
+        dentro = (cx >= minx) & (cx < maxx) & (cy >= miny) & (cy < maxy)
+        fc = feature_collection(blocos[dentro].reset_index(drop=True), camada['crs'])
+    return json.dumps(fc, separators=(',', ':')).encode('utf-8')
+
+
+def geojson_inline(camada_id, max_features=MAX_FEATURES):
+    """
+    Whole-layer GeoJSON at the finest LOD level with at most `max_features`
+    blocks, for maps shown without the tile endpoint.
+    """
+    with _LOCK:
+        camada = _CAMADAS.get(camada_id)
+    if camada is None:
+        return None
+
+    idx = np.arange(len(camada['x']))
+    for nivel in NIVEIS:
+        if nivel < camada['tamanho'].min():
+            continue
+        blocos = agregar_blocos(camada, idx, nivel)
+        if len(blocos) <= max_features:
+            break
+    return feature_collection(blocos, camada['crs'])
+
+
+_ROTA_TILE = re.compile(r'^/cells/([0-9a-f]+)/(\d+)/(\d+)/(\d+)\.geojson$')
+
+
+class _TileHandler(BaseHTTPRequestHandler):
+    """GET /cells/<layer id>/<z>/<x>/<y>.geojson"""
+
+    def do_GET(self):
+        rota = _ROTA_TILE.match(self.path.split('?')[0])
+        corpo = None
+        if rota:
+            camada_id, z, x, y = rota.group(1), *map(int, rota.groups()[1:])
+            corpo = tile_geojson(camada_id, z, x, y)
+        if corpo is None:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/geo+json')
+        self.send_header('Content-Length', str(len(corpo)))
+        self.send_header('Cache-Control', 'public, max-age=86400, immutable')
+        self.end_headers()
+        self.wfile.write(corpo)
+
+    def log_message(self, *args):
+        pass
+
+
+def iniciar_servidor(porta=MAP_PORT, host=MAP_HOST, url=MAP_URL):
+    """
+    Start the tile endpoint in a daemon thread (once per process).
+
+    Args:
+        porta (int): Port to listen on
+        host (str): Bind address (loopback by default: the reverse proxy
+            reaches it, browsers do not)
+        url (str): Endpoint URL as seen by the browser, e.g. '/tiles' when
+            the proxy forwards that path of the app's origin to the endpoint
+
+    Returns:
+        str or None: Base tile URL for the browser, or None if no URL is
+        configured or the port could not be bound (maps then embed their
+        GeoJSON inline)
+    """
+    with _LOCK:
+        if 'url' not in _SERVIDOR:
+            if not url:
+                _SERVIDOR['url'] = None
+                return None
+            try:
+                servidor = ThreadingHTTPServer((host, porta), _TileHandler)
+            except OSError as e:
+                print(f"⚠ Map tile endpoint unavailable on port {porta}: {e}")
+                _SERVIDOR['url'] = None
+            else:
+                servidor.daemon_threads = True
+                threading.Thread(target=servidor.serve_forever, daemon=True).start()
+                _SERVIDOR['servidor'] = servidor
+                _SERVIDOR['url'] = url.rstrip('/')
+                print(f"✓ Map tile endpoint on {host}:{porta}, served to the browser as {_SERVIDOR['url']}")
+        return _SERVIDOR['url']
+
+
+def _camada_tiles(url, nome):
+    """folium element drawing the GeoJSON tiles of `url` into its parent group."""
+    from branca.element import MacroElement
+    from jinja2 import Template
+
+    class CamadaTilesGeoJSON(MacroElement):
+        _template = Template("""
+            {% macro script(this, kwargs) %}
+            (function() {
+                var grupo = {{ this._parent.get_name() }};
+                var limites = {{ this.limites|tojson }};
+                var cores = {{ this.cores|tojson }};
+                var camadas = {};
+                function cor(d) {
+                    for (var i = limites.length - 1; i > 0; i--) {
+                        if (d >= limites[i]) { return cores[i]; }
+                    }
+                    return cores[0];
+                }
+                var grade = L.gridLayer({tileSize: {{ this.tile_size }}});
+                grade.createTile = function(coords, done) {
+                    var tile = document.createElement('div');
+                    var chave = coords.z + '/' + coords.x + '/' + coords.y;
+                    fetch({{ this.url|tojson }} + '/' + chave + '.geojson')
+                        .then(function(r) { return r.json(); })
+                        .then(function(fc) {
+                            // Unloaded while the fetch was in flight
+                            if (!grade._tiles[grade._tileCoordsToKey(coords)]) {
+                                done(null, tile);
+                                return;
+                            }
+                            camadas[chave] = L.geoJSON(fc, {
+                                style: function(f) {
+                                    return {fillColor: cor(f.properties.dens), fillOpacity: 0.6,
+                                            color: '#333333', weight: 0.3};
+                                },
+                                onEachFeature: function(f, layer) {
+                                    layer.bindTooltip(
+                                        {{ this.nome|tojson }} + '<br>' +
+                                        f.properties.pop + ' hab, ' + f.properties.dens + ' hab/km²' +
+                                        (f.properties.n > 1 ? '<br>' + f.properties.n + ' células' : ''));
+                                }
+                            });
+                            grupo.addLayer(camadas[chave]);
+                            done(null, tile);
+                        })
+                        .catch(function(e) { done(e, tile); });
+                    return tile;
+                };
+                grade.on('tileunload', function(e) {
+                    var chave = e.coords.z + '/' + e.coords.x + '/' + e.coords.y;
+                    if (camadas[chave]) {
+                        grupo.removeLayer(camadas[chave]);
+                        delete camadas[chave];
+                    }
+                });
+                grupo.addLayer(grade);
+            })();
+            {% endmacro %}
+        """)
+
+        def __init__(self):
+            super().__init__()
+            self._name = 'CamadaTilesGeoJSON'
+            self.url = url
+            self.nome = nome
+            self.tile_size = TILE_SIZE
+            self.limites = list(LIMITES_DENSIDADE)
+            self.cores = list(CORES_DENSIDADE)
+
+    return CamadaTilesGeoJSON()
+
+
+def _estilo_densidade(feature):
+    dens = feature['properties']['dens']
+    classe = int(np.searchsorted(LIMITES_DENSIDADE, dens, side='right')) - 1
+    return {
+        'fillColor': CORES_DENSIDADE[max(classe, 0)],
+        'fillOpacity': 0.6,
+        'color': '#333333',
+        'weight': 0.3
+    }
+
+
+def mapa_interativo(layers_poligonos, camadas, url_tiles=None, cores=None):
+    """
+    Interactive folium map of the safety layers and population cells.
+
+    Args:
+        layers_poligonos (dict): Layer name -> WGS84 polygon (outlines)
+        camadas (dict): Map title -> registered layer id (see registrar_camada)
+        url_tiles (str): Tile endpoint base URL (see iniciar_servidor); if
+            None, each layer is embedded inline, capped at MAX_FEATURES
+        cores (dict): Layer name -> outline colour
+
+    Returns:
+        folium.Map
+    """
+    import folium
+    from branca.colormap import StepColormap
+
+    minx, miny, maxx, maxy = shapely.union_all(list(layers_poligonos.values())).bounds
+    mapa = folium.Map(tiles='OpenStreetMap', control_scale=True)
+    mapa.fit_bounds([[miny, minx], [maxy, maxx]])
+
+    for i, (titulo, camada_id) in enumerate(camadas.items()):
+        grupo = folium.FeatureGroup(name=f"População - {titulo}", show=(i == 0))
+        if url_tiles:
+            grupo.add_child(_camada_tiles(f"{url_tiles}/cells/{camada_id}", titulo))
+        else:
+            fc = geojson_inline(camada_id)
+            if fc is None:
+                continue
+            folium.GeoJson(
+                fc,
+                style_function=_estilo_densidade,
+                tooltip=folium.GeoJsonTooltip(fields=['pop', 'dens'], aliases=['hab', 'hab/km²'])
+            ).add_to(grupo)
+        grupo.add_to(mapa)
+
+    for nome, geom in layers_poligonos.items():
+        cor = (cores or {}).get(nome, 'gray')
+        folium.GeoJson(
+            shapely.geometry.mapping(geom),
+            name=nome,
+            style_function=lambda _f, cor=cor: {'color': cor, 'weight': 2, 'fillOpacity': 0}
+        ).add_to(mapa)
+
+    legenda = StepColormap(
+        list(CORES_DENSIDADE),
+        index=list(LIMITES_DENSIDADE) + [LIMITES_DENSIDADE[-1] * 2],
+        vmin=LIMITES_DENSIDADE[0],
+        vmax=LIMITES_DENSIDADE[-1] * 2,
+        caption='Densidade (hab/km²)'
+    )
+    legenda.add_to(mapa)
+    folium.LayerControl(collapsed=False).add_to(mapa)
+    return mapa
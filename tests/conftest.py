@@ -0,0 +1,32 @@
+"""Shared test fixtures."""
+
+import pytest
+
+
+MULTI_MISSAO = """<?xml version="1.0" encoding="UTF-8"?>
+<kml xmlns="http://www.opengis.net/kml/2.2"><Document>
+<Folder><name>Norte</name>
+  <ExtendedData><Data name="cv_size"><value>80</value></Data></ExtendedData>
+  <Placemark><name>N1</name>
+    <ExtendedData><Data name="Height"><value>60</value></Data></ExtendedData>
+    <LineString><coordinates>-47.95,-15.80,0 -47.90,-15.78,0</coordinates></LineString>
+  </Placemark>
+  <Placemark><name>N2</name>
+    <Point><coordinates>-47.91,-15.77,0</coordinates></Point>
+  </Placemark>
+</Folder>
+<Placemark><name>Solta</name>
+  <ExtendedData><SchemaData><SimpleData name="cv-size">30</SimpleData></SchemaData></ExtendedData>
+  <LineString><coordinates>-47.80,-15.80,0 -47.75,-15.78,0</coordinates></LineString>
+</Placemark>
+<Placemark><name>Sem geometria</name></Placemark>
+</Document></kml>
+"""
+
+
+@pytest.fixture
+def missoes_kml(tmp_path):
+    """Two-mission KML: a folder of two placemarks and a loose placemark."""
+    caminho = tmp_path / 'missoes.kml'
+    caminho.write_text(MULTI_MISSAO, encoding='utf-8')
+    return str(caminho)
@@ -0,0 +1,69 @@
+"""Conservative buffer resolution and simplification (generate_safety_margins)."""
+
+import numpy as np
+import pytest
+import shapely
+from shapely.geometry import Point, LineString, Polygon
+
+from src import generate_safety_margins as gsm
+
+
+ROTA = LineString([(0, 0), (800, 0), (820, 600), (1500, 40), (900, -700)])
+AREA = Polygon([(0, 0), (1000, 0), (1000, 1000), (500, 300), (0, 1000)])
+
+
+def poligono_irregular(n=3000, raio=2000.0, semente=1, furo=True):
+    """Star-shaped ring with radial noise (concave everywhere), with a hole."""
+    rng = np.random.default_rng(semente)
+    angulos = np.linspace(0, 2 * np.pi, n, endpoint=False)
+    r = raio * (1 + 0.15 * np.sin(7 * angulos)) + rng.uniform(-20, 20, n)
+    casca = np.column_stack([r * np.cos(angulos), r * np.sin(angulos)])
+    furos = [Point(0, 0).buffer(raio / 4, quad_segs=64).exterior.coords] if furo else []
+    return Polygon(casca, furos)
+
+
+@pytest.mark.parametrize('quad_segs', [1, 2, 3, 4, 6, 8, 12, 15])
+@pytest.mark.parametrize('geometria', [Point(0, 0), ROTA, AREA], ids=['point', 'line', 'polygon'])
+@pytest.mark.parametrize('distancia', [5.0, 50.0, 7500.0])
+def test_coarse_buffer_covers_nominal(quad_segs, geometria, distancia):
+    nominal = geometria.buffer(distancia, quad_segs=gsm.QUAD_SEGS, join_style=1)
+    grosso = geometria.buffer(
+        gsm.conservative_distance(distancia, quad_segs), quad_segs=quad_segs, join_style=1
+    )
+    assert grosso.covers(nominal)
+
+
+def test_default_resolution_keeps_nominal_distance():
+    assert gsm.conservative_distance(50.0) == 50.0
+    assert gsm.conservative_distance(50.0, 4, arcs=False) == 50.0
+    assert gsm.conservative_distance(50.0, 4) > 50.0
+
+
+@pytest.mark.parametrize('quad_segs', [2, 4, 8])
+def test_coarse_layers_cover_default_layers(quad_segs):
+    entrada = gsm.gpd.GeoDataFrame(geometry=[ROTA], crs='EPSG:31983')
+    params = dict(fg_size=20, height=120, cv_size=50, adj_size=1000, corner_style='rounded', vertex_budgets={})
+    padrao = gsm.build_safety_layers(entrada, **params)
+    grossas = gsm.build_safety_layers(entrada, quad_segs=quad_segs, **params)
+    for nome in padrao.index:
+        assert grossas[nome].covers(padrao[nome]), nome
+
+
+@pytest.mark.parametrize('semente', [1, 2, 3])
+@pytest.mark.parametrize('furo', [False, True])
+def test_simplified_polygon_covers_original(semente, furo):
+    original = poligono_irregular(semente=semente, furo=furo)
+    simplificado = gsm.simplify_conservative(original, 400, 50.0)
+    assert simplificado.covers(original)
+    assert shapely.get_num_coordinates(simplificado) <= 400
+
+
+def test_simplify_keeps_small_geometries():
+    assert gsm.simplify_conservative(AREA, 100, 5.0) is AREA
+
+
+def test_unreachable_budget_still_covers():
+    original = poligono_irregular()
+    # 1 m at most cannot bring 3000 noisy vertices down to 10
+    simplificado = gsm.simplify_conservative(original, 10, 1.0)
+    assert simplificado.covers(original)
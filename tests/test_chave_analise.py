@@ -0,0 +1,38 @@
+"""Request coalescing key (population_analysis.chave_analise)."""
+
+import geopandas as gpd
+import shapely
+
+from src.population_analysis import chave_analise
+
+
+ROTA = shapely.LineString([(-47.9, -15.8, 100), (-47.8, -15.7, 120)])
+AREA = shapely.Polygon([(-47.9, -15.8), (-47.8, -15.8), (-47.8, -15.7)])
+PARAMETROS = {'fg_size': 50.0, 'height': 120.0}
+
+
+def chave(*geometrias, parametros=PARAMETROS):
+    return chave_analise(gpd.GeoSeries(list(geometrias), crs=4326), parametros)
+
+
+def test_missing_and_empty_geometries_are_ignored():
+    base = chave(ROTA, AREA)
+    assert chave(ROTA, None, AREA) == base
+    assert chave(ROTA, AREA, shapely.Polygon()) == base
+    assert chave(ROTA, AREA, shapely.LineString()) == base
+
+
+def test_only_missing_geometries():
+    assert chave(None) == chave(shapely.Point()) == chave()
+
+
+def test_feature_order_and_orientation_do_not_matter():
+    invertida = shapely.Polygon(AREA.exterior.coords[::-1])
+    assert chave(ROTA, AREA) == chave(invertida, ROTA)
+
+
+def test_heights_and_parameters_change_the_key():
+    base = chave(ROTA)
+    mais_alta = shapely.LineString([(-47.9, -15.8, 150), (-47.8, -15.7, 120)])
+    assert chave(mais_alta) != base
+    assert chave(ROTA, parametros={**PARAMETROS, 'height': 90.0}) != base
@@ -0,0 +1,95 @@
+"""Memory-mapped grid quadrants (src.grid_store)."""
+
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+import shapely
+
+from benchmarks._synthetic import quadrante_urbano
+from src import grid_store
+from src.population_analysis import ALBERS_BR
+
+
+@pytest.fixture(scope='module')
+def grade():
+    grid = quadrante_urbano(lado_km=4).to_crs(ALBERS_BR)
+    grid['SITUACAO'] = np.where(np.arange(len(grid)) % 3, 'urbano', 'rural')
+    return grid
+
+
+@pytest.fixture
+def quadrante(grade, tmp_path):
+    pasta = str(tmp_path / 'celulas')
+    grid_store.exportar_quadrante(grade, pasta)
+    return grid_store.abrir_quadrante(pasta)
+
+
+def areas(grade):
+    minx, miny, maxx, maxy = grade.total_bounds
+    cx, cy = (minx + maxx) / 2, (miny + maxy) / 2
+    return {
+        'circle': shapely.Point(cx, cy).buffer(900),
+        'diagonal': shapely.LineString([(minx - 50, miny + 130), (maxx - 170, maxy + 40)]).buffer(60),
+        'edge': shapely.box(minx - 500, miny - 500, minx + 1, maxy),
+        'outside': shapely.box(maxx + 100, maxy + 100, maxx + 900, maxy + 900),
+    }
+
+
+@pytest.mark.parametrize('nome', ['circle', 'diagonal', 'edge', 'outside'])
+def test_same_cells_as_strtree_query(grade, quadrante, nome):
+    area = areas(grade)[nome]
+    shapely.prepare(area)
+    posicoes = np.sort(grade.sindex.query(area, predicate='intersects'))
+    esperado = grade.iloc[posicoes]
+
+    celulas = grid_store.selecionar_celulas(quadrante, area)
+
+    assert list(celulas.columns) == list(grade.columns)
+    assert celulas.crs == grade.crs
+    np.testing.assert_array_equal(celulas.index, posicoes)
+    assert list(celulas['ID_UNICO']) == list(esperado['ID_UNICO'])
+    assert list(celulas['SITUACAO']) == list(esperado['SITUACAO'])
+    np.testing.assert_array_equal(celulas['TOTAL'].to_numpy(), esperado['TOTAL'].to_numpy())
+    assert shapely.equals(celulas.geometry.values, esperado.geometry.values).all()
+
+
+def test_changed_source_invalidates_the_export(grade, tmp_path):
+    origem = tmp_path / 'BR200M.shp'
+    origem.write_bytes(b'shapefile')
+    pasta = str(tmp_path / 'celulas')
+    grid_store.exportar_quadrante(grade, pasta, origem=str(origem))
+    assert grid_store.abrir_quadrante(pasta, origem=str(origem)) is not None
+
+    info = os.stat(origem)
+    os.utime(origem, (info.st_atime, info.st_mtime + 10))
+    assert grid_store.abrir_quadrante(pasta, origem=str(origem)) is None
+
+    grid_store.exportar_quadrante(grade, pasta, origem=str(origem))
+    origem.write_bytes(b'shapefile, newer')
+    os.utime(origem, (info.st_atime, info.st_mtime + 10))
+    assert grid_store.abrir_quadrante(pasta, origem=str(origem)) is None
+
+
+def test_older_layout_is_treated_as_missing(grade, tmp_path, monkeypatch):
+    pasta = str(tmp_path / 'celulas')
+    grid_store.exportar_quadrante(grade, pasta)
+    monkeypatch.setattr(grid_store, 'VERSAO', grid_store.VERSAO + 1)
+    assert grid_store.abrir_quadrante(pasta) is None
+
+
+def test_text_nulls_round_trip(grade, tmp_path):
+    grid = grade.copy()
+    grid.loc[grid.index[:2], 'SITUACAO'] = None
+    grid.loc[grid.index[2], 'SITUACAO'] = np.nan
+    grid.loc[grid.index[3], 'SITUACAO'] = 'None'
+    pasta = str(tmp_path / 'celulas')
+    grid_store.exportar_quadrante(grid, pasta)
+
+    celulas = grid_store.selecionar_celulas(grid_store.abrir_quadrante(pasta), shapely.box(*grid.total_bounds))
+
+    situacao = celulas['SITUACAO'].sort_index()
+    assert pd.isna(situacao.iloc[:3]).all()
+    assert situacao.iloc[3] == 'None'
+    assert situacao.iloc[4:].isin(['urbano', 'rural']).all()
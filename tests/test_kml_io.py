@@ -0,0 +1,78 @@
+"""KML/KMZ writer and mission reader (src.kml_io)."""
+
+import numpy as np
+import shapely
+from shapely import affinity
+from shapely.geometry import Polygon, MultiPolygon
+
+from src.kml_io import write_kml, read_missions
+
+
+# COORD_FORMAT writes 7 decimals
+PRECISAO = 1e-7
+
+EXTERIOR = [(-47.95, -15.80), (-47.85, -15.80), (-47.85, -15.70), (-47.95, -15.70)]
+FUROS = [
+    [(-47.93, -15.78), (-47.91, -15.78), (-47.91, -15.76), (-47.93, -15.76)],
+    [(-47.89, -15.74), (-47.87, -15.74), (-47.87, -15.72), (-47.89, -15.72)],
+]
+ESTILO = {'fill': '3300ff00', 'outline': 'ff00ff00', 'width': 2}
+
+
+def iguais(a, b):
+    return a.geom_type == b.geom_type and shapely.equals_exact(
+        shapely.normalize(a), shapely.normalize(b), tolerance=PRECISAO
+    )
+
+
+def ida_e_volta(tmp_path, extensao, geometria):
+    caminho = write_kml(
+        str(tmp_path / f"saida.{extensao}"),
+        {'Safety Margins': {'Ground Risk Buffer': geometria}},
+        styles={'Ground Risk Buffer': ESTILO}
+    )
+    return [g for m in read_missions(caminho) for g in m['geometries']]
+
+
+def test_polygon_with_holes_round_trip(tmp_path):
+    poligono = Polygon(EXTERIOR, FUROS)
+    for extensao in ('kml', 'kmz'):
+        lidas = ida_e_volta(tmp_path, extensao, poligono)
+        assert len(lidas) == 1
+        assert len(lidas[0].interiors) == 2
+        assert iguais(lidas[0], poligono)
+
+
+def test_coordinates_keep_seven_decimals(tmp_path):
+    deslocado = affinity.translate(Polygon(EXTERIOR, FUROS[:1]), 1.23456789e-5, -9.8765432e-6)
+    lido, = ida_e_volta(tmp_path, 'kml', deslocado)
+    erro = np.abs(shapely.get_coordinates(lido) - shapely.get_coordinates(deslocado)).max()
+    assert erro <= PRECISAO / 2 + 1e-12
+
+
+def test_multipolygon_written_as_one_placemark_per_part(tmp_path):
+    partes = MultiPolygon([Polygon(EXTERIOR, FUROS), Polygon(FUROS[0])])
+    lidas = ida_e_volta(tmp_path, 'kmz', partes)
+    assert len(lidas) == 2
+    assert iguais(MultiPolygon(lidas), partes)
+
+
+def test_empty_layer_is_skipped(tmp_path):
+    assert ida_e_volta(tmp_path, 'kml', Polygon()) == []
+
+
+def test_placemark_grouping(missoes_kml):
+    missoes = read_missions(missoes_kml, group_by='placemark')
+    assert [m['name'] for m in missoes] == ['N1', 'N2', 'Solta']
+    assert missoes[0]['params'] == {'Height': '60'}
+    assert missoes[2]['params'] == {'cv-size': '30'}
+    assert [len(m['geometries']) for m in missoes] == [1, 1, 1]
+
+
+def test_folder_grouping(missoes_kml):
+    missoes = read_missions(missoes_kml, group_by='folder')
+    assert [m['name'] for m in missoes] == ['Norte', 'Solta']
+    norte = missoes[0]
+    assert [g.geom_type for g in norte['geometries']] == ['LineString', 'Point']
+    # Placemark values, then the folder's own over them
+    assert norte['params'] == {'Height': '60', 'cv_size': '80'}
@@ -0,0 +1,42 @@
+"""Per-mission ExtendedData parameters (generate_safety_margins)."""
+
+import pytest
+
+from src import generate_safety_margins as gsm
+
+
+PADRAO = {'fg_size': 0, 'height': 100, 'cv_size': 50, 'adj_size': 7500,
+          'corner_style': 'square', 'variable_height': False}
+
+
+def test_keys_are_normalised_and_parsed():
+    params = gsm.mission_parameters(
+        {'Height': ' 60 ', 'cv-size': '30', 'Corner Style': 'Rounded', 'pilot': 'Ana'}, PADRAO
+    )
+    assert params == {**PADRAO, 'height': 60.0, 'cv_size': 30.0, 'corner_style': 'rounded'}
+
+
+def test_blank_values_keep_the_defaults():
+    assert gsm.mission_parameters({'height': '  ', 'cv_size': None}, PADRAO) == PADRAO
+
+
+@pytest.mark.parametrize('chave, valor', [
+    ('height', 'abc'),
+    ('height', '-10'),
+    ('cv_size', 'nan'),
+    ('adj_size', 'inf'),
+    ('corner_style', 'bevel'),
+])
+def test_invalid_values_name_the_key(chave, valor):
+    with pytest.raises(ValueError, match=f"invalid {chave}"):
+        gsm.mission_parameters({chave: valor}, PADRAO)
+
+
+def test_invalid_mission_is_skipped(missoes_kml):
+    caminho = missoes_kml
+    texto = open(caminho, encoding='utf-8').read().replace('<value>60</value>', '<value>alto</value>')
+    with open(caminho, 'w', encoding='utf-8') as f:
+        f.write(texto)
+    camadas = gsm.generate_mission_margins(caminho, max_workers=1, adj_size=500)
+    assert list(camadas) == ['N2', 'Solta']
+    assert list(camadas['Solta'].index) == list(gsm.STYLES)
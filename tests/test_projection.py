@@ -0,0 +1,104 @@
+"""Metric CRS choice and cached transforms (src.projection)."""
+
+import geopandas as gpd
+import numpy as np
+import pyproj
+import pytest
+import shapely
+from shapely.geometry import LineString, Polygon
+
+from src import projection
+
+
+@pytest.mark.parametrize('zona', range(17, 26))
+def test_sirgas_south_zones(zona):
+    lon = -180 + (zona - 0.5) * 6
+    codigo = projection.utm_epsg(lon, -10)
+    assert pyproj.CRS.from_epsg(codigo).name == f"SIRGAS 2000 / UTM zone {zona}S"
+
+
+@pytest.mark.parametrize('zona', range(17, 23))
+def test_sirgas_north_zones(zona):
+    lon = -180 + (zona - 0.5) * 6
+    codigo = projection.utm_epsg(lon, 2)
+    assert pyproj.CRS.from_epsg(codigo).name == f"SIRGAS 2000 / UTM zone {zona}N"
+
+
+@pytest.mark.parametrize('lon, lat, codigo', [
+    (-47.93, -15.78, 31983),     # Brasília, 23S
+    (-73.99, -7.5, 31978),       # Western Acre, 18S
+    (-72.0, -7.5, 31979),        # 18S/19S boundary belongs to 19S
+    (-72.0001, -7.5, 31978),
+    (-34.9, -7.1, 31985),        # João Pessoa, 25S
+    (-30.0001, -3.85, 31985),    # Last longitude of 25S
+    (-60.67, 2.82, 31974),       # Boa Vista, 20N
+    (-50.0, 0.0, 31976),         # Equator counts as north
+    (-50.0, -1e-9, 31982),
+])
+def test_brazil_zone_boundaries(lon, lat, codigo):
+    assert projection.utm_epsg(lon, lat) == codigo
+
+
+@pytest.mark.parametrize('lon, lat, codigo', [
+    (-30.0, -10.0, 32726),       # East of zone 25: WGS 84
+    (2.35, 48.85, 32631),        # Paris
+    (151.2, -33.87, 32756),      # Sydney
+    (180.0, 10.0, 32660),        # Antimeridian stays in zone 60
+])
+def test_wgs84_zones_elsewhere(lon, lat, codigo):
+    assert projection.utm_epsg(lon, lat) == codigo
+
+
+def test_mission_crs_choice():
+    assert projection.escolher_crs_metrico((-48.0, -16.0, -47.5, -15.5)) == 'EPSG:31983'
+    # Wider than UTM_MAX_SPAN: azimuthal equidistant on the centre
+    largo = projection.escolher_crs_metrico((-50.0, -16.0, -43.0, -15.0))
+    assert largo.startswith('+proj=aeqd') and '+lat_0=-15.50' in largo and '+lon_0=-46.50' in largo
+    assert pyproj.CRS(largo).is_projected
+    assert projection.escolher_crs_metrico((-48.0, -16.0, -47.5, -15.5), 'aeqd').startswith('+proj=aeqd')
+    assert projection.escolher_crs_metrico((-48.0, -16.0, -47.5, -15.5), 'EPSG:5880') == 'EPSG:5880'
+
+
+GEOMETRIAS = [
+    LineString([(-47.95, -15.80, 100), (-47.90, -15.78, 120), (-47.85, -15.79, 80)]),
+    Polygon([(-47.95, -15.80), (-47.85, -15.80), (-47.85, -15.70)],
+            [[(-47.87, -15.79), (-47.86, -15.79), (-47.86, -15.78)]]),
+]
+
+
+def sem_cache(geom, origem, destino):
+    transformer = pyproj.Transformer.from_crs(origem, destino, always_xy=True)
+    coords = shapely.get_coordinates(geom, include_z=True)
+    x, y = transformer.transform(coords[:, 0], coords[:, 1])
+    return np.column_stack([x, y, coords[:, 2]])
+
+
+@pytest.mark.parametrize('destino', ['EPSG:31983', 'EPSG:3857', 'EPSG:5880'])
+def test_cached_transform_matches_uncached(destino):
+    projection.get_transformer.cache_clear()
+    for vez in range(2):
+        saida = projection.transformar(np.array(GEOMETRIAS, dtype=object), 'EPSG:4326', destino)
+        for geom, transformada in zip(GEOMETRIAS, saida):
+            np.testing.assert_allclose(
+                shapely.get_coordinates(transformada, include_z=True),
+                sem_cache(geom, 'EPSG:4326', destino), rtol=0, atol=1e-6
+            )
+            assert shapely.has_z(transformada) == shapely.has_z(geom)
+    assert projection.get_transformer.cache_info().hits >= 1
+
+
+def test_para_crs_matches_geopandas():
+    serie = gpd.GeoSeries(GEOMETRIAS, crs='EPSG:4326', index=['rota', 'area'])
+    for vez in range(2):
+        metrica = projection.para_crs(serie, 'EPSG:31983')
+        esperada = serie.to_crs('EPSG:31983')
+        assert list(metrica.index) == ['rota', 'area']
+        assert metrica.crs == esperada.crs
+        assert metrica.geom_equals_exact(esperada, tolerance=1e-6).all()
+
+
+def test_para_wgs84_is_memoised():
+    metrica = projection.para_crs(gpd.GeoSeries(GEOMETRIAS, crs='EPSG:4326'), 'EPSG:31983')
+    primeira = projection.para_wgs84(metrica)
+    assert projection.para_wgs84(metrica) is primeira
+    assert primeira.geom_equals_exact(metrica.to_crs('EPSG:4326'), tolerance=1e-9).all()
@@ -0,0 +1,121 @@
+"""Result store quotas and eviction (src.results_store)."""
+
+import os
+import time
+from collections import OrderedDict
+
+import pytest
+
+from src import results_store as rs
+
+
+@pytest.fixture(autouse=True)
+def loja(tmp_path, monkeypatch):
+    """Empty store in a temporary folder, without the janitor thread."""
+    monkeypatch.setattr(rs, 'RESULTS_DIR', str(tmp_path))
+    monkeypatch.setattr(rs, '_RESULTADOS', OrderedDict())
+    monkeypatch.setattr(rs, '_JANITOR', object())
+    monkeypatch.setattr(rs, 'TTL_S', 100.0)
+    monkeypatch.setattr(rs, 'MAX_MB', 1.0)
+    monkeypatch.setattr(rs, 'POR_SESSAO', 2)
+    return tmp_path
+
+
+def resultado(sessao, mb=0.0):
+    """A finished (unpinned) result of `mb` MB."""
+    resultado_id, pasta = rs.criar_resultado(sessao)
+    with open(os.path.join(pasta, 'dados.bin'), 'wb') as f:
+        f.write(b'\0' * int(mb * 1e6))
+    rs.liberar_resultado(resultado_id)
+    return resultado_id
+
+
+def guardados():
+    return list(rs._RESULTADOS)
+
+
+def test_session_quota_keeps_the_latest_results():
+    a, b = resultado('s1'), resultado('s1')
+    outra = resultado('s2')
+    c = resultado('s1')
+    assert guardados() == [b, outra, c]
+    assert not os.path.exists(os.path.join(rs.RESULTS_DIR, a))
+
+
+def test_session_quota_skips_pinned_results():
+    em_curso, _ = rs.criar_resultado('s1')
+    resultado('s1'), resultado('s1')
+    assert em_curso in guardados()
+    assert len(guardados()) == 3
+
+
+def test_shared_result_stays_while_another_session_keeps_it():
+    comum = resultado('s1')
+    assert rs.compartilhar_resultado(comum, 's2')
+    resultado('s1'), resultado('s1')
+    assert comum in guardados()
+    assert rs._RESULTADOS[comum]['sessions'] == {'s2'}
+
+    resultado('s2'), resultado('s2')
+    assert comum not in guardados()
+
+
+def test_share_unknown_result():
+    assert not rs.compartilhar_resultado('desconhecido', 's1')
+
+
+def test_ttl_expiry():
+    velho = resultado('s1')
+    agora = time.time()
+    rs._RESULTADOS[velho]['accessed'] = agora - 150
+    novo = resultado('s2')
+
+    assert rs.limpar_resultados(agora=agora) == 1
+    assert guardados() == [novo]
+    assert not rs.existe_resultado(velho)
+
+
+def test_store_quota_evicts_least_recently_used():
+    a, b, c = resultado('s1', 0.4), resultado('s2', 0.4), resultado('s3', 0.4)
+    # Reading `a` makes `b` the least recently used
+    assert rs.existe_resultado(a)
+
+    assert rs.limpar_resultados() == 1
+    assert guardados() == [c, a]
+    assert rs.relatorio_resultados()['size_mb'] == pytest.approx(0.8)
+
+
+def test_pinned_results_are_never_evicted():
+    em_curso, pasta = rs.criar_resultado('s1')
+    with open(os.path.join(pasta, 'dados.bin'), 'wb') as f:
+        f.write(b'\0' * 2_000_000)
+    rs._RESULTADOS[em_curso]['size'] = 2_000_000
+    rs._RESULTADOS[em_curso]['accessed'] = 0
+
+    assert rs.limpar_resultados(agora=time.time()) == 0
+    assert guardados() == [em_curso]
+    rs.liberar_resultado(em_curso)
+    assert rs.limpar_resultados() == 1
+
+
+def test_file_being_generated_protects_its_result():
+    alvo = resultado('s1', 2.0)
+    removidos = []
+
+    def gerar(caminho):
+        removidos.append(rs.limpar_resultados(agora=time.time() + 1000))
+        with open(caminho, 'w') as f:
+            f.write('ok')
+
+    caminho = rs.arquivo_resultado(alvo, 'gerado.txt', gerar=gerar)
+    assert removidos == [0]
+    assert open(caminho).read() == 'ok'
+    assert rs._RESULTADOS[alvo]['readers'] == 0
+    assert rs.limpar_resultados() == 1
+
+
+def test_evicted_result_raises_key_error():
+    alvo = resultado('s1')
+    rs.remover_resultado(alvo)
+    with pytest.raises(KeyError):
+        rs.arquivo_resultado(alvo, 'dados.bin')
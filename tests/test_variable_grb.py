@@ -0,0 +1,91 @@
+"""Per-waypoint Ground Risk Buffer (generate_safety_margins)."""
+
+import geopandas as gpd
+import numpy as np
+import pytest
+import shapely
+from shapely.geometry import LineString, Point
+
+from src import generate_safety_margins as gsm
+
+
+CRS = 'EPSG:31983'
+FG, CV = 10.0, 50.0
+# Long legs so each segment's middle is far from the others
+WAYPOINTS = [(0, 0, 30), (3000, 0, 30), (3000, 3000, 300), (6000, 3000, 120), (6000, 6000, 60)]
+
+
+def grb(waypoints, corner_style='square', quad_segs=gsm.QUAD_SEGS):
+    entrada = gpd.GeoSeries([LineString(waypoints)], crs=CRS)
+    return gsm.variable_grb_buffer(entrada, FG + CV, 100, corner_style, quad_segs)
+
+
+def larguras(waypoints):
+    z = np.array([p[2] for p in waypoints], dtype=float)
+    return gsm.calculate_grb_size(np.maximum(z[:-1], z[1:])) + FG + CV
+
+
+@pytest.mark.parametrize('corner_style', gsm.CORNER_STYLES)
+@pytest.mark.parametrize('altura', [40, 120, 300])
+def test_constant_height_matches_fixed_grb(corner_style, altura):
+    rota = [(x, y, altura) for x, y, _ in WAYPOINTS]
+    entrada = gpd.GeoDataFrame(geometry=[LineString(rota)], crs=CRS)
+    params = dict(fg_size=FG, height=altura, cv_size=CV, adj_size=500,
+                  corner_style=corner_style, vertex_budgets={})
+    fixa = gsm.build_safety_layers(entrada, **params)['Ground Risk Buffer']
+    variavel = gsm.build_safety_layers(entrada, variable_height=True, **params)['Ground Risk Buffer']
+    assert variavel.symmetric_difference(fixa).area < 1e-6 * fixa.area
+
+
+@pytest.mark.parametrize('corner_style', gsm.CORNER_STYLES)
+@pytest.mark.parametrize('quad_segs', [4, gsm.QUAD_SEGS])
+def test_each_segment_gets_at_least_its_own_grb(corner_style, quad_segs):
+    # Nominal width at the default resolution (see QUAD_SEGS)
+    buffer = grb(WAYPOINTS, corner_style, quad_segs).buffer(1e-6)
+    for (a, b), largura in zip(zip(WAYPOINTS[:-1], WAYPOINTS[1:]), larguras(WAYPOINTS)):
+        segmento = LineString([a[:2], b[:2]])
+        assert buffer.covers(segmento.buffer(largura, quad_segs=gsm.QUAD_SEGS))
+
+
+def test_widths_follow_the_waypoint_heights():
+    buffer = grb(WAYPOINTS)
+    largura = larguras(WAYPOINTS)
+    # Middle of each leg, just outside its own width: not covered, so a low
+    # leg is not widened to the GRB of the highest waypoint
+    for (a, b), w in zip(zip(WAYPOINTS[:-1], WAYPOINTS[1:]), largura):
+        meio = np.add(a[:2], b[:2]) / 2
+        direcao = np.subtract(b[:2], a[:2]) / np.hypot(*np.subtract(b[:2], a[:2]))
+        normal = np.array([-direcao[1], direcao[0]])
+        assert buffer.covers(Point(meio + normal * (w - 1)))
+        assert not buffer.covers(Point(meio + normal * (w + 1)))
+    assert largura.min() < largura.max() - 100
+
+
+def test_negative_heights_count_as_ground_level():
+    assert gsm.calculate_grb_size(-20) == 0
+    assert list(gsm.calculate_grb_size(np.array([-20.0, 50.0]))) == [0, 50]
+
+
+@pytest.mark.parametrize('modos', [set(), {'relativeToGround'}, {'clampToGround', 'relativeToGround'}])
+def test_relative_altitudes_accepted(modos):
+    gsm.check_altitude_modes(modos)
+
+
+@pytest.mark.parametrize('modos', [{'absolute'}, {'absolute', 'relativeToGround'}])
+def test_absolute_altitudes_rejected(modos):
+    with pytest.raises(ValueError, match='absolute'):
+        gsm.check_altitude_modes(modos)
+
+
+def test_variable_height_rejects_absolute_kml(tmp_path):
+    caminho = tmp_path / 'absoluta.kml'
+    caminho.write_text(
+        '<?xml version="1.0"?><kml xmlns="http://www.opengis.net/kml/2.2"><Document><Placemark>'
+        '<LineString><altitudeMode>absolute</altitudeMode>'
+        '<coordinates>-47.95,-15.80,1100 -47.90,-15.78,1150</coordinates></LineString>'
+        '</Placemark></Document></kml>', encoding='utf-8'
+    )
+    with pytest.raises(ValueError, match='absolute'):
+        gsm.generate_safety_margins(str(caminho), return_layers=True, variable_height=True)
+    # Fixed height ignores Z, so the file is accepted
+    assert 'Ground Risk Buffer' in gsm.generate_safety_margins(str(caminho), return_layers=True).index